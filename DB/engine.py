@@ -75,5 +75,5 @@ def get_async_session():
     return AsyncSession(async_engine, expire_on_commit=False)
 
 
-def get_uri_for_polars():
-    return get_url(polars=True).render_as_string(hide_password=False)
+def get_uri_for_polars(readonly: bool = True):
+    return get_url(polars=True, readonly=readonly).render_as_string(hide_password=False)
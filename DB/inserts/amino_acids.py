@@ -1,9 +1,20 @@
+import polars as pl
 from sqlalchemy import and_, select
+from sqlalchemy.sql.expression import text
 
 from DB.engine import get_async_session
 from DB.models import AminoAcid
+from utils.constants import ColumnNames, TableNames
 from utils.errors import NotFoundError
 
+# the fields that identify an amino acid substitution regardless of codon
+AMINO_ACID_KEY_COLUMNS = [
+    ColumnNames.gff_feature,
+    ColumnNames.position_aa,
+    ColumnNames.ref_aa,
+    ColumnNames.alt_aa
+]
+
 
 async def find_equivalent_amino_acids(aa: AminoAcid) -> set[int]:
     if None in {aa.alt_aa, aa.ref_aa, aa.position_aa, aa.gff_feature}:
@@ -25,3 +36,47 @@ async def find_equivalent_amino_acids(aa: AminoAcid) -> set[int]:
     if len(ids) == 0:
         raise NotFoundError('No amino acids found')
     return ids
+
+
+async def find_equivalent_amino_acids_as_pl_df(amino_acids: pl.DataFrame) -> pl.DataFrame:
+    """
+    Bulk version of find_equivalent_amino_acids, resolved in a single query.
+    :param amino_acids: gff_feature, position_aa, ref_aa, alt_aa
+    :return: gff_feature, position_aa, ref_aa, alt_aa, amino_acid_id, with one row per matching amino acid.
+    Inputs with no match are left out.
+    """
+    keys = amino_acids.select(AMINO_ACID_KEY_COLUMNS).unique()
+    async with get_async_session() as session:
+        res = await session.execute(
+            text(
+                f'select {", ".join(f"t.{cn}" for cn in AMINO_ACID_KEY_COLUMNS)}, aa.id\n'
+                f'from unnest(\n'
+                f'cast(:gff_features as text[]),\n'
+                f'cast(:positions as integer[]),\n'
+                f'cast(:refs as text[]),\n'
+                f'cast(:alts as text[])\n'
+                f') as t({", ".join(AMINO_ACID_KEY_COLUMNS)})\n'
+                f'inner join {TableNames.amino_acids} aa\n'
+                f'on aa.{ColumnNames.gff_feature} = t.{ColumnNames.gff_feature}\n'
+                f'and aa.{ColumnNames.position_aa} = t.{ColumnNames.position_aa}\n'
+                f'and aa.{ColumnNames.ref_aa} = t.{ColumnNames.ref_aa}\n'
+                f'and aa.{ColumnNames.alt_aa} = t.{ColumnNames.alt_aa};'
+            ),
+            {
+                'gff_features': keys.get_column(ColumnNames.gff_feature).to_list(),
+                'positions': keys.get_column(ColumnNames.position_aa).to_list(),
+                'refs': keys.get_column(ColumnNames.ref_aa).to_list(),
+                'alts': keys.get_column(ColumnNames.alt_aa).to_list(),
+            }
+        )
+    return pl.DataFrame(
+        res.all(),
+        schema={
+            ColumnNames.gff_feature: pl.String,
+            ColumnNames.position_aa: pl.Int64,
+            ColumnNames.ref_aa: pl.String,
+            ColumnNames.alt_aa: pl.String,
+            ColumnNames.amino_acid_id: pl.Int64,
+        },
+        orient='row'
+    )
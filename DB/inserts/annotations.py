@@ -1,10 +1,18 @@
 from typing import Set
 
+import polars as pl
+from sqlalchemy.sql.expression import text
+
 from DB.engine import get_async_write_session
 from DB.models import Annotation, AnnotationAminoAcid
 from DB.queries.amino_acids import get_aa_ids_for_annotation_effect
+from utils.constants import ColumnNames, TableNames
 from utils.errors import DuplicateAnnotationError
 
+AMINO_ACID_IDS = 'amino_acid_ids'
+PAPER_IDS = 'paper_ids'
+AMINO_ACID_SET_KEY = 'amino_acid_set_key'
+
 
 async def insert_annotation(a: Annotation, amino_acid_ids: Set[int]) -> int:
     # make sure we aren't making a duplicate
@@ -24,4 +32,95 @@ async def insert_annotation(a: Annotation, amino_acid_ids: Set[int]) -> int:
         ]
         session.add_all(amino_acids)
         await session.commit()
-    return a.id
\ No newline at end of file
+    return a.id
+
+
+async def batch_insert_annotations(annotations: pl.DataFrame) -> (int, int):
+    """
+    Bulk version of insert_annotation, which also links the new annotations to their papers.
+    Ids for the new annotations are allocated up front so that all three tables can be loaded with COPY.
+    An annotation is a duplicate if it has the same effect and the same set of amino acids as an existing annotation,
+    or as one earlier in the input. Duplicates are skipped.
+    :param annotations: effect_id, amino_acid_ids <list[int]>, paper_ids <list[int]>
+    :return: (int: count of annotations inserted, int: count of duplicates skipped)
+    """
+
+    def with_amino_acid_set_key(df: pl.DataFrame) -> pl.DataFrame:
+        return df.with_columns(
+            pl.col(AMINO_ACID_IDS)
+            .list.unique()
+            .list.sort()
+            .list.eval(pl.element().cast(pl.String))
+            .list.join(',')
+            .alias(AMINO_ACID_SET_KEY)
+        )
+
+    async with get_async_write_session() as session:
+        res = await session.execute(text(
+            f'select a.{ColumnNames.effect_id}, array_agg(aaa.{ColumnNames.amino_acid_id})\n'
+            f'from {TableNames.annotations} a\n'
+            f'inner join {TableNames.annotations_amino_acids} aaa on aaa.{ColumnNames.annotation_id} = a.id\n'
+            f'group by a.id, a.{ColumnNames.effect_id};'
+        ))
+        existing = pl.DataFrame(
+            res.all(),
+            schema={ColumnNames.effect_id: pl.Int64, AMINO_ACID_IDS: pl.List(pl.Int64)},
+            orient='row'
+        )
+
+        new_annotations = (
+            with_amino_acid_set_key(annotations)
+            .unique(subset=[ColumnNames.effect_id, AMINO_ACID_SET_KEY], keep='first', maintain_order=True)
+            .join(
+                with_amino_acid_set_key(existing),
+                on=[ColumnNames.effect_id, AMINO_ACID_SET_KEY],
+                how='anti'
+            )
+        )
+
+        if new_annotations.height > 0:
+            res = await session.execute(
+                text(
+                    f"select nextval(pg_get_serial_sequence('{TableNames.annotations}', 'id'))\n"
+                    f"from generate_series(1, :n);"
+                ),
+                {'n': new_annotations.height}
+            )
+            new_annotations = new_annotations.with_columns(
+                pl.Series(ColumnNames.annotation_id, [r[0] for r in res.all()], dtype=pl.Int64)
+            )
+
+            connection = await session.connection()
+            raw_connection = (await connection.get_raw_connection()).driver_connection
+            await raw_connection.copy_records_to_table(
+                TableNames.annotations,
+                records=new_annotations.select(ColumnNames.annotation_id, ColumnNames.effect_id).iter_rows(),
+                columns=['id', ColumnNames.effect_id]
+            )
+            await raw_connection.copy_records_to_table(
+                TableNames.annotations_amino_acids,
+                records=(
+                    new_annotations
+                    .select(pl.col(AMINO_ACID_IDS).alias(ColumnNames.amino_acid_id), ColumnNames.annotation_id)
+                    .explode(ColumnNames.amino_acid_id)
+                    .drop_nulls()
+                    .unique()
+                    .iter_rows()
+                ),
+                columns=[ColumnNames.amino_acid_id, ColumnNames.annotation_id]
+            )
+            await raw_connection.copy_records_to_table(
+                TableNames.annotations_papers,
+                records=(
+                    new_annotations
+                    .select(pl.col(PAPER_IDS).alias(ColumnNames.paper_id), ColumnNames.annotation_id)
+                    .explode(ColumnNames.paper_id)
+                    .drop_nulls()
+                    .unique()
+                    .iter_rows()
+                ),
+                columns=[ColumnNames.paper_id, ColumnNames.annotation_id]
+            )
+        await session.commit()
+
+    return new_annotations.height, annotations.height - new_annotations.height
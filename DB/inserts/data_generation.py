@@ -0,0 +1,23 @@
+from sqlalchemy.sql.expression import text
+
+from DB.engine import get_async_write_session
+from utils.constants import TableNames, ColumnNames
+
+
+async def bump_data_generation(source: str) -> int:
+    """
+    Record that the data served by the API has changed, so that cached responses are no longer used.
+    :param source: what changed the data, e.g. the name of the format ingested
+    :return: the new data generation
+    """
+    async with get_async_write_session() as session:
+        generation = await session.scalar(
+            text(
+                f'insert into {TableNames.data_generation} ({ColumnNames.source})\n'
+                f'values (:source)\n'
+                f'returning id;'
+            ),
+            {'source': source}
+        )
+        await session.commit()
+    return generation
@@ -1,7 +1,10 @@
+import polars as pl
 from sqlalchemy import select, and_
+from sqlalchemy.sql.expression import text
 
 from DB.engine import get_async_write_session
 from DB.models import Effect
+from utils.constants import ColumnNames, ConstraintNames, TableNames
 
 
 async def find_or_insert_effect(e: Effect) -> int:
@@ -20,3 +23,35 @@ async def find_or_insert_effect(e: Effect) -> int:
             await session.refresh(e)
             id_ = e.id
     return id_
+
+
+async def find_or_insert_effects(details: pl.Series) -> pl.DataFrame:
+    """
+    Bulk version of find_or_insert_effect.
+    :param details: effect details, may contain repeats
+    :return: detail, effect_id for each distinct detail
+    """
+    params = {'details': details.unique().to_list()}
+    async with get_async_write_session() as session:
+        await session.execute(
+            text(
+                f'insert into {TableNames.effects} ({ColumnNames.detail})\n'
+                f'select unnest(cast(:details as text[]))\n'
+                f'on conflict on constraint {ConstraintNames.uq_effects_detail} do nothing;'
+            ),
+            params
+        )
+        res = await session.execute(
+            text(
+                f'select {ColumnNames.detail}, id from {TableNames.effects}\n'
+                f'where {ColumnNames.detail} = any(cast(:details as text[]));'
+            ),
+            params
+        )
+        effects = pl.DataFrame(
+            res.all(),
+            schema={ColumnNames.detail: pl.String, ColumnNames.effect_id: pl.Int64},
+            orient='row'
+        )
+        await session.commit()
+    return effects
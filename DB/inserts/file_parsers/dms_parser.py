@@ -1,15 +1,17 @@
 from csv import DictReader
 from typing import Set, Dict
 
+import polars as pl
+
 from DB.inserts.file_parsers.file_parser import FileParser
-from DB.inserts.phenotype_measurement_results import insert_pheno_measurement_result
+from DB.inserts.phenotype_measurement_results import copy_upsert_pheno_measurement_results
+from DB.inserts.amino_acids import AMINO_ACID_KEY_COLUMNS
 from DB.inserts.phenotype_metrics import find_or_insert_metric
-from DB.models import AminoAcid, PhenotypeMetric, PhenotypeMetricValues
-from DB.inserts.amino_acids import find_equivalent_amino_acids
+from DB.models import PhenotypeMetric
 from utils.constants import PhenotypeMetricAssayTypes, DefaultGffFeaturesByRegion, ColumnNames, \
     StandardPhenoMetricNames
-from utils.csv_helpers import get_value, clean_up_gff_feature
-from utils.errors import NotFoundError
+from utils.csv_helpers import clean_up_gff_feature
+from utils.input_files import open_input_text, get_polars_source
 
 
 class DmsFileParser(FileParser):
@@ -21,92 +23,77 @@ class DmsFileParser(FileParser):
 
     async def parse_and_insert(self):
         debug_info = {
-            'skipped_aas_data_missing': 0,
+            'skipped_aas_info_missing': 0,
             'skipped_aas_not_found': 0,
             'value_parsing_errors': 0,
             'count_existing_updated': 0,  # only counts if the value changed
             'count_new_records_inserted': 0
         }
-        # format: metric_name -> id
-        cache_metric_ids = dict()
-        # format: (position_aa, ref_aa, alt_aa) -> {amino acid ids} set
-        cache_amino_sub_ids = dict()
-        # format: (position_aa, ref_aa, alt_aa)
-        cache_amino_subs_not_found = set()
-        with open(self.filename, 'r') as f:
+        with open_input_text(self.filename) as f:
             reader = DictReader(f, delimiter=self.delimiter)
             self._verify_header(reader)
             present_data_cols = self._get_present_data_columns(reader)
 
-            for row in reader:
-                try:
-                    position_aa = get_value(
-                        row,
-                        self.required_column_name_map[ColumnNames.position_aa],
-                        transform=int
-                    )
-                    ref_aa = get_value(row, self.required_column_name_map[ColumnNames.ref_aa])
-                    alt_aa = get_value(row, self.required_column_name_map[ColumnNames.alt_aa])
-                except ValueError:
-                    debug_info['skipped_aas_info_missing'] += 1
-                    continue
-
-                if (position_aa, ref_aa, alt_aa) in cache_amino_subs_not_found:
-                    debug_info['skipped_aas_not_found'] += 1
-                    continue
-                try:
-                    amino_acid_ids = cache_amino_sub_ids[(position_aa, ref_aa, alt_aa)]
-                except KeyError:
-                    try:
-                        amino_acid_ids = await find_equivalent_amino_acids(
-                            AminoAcid(
-                                gff_feature=self.gff_feature,
-                                position_aa=position_aa,
-                                alt_aa=alt_aa,
-                                ref_aa=ref_aa
-                            )
-                        )
-                        cache_amino_sub_ids[(position_aa, ref_aa, alt_aa)] = amino_acid_ids
-                    except NotFoundError:
-                        # if the aas doesn't already exist, skip the record.
-                        # we don't want to create orphaned aas entries just for the dms data
-                        debug_info['skipped_aas_not_found'] += 1
-                        cache_amino_subs_not_found.add((position_aa, ref_aa, alt_aa))
-                        continue
-
-                for canonical_name, input_name in present_data_cols.items():
-                    try:
-                        v = get_value(row, input_name, transform=float)
-                    except ValueError:
-                        debug_info['value_parsing_errors'] += 1
-                        continue
-
-                    try:
-                        metric_id = cache_metric_ids[canonical_name]
-                    except KeyError:
-                        metric_id = await find_or_insert_metric(
-                            PhenotypeMetric(
-                                phenotype_metric_name=canonical_name,
-                                phenotype_metric_assay_type=PhenotypeMetricAssayTypes.DMS
-                            )
-                        )
-                        cache_metric_ids[canonical_name] = metric_id
-
-                    for aa_id in amino_acid_ids:
-                        updated = await insert_pheno_measurement_result(
-                            PhenotypeMetricValues(
-                                amino_acid_id=aa_id,
-                                phenotype_metric_id=metric_id,
-                                value=v
-                            ),
-                            upsert=True
-                        )
-                        if updated:
-                            debug_info['count_existing_updated'] += 1
-                        else:
-                            debug_info['count_new_records_inserted'] += 1
-
-        debug_info['count_aas_not_found'] = len(cache_amino_subs_not_found)
+        # format: metric_name -> id
+        metric_ids = dict()
+        for canonical_name in present_data_cols.keys():
+            metric_ids[canonical_name] = await find_or_insert_metric(
+                PhenotypeMetric(
+                    phenotype_metric_name=canonical_name,
+                    phenotype_metric_assay_type=PhenotypeMetricAssayTypes.DMS
+                )
+            )
+
+        rows = (
+            pl.scan_csv(get_polars_source(self.filename), separator=self.delimiter, infer_schema=False)
+            .select(
+                pl.lit(self.gff_feature).alias(ColumnNames.gff_feature),
+                pl.col(self.required_column_name_map[ColumnNames.position_aa])
+                .cast(pl.Int64, strict=False)
+                .alias(ColumnNames.position_aa),
+                pl.col(self.required_column_name_map[ColumnNames.ref_aa]).alias(ColumnNames.ref_aa),
+                pl.col(self.required_column_name_map[ColumnNames.alt_aa]).alias(ColumnNames.alt_aa),
+                *[pl.col(input_name).alias(canonical_name) for canonical_name, input_name in present_data_cols.items()]
+            )
+            .collect()
+        )
+        rows_with_aas = rows.drop_nulls(AMINO_ACID_KEY_COLUMNS)
+        debug_info['skipped_aas_info_missing'] = rows.height - rows_with_aas.height
+
+        # one row per (amino acid, metric), null values are the ones that couldn't be parsed
+        values = (
+            rows_with_aas
+            .unpivot(
+                index=AMINO_ACID_KEY_COLUMNS,
+                on=list(present_data_cols.keys()),
+                variable_name=ColumnNames.phenotype_metric_name,
+                value_name=ColumnNames.value
+            )
+            .with_columns(
+                pl.col(ColumnNames.value).cast(pl.Float64, strict=False),
+                pl.col(ColumnNames.phenotype_metric_name)
+                .replace_strict(metric_ids, return_dtype=pl.Int64)
+                .alias(ColumnNames.phenotype_metric_id)
+            )
+        )
+
+        inserted, updated, aas_not_found = await copy_upsert_pheno_measurement_results(
+            values.drop_nulls(ColumnNames.value)
+        )
+        debug_info['count_new_records_inserted'] = inserted
+        debug_info['count_existing_updated'] = updated
+        # if the aas doesn't already exist, the record is skipped.
+        # we don't want to create orphaned aas entries just for the dms data
+        debug_info['skipped_aas_not_found'] = rows_with_aas.join(
+            aas_not_found, on=AMINO_ACID_KEY_COLUMNS, how='semi'
+        ).height
+        debug_info['value_parsing_errors'] = (
+            values
+            .join(aas_not_found, on=AMINO_ACID_KEY_COLUMNS, how='anti')
+            .filter(pl.col(ColumnNames.value).is_null())
+            .height
+        )
+        debug_info['count_aas_not_found'] = aas_not_found.height
         print(debug_info)
 
     @classmethod
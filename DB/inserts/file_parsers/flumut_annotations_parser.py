@@ -1,20 +1,17 @@
 import csv
 from enum import Enum
-from typing import Set, List
+from typing import Set
 
 import polars as pl
 
-from DB.inserts.amino_acids import find_equivalent_amino_acids
-from DB.inserts.annotations import insert_annotation
-from DB.inserts.annotations_papers import find_or_insert_annotation_paper
-from DB.inserts.effects import find_or_insert_effect
+from DB.inserts.amino_acids import find_equivalent_amino_acids_as_pl_df, AMINO_ACID_KEY_COLUMNS
+from DB.inserts.annotations import batch_insert_annotations, AMINO_ACID_IDS, PAPER_IDS
+from DB.inserts.effects import find_or_insert_effects
 from DB.inserts.file_parsers.file_parser import FileParser
-from DB.inserts.papers import find_or_insert_paper
-from DB.models import AminoAcid, Effect, Paper, Annotation, AnnotationPaper
-from utils.constants import DefaultGffFeaturesByRegion
-from utils.csv_helpers import parse_change_string
-from utils.errors import NotFoundError, DuplicateAnnotationError
-from utils.ha_numbering import convert_mature_h5_to_sequential
+from DB.inserts.papers import find_or_insert_papers
+from utils.constants import DefaultGffFeaturesByRegion, CHANGE_PATTERN, ColumnNames
+from utils.ha_numbering import convert_mature_h5_to_sequential_expr
+from utils.input_files import open_input_text, get_polars_source
 
 # this is intended to parse the output of the following query:
 # select mm.mutation_name,
@@ -30,6 +27,11 @@ from utils.ha_numbering import convert_mature_h5_to_sequential
 # where me.subtype = 'H5N1';
 
 UNMAPPED = 'unmapped'
+ROW_INDEX = 'row_index'
+AA_FOUND = 'aa_found'
+SKIP_REASON = 'skip_reason'
+SKIPPED_MISC = 'misc'
+SKIPPED_AA_NOT_FOUND = 'aa_not_found'
 
 gff_mapping = {
     'HA1-5': 'XAJ25415.1',
@@ -55,112 +57,127 @@ class FlumutParser(FileParser):
         self._verify_header()
 
     async def parse_and_insert(self):
-        annotation_id_by_marker_id = dict()
-
         debug_info = {
             'count_skipped_misc': 0,
             'count_skipped_duplicate_annotation': 0,
             'count_skipped_aa_not_found': 0
         }
 
-        annotations_input = pl.scan_csv(
-            self.filename,
-            separator=self.delimiter,
-            with_column_names=lambda names: [ColNameMapping(n).name for n in names]
-        ).collect()
-
-        # Each entry in this df will correspond to one row in the annotations table
-        uq_effects_markers = (
-            annotations_input
-            .select(
-                pl.col(ColNameMapping.marker_id.name),
-                pl.col(ColNameMapping.effect_detail.name)
+        annotations_input = (
+            pl.scan_csv(
+                get_polars_source(self.filename),
+                separator=self.delimiter,
+                with_column_names=lambda names: [ColNameMapping(n).name for n in names]
             )
-            .unique()
+            .collect()
+            .with_row_index(ROW_INDEX)
         )
+        # Each distinct (marker_id, effect_detail) will correspond to one row in the annotations table
+        annotation_key = [ColNameMapping.marker_id.name, ColNameMapping.effect_detail.name]
+
+        changes = self._parse_changes(annotations_input.select(ROW_INDEX, *annotation_key, ColNameMapping.aa_change.name))
+        amino_acids = await find_equivalent_amino_acids_as_pl_df(changes.drop_nulls(AMINO_ACID_KEY_COLUMNS))
+
+        # An annotation is skipped if any of its changes can't be parsed or mapped, or doesn't match an amino acid.
+        # The first bad change determines which counter it goes into.
+        changes = (
+            changes
+            .join(
+                amino_acids.select(AMINO_ACID_KEY_COLUMNS).unique().with_columns(pl.lit(True).alias(AA_FOUND)),
+                on=AMINO_ACID_KEY_COLUMNS,
+                how='left'
+            )
+            .with_columns(
+                pl.when(pl.any_horizontal(pl.col(AMINO_ACID_KEY_COLUMNS).is_null()))
+                .then(pl.lit(SKIPPED_MISC))
+                .when(pl.col(AA_FOUND).is_null())
+                .then(pl.lit(SKIPPED_AA_NOT_FOUND))
+                .alias(SKIP_REASON)
+            )
+        )
+        skipped_annotations = (
+            changes
+            .drop_nulls(SKIP_REASON)
+            .sort(ROW_INDEX)
+            .group_by(annotation_key)
+            .agg(pl.col(SKIP_REASON).first())
+        )
+        debug_info['count_skipped_misc'] = skipped_annotations.filter(pl.col(SKIP_REASON) == SKIPPED_MISC).height
+        debug_info['count_skipped_aa_not_found'] = (
+            skipped_annotations.filter(pl.col(SKIP_REASON) == SKIPPED_AA_NOT_FOUND).height
+        )
+
+        annotations_input = annotations_input.join(skipped_annotations, on=annotation_key, how='anti')
+        changes = changes.join(skipped_annotations, on=annotation_key, how='anti')
 
-        for marker_id, effect_detail in uq_effects_markers.rows():
-            # Get all the related rows from the main df
-            one_annotation = annotations_input.filter(
-                pl.col(ColNameMapping.effect_detail.name) == effect_detail,
-                pl.col(ColNameMapping.marker_id.name) == marker_id
+        effects = await find_or_insert_effects(annotations_input.get_column(ColNameMapping.effect_detail.name))
+        papers = await find_or_insert_papers(
+            annotations_input.select(
+                pl.col(ColNameMapping.paper_title.name).alias(ColumnNames.title),
+                pl.col(ColNameMapping.paper_authors.name).alias(ColumnNames.authors),
+                pl.col(ColNameMapping.paper_year.name).cast(pl.Int64).alias(ColumnNames.publication_year),
             )
+        )
 
-            # get the amino acid data
-            amino_acid_ids: set[int] = set()
-            try:
-                for aa_change in one_annotation.select(pl.col(ColNameMapping.aa_change.name)).rows():
-                    protein, ref, position, alt = parse_change_string(aa_change[0])
-                    gff_feature = gff_mapping[protein]
-
-                    # adjust position for HA
-                    if gff_feature == DefaultGffFeaturesByRegion.HA:
-                        position = convert_mature_h5_to_sequential(position)
-
-                    amino_acid_ids = amino_acid_ids.union(
-                        await find_equivalent_amino_acids(
-                            AminoAcid(
-                                gff_feature=gff_feature,
-                                position_aa=position,
-                                ref_aa=ref,
-                                alt_aa=alt
-                            )
-                        )
-                    )
-            except (KeyError, ValueError):
-                debug_info['count_skipped_misc'] += 1
-                continue
-            except NotFoundError:
-                debug_info['count_skipped_aa_not_found'] += 1
-                continue
-
-            # effect
-            effect_id = await find_or_insert_effect(
-                Effect(
-                    detail=effect_detail
-                )
+        amino_acid_ids = (
+            changes
+            .join(amino_acids, on=AMINO_ACID_KEY_COLUMNS, how='inner')
+            .group_by(annotation_key)
+            .agg(pl.col(ColumnNames.amino_acid_id).unique().alias(AMINO_ACID_IDS))
+        )
+        paper_ids = (
+            annotations_input
+            .join(
+                papers,
+                left_on=[
+                    ColNameMapping.paper_title.name,
+                    ColNameMapping.paper_authors.name,
+                    pl.col(ColNameMapping.paper_year.name).cast(pl.Int64)
+                ],
+                right_on=[ColumnNames.title, ColumnNames.authors, ColumnNames.publication_year],
+                how='inner'
+            )
+            .group_by(annotation_key)
+            .agg(pl.col(ColumnNames.paper_id).unique().alias(PAPER_IDS))
+        )
+        annotations = (
+            amino_acid_ids
+            .join(paper_ids, on=annotation_key, how='left')
+            .join(
+                effects,
+                left_on=ColNameMapping.effect_detail.name,
+                right_on=ColumnNames.detail,
+                how='inner'
             )
+            .select(ColumnNames.effect_id, AMINO_ACID_IDS, PAPER_IDS)
+        )
 
-            # papers
-            paper_ids: List[int] = []
-            for title, authors, year in one_annotation.select(
-                    pl.col(ColNameMapping.paper_title.name),
-                    pl.col(ColNameMapping.paper_authors.name),
-                    pl.col(ColNameMapping.paper_year.name),
-            ).rows():
-                paper_ids.append(
-                    await find_or_insert_paper(
-                        Paper(
-                            title=title,
-                            authors=authors,
-                            publication_year=year
-                        )
-                    )
-                )
-
-            # Insert annotation
-            # this also handles the amino acids relationships
-            try:
-                annotation_id = await insert_annotation(
-                    Annotation(
-                        effect_id=effect_id
-                    ),
-                    set(amino_acid_ids)
-                )
-            except DuplicateAnnotationError:
-                debug_info['count_skipped_duplicate_annotation'] += 1
-                continue
-
-            # associate with papers
-            for pid in paper_ids:
-                await find_or_insert_annotation_paper(
-                    AnnotationPaper(
-                        annotation_id=annotation_id,
-                        paper_id=pid
-                    )
-                )
+        # this also handles the amino acids and papers relationships
+        _, count_duplicates = await batch_insert_annotations(annotations)
+        debug_info['count_skipped_duplicate_annotation'] = count_duplicates
         print(debug_info)
 
+    @staticmethod
+    def _parse_changes(changes: pl.DataFrame) -> pl.DataFrame:
+        """
+        Split the change strings into amino acid fields, mapping proteins to gff features and converting HA
+        positions from mature H5 to sequential numbering.
+        Fields that can't be parsed or mapped are left null.
+        """
+        # same pattern as parse_change_string, which requires the whole string to match
+        parts = pl.col(ColNameMapping.aa_change.name).str.extract_groups(CHANGE_PATTERN + '$')
+        position = parts.struct.field('3').cast(pl.Int64, strict=False)
+        gff_feature = parts.struct.field('1').replace_strict(gff_mapping, default=None, return_dtype=pl.String)
+        return changes.with_columns(
+            gff_feature.alias(ColumnNames.gff_feature),
+            pl.when(gff_feature == DefaultGffFeaturesByRegion.HA)
+            .then(convert_mature_h5_to_sequential_expr(position))
+            .otherwise(position)
+            .alias(ColumnNames.position_aa),
+            parts.struct.field('2').alias(ColumnNames.ref_aa),
+            parts.struct.field('4').alias(ColumnNames.alt_aa),
+        )
+
     @classmethod
     def get_required_column_set(cls) -> Set[str]:
         return {cn.value for cn in {
@@ -173,7 +190,7 @@ class FlumutParser(FileParser):
         }}
 
     def _verify_header(self):
-        with open(self.filename, 'r') as f:
+        with open_input_text(self.filename) as f:
             reader = csv.DictReader(f, delimiter=self.delimiter)
             required_columns = FlumutParser.get_required_column_set()
             diff = required_columns - set(reader.fieldnames)
@@ -11,6 +11,7 @@ from DB.inserts.lineage_systems import find_or_insert_lineage_system
 from DB.inserts.lineages import copy_insert_lineages, get_all_lineages_by_lineage_system_as_pl_df
 from DB.models import LineageSystem
 from utils.constants import ColumnNames, LineageSystemNames
+from utils.input_files import open_input_text
 
 PARENT_NAME = 'parent_name'
 CHILD_NAME = 'child_name'
@@ -118,7 +119,7 @@ class FreyjaDemixedLineageHierarchyYamlParser(FileParser):
         def make_pc_entry(parent_name: str, child_name: str) -> dict:
             return {PARENT_NAME: parent_name, CHILD_NAME: child_name}
 
-        with open(self.filename, 'r') as f:
+        with open_input_text(self.filename) as f:
             hierarchy_input = yaml.safe_load(f)
 
         relationships = []
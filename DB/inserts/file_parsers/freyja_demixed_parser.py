@@ -1,18 +1,21 @@
+import multiprocessing
 import re
+from concurrent.futures import ProcessPoolExecutor
 from glob import glob
-from os import path
-from typing import List
+from os import path, cpu_count
+from typing import List, Tuple
 
-from psycopg2 import IntegrityError
+import polars as pl
 
 from DB.inserts.file_parsers.file_parser import FileParser
 from DB.inserts.lineage_systems import find_or_insert_lineage_system
-from DB.inserts.lineages import find_or_insert_lineage
-from DB.inserts.samples import get_sample_id_by_accession
-from DB.inserts.samples_lineages import upsert_sample_lineage
-from DB.models import LineageSystem, Lineage, SampleLineage
-from utils.constants import LineageSystemNames
-from utils.errors import NotFoundError
+from DB.inserts.lineages import copy_insert_lineages, get_all_lineages_by_lineage_system_as_pl_df
+from DB.inserts.samples import get_samples_accession_and_id_as_pl_df
+from DB.inserts.samples_lineages import copy_upsert_samples_lineages
+from DB.models import LineageSystem
+from utils.constants import LineageSystemNames, ColumnNames
+from utils.input_files import split_archive_member, list_archive_members, iter_archive_members, \
+    ARCHIVE_MEMBER_SEPARATOR
 
 LINEAGES = 'lineages'
 ABUNDANCES = 'abundances'
@@ -21,14 +24,27 @@ ABUNDANCES = 'abundances'
 class FreyjaDemixedParser(FileParser):
 
     def __init__(self, target_dir: str):
-        if not path.isdir(target_dir):
+        """
+        :param target_dir: directory holding the .demixed files. May also be a directory within a zip or tar archive,
+        given as <archive>::<directory>, or <archive>:: for the top of the archive, in which case the files are
+        read straight out of the archive.
+        """
+        self.archive_dir = split_archive_member(target_dir)
+        if self.archive_dir is None and not path.isdir(target_dir):
             raise ValueError('FreyjaDemixedParser must be provided with a directory as a target')
         self.target_dir = target_dir
         self.file_by_accession = self._list_files_by_accession()
 
     def _list_files_by_accession(self) -> dict:
         file_by_accession = dict()
-        demixed_files = glob(path.join(self.target_dir, '*.demixed'))
+        if self.archive_dir is None:
+            demixed_files = glob(path.join(self.target_dir, '*.demixed'))
+        else:
+            archive, directory = self.archive_dir
+            demixed_files = [
+                f'{archive}{ARCHIVE_MEMBER_SEPARATOR}{member}' for member in list_archive_members(archive)
+                if member.endswith('.demixed') and path.dirname(member) == directory.strip('/')
+            ]
         for df in demixed_files:
             basename = path.basename(df)
             accession = basename.removesuffix('.demixed')
@@ -42,62 +58,104 @@ class FreyjaDemixedParser(FileParser):
         debug_info = {
             'skipped_malformed': 0,
             'skipped_sample_not_found': 0,
+            'count_new_records': 0,
             'count_existing_records_modified': 0,
-            'count_integrity_errors': 0,
         }
         lineage_system_id = await find_or_insert_lineage_system(
             LineageSystem(
                 lineage_system_name=LineageSystemNames.freyja_demixed
             )
         )
-        # format = name -> id
-        cache_lineage_ids = dict()
-        for accession, file in self.file_by_accession.items():
-            # parse data from file
-            try:
-                abundance_by_lineage = FreyjaDemixedParser._parse_file(accession, file)
-            except ValueError as e:
-                print(e)
-                debug_info['skipped_malformed'] += 1
-                continue
-            # find sample
-            try:
-                sample_id = await get_sample_id_by_accession(accession)
-            except NotFoundError:
-                debug_info['skipped_sample_not_found'] += 1
-                continue
 
-            for lineage_name, abundance in abundance_by_lineage.items():
-                # get lineage id
-                try:
-                    lineage_id = cache_lineage_ids[lineage_name]
-                except KeyError:
-                    lineage_id = await find_or_insert_lineage(
-                        Lineage(
-                            lineage_name=lineage_name,
-                            lineage_system_id=lineage_system_id
-                        )
-                    )
-                    cache_lineage_ids[lineage_name] = lineage_id
-                # insert sample-lineage data
-                try:
-                    modified = await upsert_sample_lineage(
-                        SampleLineage(
-                            lineage_id=lineage_id,
-                            sample_id=sample_id,
-                            is_consensus_call=False,
-                            abundance=abundance
-                        )
-                    )
-                    if modified:
-                        debug_info['count_existing_records_modified'] += 1
-                except IntegrityError:
-                    debug_info['count_integrity_errors'] += 1
-                    continue
+        abundances = self._parse_files(debug_info)
+
+        # find samples
+        existing_samples = await get_samples_accession_and_id_as_pl_df()
+        samples_found = abundances.join(existing_samples, on=ColumnNames.accession, how='inner')
+        debug_info['skipped_sample_not_found'] = (
+            abundances.get_column(ColumnNames.accession).n_unique()
+            - samples_found.get_column(ColumnNames.accession).n_unique()
+        )
+
+        # add any lineages we haven't seen yet
+        existing_lineages = await get_all_lineages_by_lineage_system_as_pl_df(LineageSystemNames.freyja_demixed)
+        missing_lineages = (
+            samples_found
+            .select(ColumnNames.lineage_name)
+            .unique()
+            .join(existing_lineages, on=ColumnNames.lineage_name, how='anti')
+            .with_columns(pl.lit(lineage_system_id).alias(ColumnNames.lineage_system_id))
+        )
+        if missing_lineages.height > 0:
+            await copy_insert_lineages(missing_lineages)
+            existing_lineages = await get_all_lineages_by_lineage_system_as_pl_df(LineageSystemNames.freyja_demixed)
+
+        samples_lineages = (
+            samples_found
+            .join(existing_lineages, on=ColumnNames.lineage_name, how='inner')
+            .select(
+                pl.col(ColumnNames.sample_id),
+                pl.col(ColumnNames.lineage_id),
+                pl.lit(False).alias(ColumnNames.is_consensus_call),
+                pl.col(ColumnNames.abundance)
+            )
+        )
+        if samples_lineages.height > 0:
+            inserted, modified = await copy_upsert_samples_lineages(samples_lineages)
+            debug_info['count_new_records'] = inserted
+            debug_info['count_existing_records_modified'] = modified
         print(debug_info)
 
+    def _parse_files(self, debug_info: dict) -> pl.DataFrame:
+        """
+        Parse all the demixed files across a pool of worker processes.
+        :return: accession, lineage_name, abundance for every file that parsed successfully
+        """
+        accessions = []
+        lineage_names = []
+        abundances = []
+        items = [(accession, file, None) for accession, file in self.file_by_accession.items()]
+        if self.archive_dir is not None:
+            # the files are small, so read them all in one pass over the archive and hand the contents to the workers
+            archive = self.archive_dir[0]
+            contents_by_member = dict(
+                iter_archive_members(archive, [split_archive_member(file)[1] for _, file, _ in items])
+            )
+            items = [
+                (accession, file, contents_by_member[split_archive_member(file)[1]]) for accession, file, _ in items
+            ]
+        n_workers = cpu_count() or 1
+        # this process has an event loop and DB connections open, which must not be forked into the workers
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            results = executor.map(
+                _parse_file_in_worker,
+                items,
+                chunksize=max(1, len(items) // (n_workers * 4))
+            )
+            for accession, abundance_by_lineage, error in results:
+                if error is not None:
+                    print(error)
+                    debug_info['skipped_malformed'] += 1
+                    continue
+                accessions.extend([accession] * len(abundance_by_lineage))
+                lineage_names.extend(abundance_by_lineage.keys())
+                abundances.extend(abundance_by_lineage.values())
+
+        return pl.DataFrame(
+            {
+                ColumnNames.accession: accessions,
+                ColumnNames.lineage_name: lineage_names,
+                ColumnNames.abundance: abundances,
+            },
+            schema={
+                ColumnNames.accession: pl.String,
+                ColumnNames.lineage_name: pl.String,
+                ColumnNames.abundance: pl.Float64,
+            }
+        )
+
     @classmethod
-    def _parse_file(cls, accession: str, file: str) -> dict[str, float]:
+    def _parse_file(cls, accession: str, file: str, contents: bytes | None = None) -> dict[str, float]:
         """
         File Format:
 
@@ -108,33 +166,39 @@ class FreyjaDemixedParser(FileParser):
             resid _\t_ 12.519881748345714
             coverage _\t_ 82.55681818181819
 
+        :param contents: contents of the file, if already read, e.g. out of an archive
         :return:
         """
+        if contents is None:
+            with open(file, 'r') as f:
+                lines = f.readlines()
+        else:
+            lines = contents.decode().splitlines()
+
         lineages = abundances = None
-        with open(file, 'r') as f:
-            for line in f.readlines():
-                line = line.strip()
-                if line.startswith(LINEAGES):
-                    lineages = FreyjaDemixedParser._parse_lineages_line(line)
-                elif line.startswith(ABUNDANCES):
-                    abundances = FreyjaDemixedParser._parse_abundances_line(line)
-                elif '_variants.tsv' in line:
-                    accession_2 = line.removesuffix('_variants.tsv').strip()
-                    if accession != accession_2:
-                        raise ValueError(f'Accession within file does not match filename: {file}')
-                else:
-                    continue
+        for line in lines:
+            line = line.strip()
+            if line.startswith(LINEAGES):
+                lineages = FreyjaDemixedParser._parse_lineages_line(line)
+            elif line.startswith(ABUNDANCES):
+                abundances = FreyjaDemixedParser._parse_abundances_line(line)
+            elif '_variants.tsv' in line:
+                accession_2 = line.removesuffix('_variants.tsv').strip()
+                if accession != accession_2:
+                    raise ValueError(f'Accession within file does not match filename: {file}')
+            else:
+                continue
 
-            if lineages is None:
-                raise ValueError(f'Lineages not found in file: {file}')
+        if lineages is None:
+            raise ValueError(f'Lineages not found in file: {file}')
 
-            if abundances is None:
-                raise ValueError(f'Abundances not found in file: {file}')
+        if abundances is None:
+            raise ValueError(f'Abundances not found in file: {file}')
 
-            if len(lineages) != len(abundances):
-                raise ValueError(f'lineages and abundances have mismatched lengths: {file}')
+        if len(lineages) != len(abundances):
+            raise ValueError(f'lineages and abundances have mismatched lengths: {file}')
 
-            return dict(zip(lineages, abundances))
+        return dict(zip(lineages, abundances))
 
     @classmethod
     def _parse_lineages_line(cls, line: str) -> List[str]:
@@ -149,3 +213,15 @@ class FreyjaDemixedParser(FileParser):
     @classmethod
     def get_required_column_set(cls):
         return {'not really applicable, requires abundances line and lineages lines'}
+
+
+def _parse_file_in_worker(
+    accession_file_and_contents: Tuple[str, str, bytes | None]
+) -> Tuple[str, dict[str, float] | None, str | None]:
+    # Module level so that it can be pickled and sent to the process pool.
+    # Errors are passed back as strings so that one bad file doesn't stop the pool.
+    accession, file, contents = accession_file_and_contents
+    try:
+        return accession, FreyjaDemixedParser._parse_file(accession, file, contents), None
+    except ValueError as e:
+        return accession, None, str(e)
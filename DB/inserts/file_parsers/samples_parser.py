@@ -1,17 +1,26 @@
 import csv
 from csv import DictReader
+from datetime import datetime, timezone
 from enum import Enum
-from typing import Set
+from typing import Set, Callable, Dict, List
 
-import dateutil
+import dateutil.parser
+import polars as pl
 
 from DB.inserts.file_parsers.file_parser import FileParser
-from DB.inserts.geo_locations import find_or_insert_geo_location
-from DB.inserts.samples import find_or_insert_sample
-from DB.models import GeoLocation, Sample
-from utils.constants import EXCLUDED_SRAS
-from utils.csv_helpers import get_value, bool_from_str
+from DB.inserts.geo_locations import find_or_insert_geo_locations
+from DB.inserts.samples import copy_upsert_samples
+from utils.constants import EXCLUDED_SRAS, ColumnNames, GEO_LOCATION, COLLECTION_DATE
 from utils.dates_and_times import parse_collection_start_and_end
+from utils.input_files import open_input_text, get_polars_source
+
+MALFORMED = 'malformed'
+GEO_LOCATION_COLUMNS = [
+    ColumnNames.country_name,
+    ColumnNames.admin1_name,
+    ColumnNames.admin2_name,
+    ColumnNames.admin3_name
+]
 
 
 class SamplesParser(FileParser):
@@ -24,132 +33,147 @@ class SamplesParser(FileParser):
         debug_info = {
             'skipped_malformed': 0,
             'count_preexisting': 0,
+            'count_updated': 0,
             'malformed_collection_dates': set()
         }
 
-        # (country, admin1, admin2, admin3) -> id
-        cache_geo_loc_ids = dict()
-
-        with open(self.filename, 'r') as f:
-            reader = csv.DictReader(f, delimiter=self.delimiter)
-            self._verify_header(reader)
-            for row in reader:
-                try:
-                    accession = get_value(row, ColNameMapping.accession.value)
-                    if accession in EXCLUDED_SRAS:
-                        continue
-                    # parse geo location
-                    geo_location_id = None
-                    geo_loc_full_text = get_value(
-                        row,
-                        ColNameMapping.geo_loc_name.value,
-                        allow_none=True
-                    )
-                    if geo_loc_full_text is not None:
-                        country_name, admin1, admin2, admin3 = geo_loc_full_text.split('/')
-                        try:
-                            geo_location_id = cache_geo_loc_ids[(country_name, admin1, admin2, admin3)]
-                        except KeyError:
-                            geo_loc = GeoLocation(
-                                country_name=country_name,
-                                admin1_name=admin1,
-                                admin2_name=admin2,
-                                admin3_name=admin3
-                            )
-                            geo_location_id = await find_or_insert_geo_location(geo_loc)
-                            cache_geo_loc_ids[(country_name, admin1, admin2, admin3)] = geo_location_id
-
-                    # parse collection date
-                    collection_start_date = collection_end_date = None
-                    collection_date = get_value(
-                        row,
-                        ColNameMapping.collection_date.value,
-                        allow_none=True
-                    )
-                    if collection_date is not None:
-                        try:
-                            collection_start_date, collection_end_date = parse_collection_start_and_end(collection_date)
-                        except ValueError | TypeError:
-                            debug_info['malformed_collection_dates'].add(collection_date)
-
-                    # parse retraction date
-                    retraction_detected_date = get_value(
-                        row,
-                        ColNameMapping.retraction_detected_date.value,
-                        allow_none=True
-                    )
-                    if retraction_detected_date is not None:
-                        retraction_detected_date = dateutil.parser.isoparse(retraction_detected_date + 'Z')
-
-                    sample = Sample(
-                        geo_location_id=geo_location_id,
-                        accession=accession,
-                        assay_type=get_value(row, ColNameMapping.assay_type.value, allow_none=True),
-                        avg_spot_length=get_value(
-                            row,
-                            ColNameMapping.avg_spot_length.value,
-                            allow_none=True,
-                            transform=float
-                        ),
-                        bases=get_value(row, ColNameMapping.bases.value, transform=int, allow_none=True),
-                        bio_project=get_value(row, ColNameMapping.bio_project.value, allow_none=True),
-                        bio_sample=get_value(row, ColNameMapping.bio_sample.value, allow_none=True),
-                        bio_sample_model=get_value(row, ColNameMapping.bio_sample_model.value),
-                        bio_sample_accession=get_value(
-                            row,
-                            ColNameMapping.bio_sample_accession.value,
-                            allow_none=True
-                        ),
-                        center_name=get_value(row, ColNameMapping.center_name.value, allow_none=True),
-                        collection_start_date=collection_start_date,
-                        collection_end_date=collection_end_date,
-                        experiment=get_value(row, ColNameMapping.experiment.value, allow_none=True),
-                        host=get_value(row, ColNameMapping.host.value, allow_none=True),
-                        instrument=get_value(row, ColNameMapping.instrument.value, allow_none=True),
-                        isolate=get_value(row, ColNameMapping.isolate.value, allow_none=True),
-                        library_name=get_value(row, ColNameMapping.library_name.value, allow_none=True),
-                        library_layout=get_value(row, ColNameMapping.library_layout.value, allow_none=True),
-                        library_selection=get_value(row, ColNameMapping.library_selection.value, allow_none=True),
-                        library_source=get_value(row, ColNameMapping.library_source.value, allow_none=True),
-                        organism=get_value(row, ColNameMapping.organism.value),
-                        platform=get_value(row, ColNameMapping.platform.value, allow_none=True),
-                        version=get_value(row, ColNameMapping.version.value, allow_none=True),
-                        sample_name=get_value(row, ColNameMapping.sample_name.value, allow_none=True),
-                        sra_study=get_value(row, ColNameMapping.sra_study.value, allow_none=True),
-                        serotype=get_value(row, ColNameMapping.serotype.value, allow_none=True),
-                        isolation_source=get_value(
-                            row,
-                            ColNameMapping.isolation_source.value,
-                            allow_none=True
-                        ),
-                        is_retracted=get_value(
-                            row,
-                            ColNameMapping.is_retracted.value,
-                            transform=bool_from_str
-                        ),
-                        retraction_detected_date=retraction_detected_date,
-                        release_date=get_value(
-                            row,
-                            ColNameMapping.release_date.value,
-                            transform=dateutil.parser.isoparse,
-                            allow_none=True
-                        ),
-                        creation_date=get_value(
-                            row,
-                            ColNameMapping.creation_date.value,
-                            transform=dateutil.parser.isoparse,
-                            allow_none=True
-                        ),
-                    )
-
-                    _, preexisting = await find_or_insert_sample(sample, upsert=True)
-                    if preexisting:
-                        debug_info['count_preexisting'] += 1
-                except ValueError:
-                    debug_info['skipped_malformed'] += 1
+        with open_input_text(self.filename) as f:
+            self._verify_header(csv.DictReader(f, delimiter=self.delimiter))
+
+        # Read everything as strings, blanks come in as nulls
+        samples_input = (
+            pl.scan_csv(get_polars_source(self.filename), separator=self.delimiter, infer_schema=False)
+            .select([pl.col(cn.value).alias(self._get_parsed_column_name(cn)) for cn in self._get_required_columns()])
+            .filter(pl.col(ColumnNames.accession).is_in(list(EXCLUDED_SRAS)).not_().fill_null(True))
+            .collect()
+        )
+
+        samples = self._parse_columns(samples_input, debug_info)
+        debug_info['skipped_malformed'] = samples.filter(pl.col(MALFORMED)).height
+        samples = (
+            samples
+            .filter(pl.col(MALFORMED).not_())
+            .drop(MALFORMED)
+            # later rows replace earlier ones with the same accession
+            .unique(subset=ColumnNames.accession, keep='last', maintain_order=True)
+        )
+
+        geo_locations = await self._find_or_insert_geo_locations(samples)
+        samples = (
+            samples
+            .join(geo_locations, on=GEO_LOCATION, how='left')
+            .drop(GEO_LOCATION, *GEO_LOCATION_COLUMNS)
+        )
+
+        if samples.height > 0:
+            inserted, updated, unchanged = await copy_upsert_samples(samples)
+            debug_info['count_preexisting'] = updated + unchanged
+            debug_info['count_updated'] = updated
 
         print(debug_info)
 
+    @staticmethod
+    def _parse_columns(samples_input: pl.DataFrame, debug_info: Dict) -> pl.DataFrame:
+        """
+        Convert the raw string columns to the types used by the samples table.
+        Rows that can't be inserted get marked as malformed. A collection date that can't be parsed is left null
+        and recorded in debug_info, but the row is kept.
+        :param samples_input: one string column per input column, named for the corresponding ColNameMapping
+        :param debug_info: collects malformed collection dates
+        :return: parsed columns plus a boolean malformed column
+        """
+        collection_dates = dict()
+        for collection_date in samples_input.get_column(COLLECTION_DATE).drop_nulls().unique():
+            try:
+                collection_dates[collection_date] = parse_collection_start_and_end(collection_date)
+            except (ValueError, TypeError):
+                debug_info['malformed_collection_dates'].add(collection_date)
+
+        # timestamps with an offset are converted to UTC, naive ones are assumed to be UTC already
+        def parse_timestamp(s: str) -> datetime:
+            ts = dateutil.parser.isoparse(s)
+            if ts.tzinfo is None:
+                return ts.replace(tzinfo=timezone.utc)
+            return ts.astimezone(timezone.utc)
+
+        timestamp_columns = {
+            ColumnNames.release_date: pl.col(ColumnNames.release_date),
+            ColumnNames.creation_date: pl.col(ColumnNames.creation_date),
+            ColumnNames.retraction_detected_date: pl.col(ColumnNames.retraction_detected_date) + 'Z',
+        }
+        timestamps = {
+            colname: _parse_unique_values(samples_input.select(expr).to_series(), parse_timestamp)
+            for colname, expr in timestamp_columns.items()
+        }
+
+        geo_parts = pl.col(GEO_LOCATION).str.split('/')
+        parsed = samples_input.with_columns(
+            pl.col(COLLECTION_DATE).replace_strict(
+                {k: v[0] for k, v in collection_dates.items()}, default=None, return_dtype=pl.Date
+            ).alias(ColumnNames.collection_start_date),
+            pl.col(COLLECTION_DATE).replace_strict(
+                {k: v[1] for k, v in collection_dates.items()}, default=None, return_dtype=pl.Date
+            ).alias(ColumnNames.collection_end_date),
+            pl.col(ColumnNames.avg_spot_length).cast(pl.Float64, strict=False),
+            pl.col(ColumnNames.bases).cast(pl.Int64, strict=False),
+            (pl.col(ColumnNames.is_retracted).str.to_lowercase() == 'true'),
+            *[
+                expr.replace_strict(timestamps[colname], default=None, return_dtype=pl.Datetime('us', 'UTC'))
+                .alias(colname)
+                for colname, expr in timestamp_columns.items()
+            ],
+            *[
+                geo_parts.list.get(i, null_on_oob=True).alias(colname)
+                for i, colname in enumerate(GEO_LOCATION_COLUMNS)
+            ],
+            pl.any_horizontal(
+                pl.col(ColumnNames.accession).is_null(),
+                pl.col(ColumnNames.bio_sample_model).is_null(),
+                pl.col(ColumnNames.organism).is_null(),
+                pl.col(ColumnNames.is_retracted).is_null(),
+                geo_parts.list.len() != 4,
+                *[
+                    pl.col(colname).is_not_null() & pl.col(colname).cast(dtype, strict=False).is_null()
+                    for colname, dtype in [
+                        (ColumnNames.avg_spot_length, pl.Float64),
+                        (ColumnNames.bases, pl.Int64)
+                    ]
+                ],
+                *[
+                    expr.is_not_null() & expr.is_in(list(timestamps[colname].keys())).not_()
+                    for colname, expr in timestamp_columns.items()
+                ],
+            ).fill_null(False).alias(MALFORMED)
+        )
+        return parsed.drop(COLLECTION_DATE)
+
+    @staticmethod
+    async def _find_or_insert_geo_locations(samples: pl.DataFrame) -> pl.DataFrame:
+        """
+        :return: geo_location <str>, geo_location_id <int> to be joined with samples
+        """
+        geo_locations = (
+            samples
+            .select(pl.col(GEO_LOCATION), *[pl.col(cn) for cn in GEO_LOCATION_COLUMNS])
+            .drop_nulls(GEO_LOCATION)
+            .unique(subset=GEO_LOCATION)
+        )
+        return (
+            (await find_or_insert_geo_locations(geo_locations))
+            .select(pl.col(GEO_LOCATION), pl.col(ColumnNames.geo_location_id))
+        )
+
+    @classmethod
+    def _get_required_columns(cls) -> List['ColNameMapping']:
+        required_column_set = cls.get_required_column_set()
+        return [cn for cn in ColNameMapping if cn.value in required_column_set]
+
+    @staticmethod
+    def _get_parsed_column_name(cn: 'ColNameMapping') -> str:
+        if cn == ColNameMapping.geo_loc_name:
+            return GEO_LOCATION
+        return cn.name
+
     @classmethod
     def _verify_header(cls, reader: DictReader):
         required_columns = cls.get_required_column_set()
@@ -192,6 +216,20 @@ class SamplesParser(FileParser):
         }}
 
 
+def _parse_unique_values(values: pl.Series, parse: Callable) -> Dict:
+    """
+    Parse each distinct non-null value once.
+    :return: raw value -> parsed value, for the values that parsed successfully
+    """
+    parsed = dict()
+    for value in values.drop_nulls().unique():
+        try:
+            parsed[value] = parse(value)
+        except (ValueError, TypeError, OverflowError):
+            pass
+    return parsed
+
+
 class ColNameMapping(Enum):
     accession = 'Run'
     assay_type = 'Assay Type'
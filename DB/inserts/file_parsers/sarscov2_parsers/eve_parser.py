@@ -2,14 +2,15 @@ from csv import DictReader
 from enum import Enum
 from typing import Set
 
-from DB.inserts.amino_acids import find_equivalent_amino_acids
+import polars as pl
+
 from DB.inserts.file_parsers.file_parser import FileParser
-from DB.inserts.phenotype_measurement_results import insert_pheno_measurement_result
+from DB.inserts.phenotype_measurement_results import copy_upsert_pheno_measurement_results
+from DB.inserts.amino_acids import AMINO_ACID_KEY_COLUMNS
 from DB.inserts.phenotype_metrics import find_or_insert_metric
-from DB.models import PhenotypeMetricValues, PhenotypeMetric, AminoAcid
-from utils.constants import PhenotypeMetricAssayTypes
-from utils.csv_helpers import get_value, int_from_decimal_str
-from utils.errors import NotFoundError
+from DB.models import PhenotypeMetric
+from utils.constants import PhenotypeMetricAssayTypes, ColumnNames
+from utils.input_files import open_input_text, get_polars_source
 
 
 class EveParser(FileParser):
@@ -24,66 +25,61 @@ class EveParser(FileParser):
             'skipped_aas_not_found': 0,
             'count_existing_updated': 0
         }
-        cache_phenotype_metrics = dict()
-        with open(self.filename, 'r') as f:
-            reader = DictReader(f)
-            EveParser._verify_header(reader)
-
-            for row in reader:
-                # try to get the amino-sub identifying fields
-                try:
-                    position_aa = get_value(row, ColNameMapping.position_aa.value, transform=int_from_decimal_str)
-                    ref_aa = get_value(row, ColNameMapping.ref_aa.value)
-                    alt_aa = get_value(row, ColNameMapping.alt_aa.value)
-                    gff_feature = get_value(row, ColNameMapping.gff_feature.value)
-                except ValueError:
-                    # If any of these are missing we have to skip the record
-                    debug_info['skipped_aas_info_missing'] += 1
-                    continue
-
-                try:
-                    amino_acid_ids: set[int]  = await find_equivalent_amino_acids(
-                        AminoAcid(
-                            gff_feature=gff_feature,
-                            position_aa=position_aa,
-                            alt_aa=alt_aa,
-                            ref_aa=ref_aa
-                        )
-                    )
-
-                except NotFoundError:
-                    debug_info['skipped_aas_not_found'] += 1
-                    # these aren't coming with nt data, I don't want to create a bunch or orphaned amino subs
-                    continue
-
-                for col in EveParser._get_data_cols():
-                    try:
-                        v = get_value(row, col.value, transform=float)
-                    except ValueError:
-                        continue
-
-                    try:
-                        metric_id = cache_phenotype_metrics[col.name]
-                    except KeyError:
-                        metric_id = await find_or_insert_metric(
-                            PhenotypeMetric(
-                                phenotype_metric_name=col.name,
-                                phenotype_metric_assay_type=PhenotypeMetricAssayTypes.EVE
-                            )
-                        )
-                        cache_phenotype_metrics[col.name] = metric_id
-
-                    for aa_id in amino_acid_ids:
-                        updated = await insert_pheno_measurement_result(
-                            PhenotypeMetricValues(
-                                amino_acid_id=aa_id,
-                                phenotype_metric_id=metric_id,
-                                value=v
-                            ),
-                            upsert=True
-                        )
-                        if updated:
-                            debug_info['count_existing_updated'] += 1
+        with open_input_text(self.filename) as f:
+            EveParser._verify_header(DictReader(f))
+
+        data_cols = EveParser._get_data_cols()
+        metric_ids = dict()
+        for col in data_cols:
+            metric_ids[col.name] = await find_or_insert_metric(
+                PhenotypeMetric(
+                    phenotype_metric_name=col.name,
+                    phenotype_metric_assay_type=PhenotypeMetricAssayTypes.EVE
+                )
+            )
+
+        # positions come as decimal strings, only whole numbers are valid
+        position_aa = pl.col(ColNameMapping.position_aa.value).cast(pl.Float64, strict=False)
+        rows = (
+            pl.scan_csv(get_polars_source(self.filename), infer_schema=False)
+            .select(
+                pl.col(ColNameMapping.gff_feature.value).alias(ColumnNames.gff_feature),
+                pl.when(position_aa == position_aa.floor())
+                .then(position_aa.cast(pl.Int64, strict=False))
+                .alias(ColumnNames.position_aa),
+                pl.col(ColNameMapping.ref_aa.value).alias(ColumnNames.ref_aa),
+                pl.col(ColNameMapping.alt_aa.value).alias(ColumnNames.alt_aa),
+                *[pl.col(col.value).cast(pl.Float64, strict=False).alias(col.name) for col in data_cols]
+            )
+            .collect()
+        )
+        # If any of these are missing we have to skip the record
+        rows_with_aas = rows.drop_nulls(AMINO_ACID_KEY_COLUMNS)
+        debug_info['skipped_aas_info_missing'] = rows.height - rows_with_aas.height
+
+        values = (
+            rows_with_aas
+            .unpivot(
+                index=AMINO_ACID_KEY_COLUMNS,
+                on=[col.name for col in data_cols],
+                variable_name=ColumnNames.phenotype_metric_name,
+                value_name=ColumnNames.value
+            )
+            .drop_nulls(ColumnNames.value)
+            .with_columns(
+                pl.col(ColumnNames.phenotype_metric_name)
+                .replace_strict(metric_ids, return_dtype=pl.Int64)
+                .alias(ColumnNames.phenotype_metric_id)
+            )
+        )
+
+        # amino subs that aren't already in the db are skipped,
+        # these aren't coming with nt data, I don't want to create a bunch or orphaned amino subs
+        _, updated, aas_not_found = await copy_upsert_pheno_measurement_results(values)
+        debug_info['count_existing_updated'] = updated
+        debug_info['skipped_aas_not_found'] = rows_with_aas.join(
+            aas_not_found, on=AMINO_ACID_KEY_COLUMNS, how='semi'
+        ).height
 
         print(debug_info)
 
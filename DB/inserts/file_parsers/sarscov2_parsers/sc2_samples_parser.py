@@ -1,68 +1,145 @@
 import csv
+import io
 import time
 from abc import abstractmethod
 from time import perf_counter
-from typing import Set
+from typing import Set, Iterator, List
 
 import polars as pl
 
 from DB.inserts.file_parsers.file_parser import FileParser
-from DB.inserts.geo_locations import find_or_insert_geo_location
-from DB.inserts.samples import copy_insert_samples, batch_upsert_samples, get_samples_accession_and_id_as_pl_df
-from DB.models import GeoLocation
+from DB.inserts.geo_locations import find_or_insert_geo_locations
+from DB.inserts.samples import copy_upsert_samples
 from utils.constants import ColumnNames, COLLECTION_DATE, GEO_LOCATION
-from utils.dates_and_times import parse_collection_start_and_end
+from utils.dates_and_times import parse_collection_start_and_end_expr
+from utils.input_files import open_input_text, get_polars_source
+
+# number of rows polars looks at to infer the column types, same as the default for scan_csv
+SCHEMA_INFERENCE_ROWS = 100
+COLLECTION_DATES = 'collection_dates'
+
 
 class Sc2SamplesParser(FileParser):
+    # If set, the file is read and inserted this many rows at a time, so that memory use is bounded by the batch
+    # rather than by the size of the file and the number of samples already in the DB.
+    # Set with --parser_extras batch_rows=<n>
+    batch_rows: int | None = None
+
     def __init__(
         self,
         samples_filename: str,
         samples_delimiter: str = '\t',
-        geo_location_levels_delimiter: str = '/'
+        geo_location_levels_delimiter: str = '/',
+        parser_extras: List[str] | None = None
     ):
         self.samples_filename = samples_filename
         self.samples_delimiter = samples_delimiter
         self._verify_header()
 
         self.geo_location_levels_delimiter = geo_location_levels_delimiter
+        if parser_extras is not None:
+            self._parse_extra_args(parser_extras)
 
     async def parse_and_insert(self):
+        if self.batch_rows is not None:
+            await self._parse_and_insert_in_batches()
+            return
+
+        start = perf_counter()
+        samples_input = self._prepare_input(
+            pl.scan_csv(get_polars_source(self.samples_filename), separator=self.samples_delimiter)
+        )
+        # unique by accession? No, leave it out for now to force errors on conflict.
+
+        geo_locations = await self._insert_geo_locations(samples_input)
+
+        samples_finished = self._finish_samples(samples_input, geo_locations)
+        setup_elapsed = perf_counter() - start
+        print(f'samples: starting db ops. setup took {round(setup_elapsed, 2)}s')
+        await self._upsert_samples(samples_finished)
+
+    async def _parse_and_insert_in_batches(self):
+        """
+        Insert the file batch_rows rows at a time. Each batch gets its own geo locations inserted before its
+        samples are upserted. Note that an accession repeated in a later batch updates the sample rather than failing.
+        """
         start = perf_counter()
-        # Scan file, rename columns, drop unused cols, drop rows with null collection date
+        n_rows = 0
+        for i, batch in enumerate(self._iter_input_batches()):
+            samples_input = self._prepare_input(batch.lazy())
+
+            geo_locations = await self._insert_geo_locations(samples_input)
+            samples_finished = self._finish_samples(samples_input, geo_locations)
+            await self._upsert_samples(samples_finished)
+
+            n_rows += batch.height
+            print(f'samples: batch {i} done, {n_rows} rows read in {round(perf_counter() - start, 2)}s')
+
+    def _iter_input_batches(self) -> Iterator[pl.DataFrame]:
+        """
+        Read the input file batch_rows rows at a time. The file is streamed, so this works the same for compressed
+        files and files within archives.
+        Rows go through the csv module so that quoted fields spanning lines stay in one batch, and are then handed
+        to polars to get the same parsing as scan_csv. The column types are inferred from the start of the file
+        and used for every batch, as scan_csv would.
+        """
+        schema = None
+        with open_input_text(self.samples_filename) as f:
+            reader = csv.reader(f, delimiter=self.samples_delimiter)
+            header = next(reader)
+            while True:
+                buffer = io.StringIO()
+                writer = csv.writer(buffer, delimiter=self.samples_delimiter, lineterminator='\n')
+                writer.writerow(header)
+                n_rows = 0
+                for row in reader:
+                    writer.writerow(row)
+                    n_rows += 1
+                    if n_rows == self.batch_rows:
+                        break
+                if n_rows == 0:
+                    return
+                batch = pl.read_csv(
+                    buffer.getvalue().encode(),
+                    separator=self.samples_delimiter,
+                    schema=schema,
+                    infer_schema_length=SCHEMA_INFERENCE_ROWS
+                )
+                if schema is None:
+                    schema = batch.schema
+                yield batch
+
+    def _prepare_input(self, samples_input: pl.LazyFrame) -> pl.LazyFrame:
+        # rename columns, drop unused cols, drop rows with null collection date
         samples_input = (
-            pl.scan_csv(self.samples_filename, separator=self.samples_delimiter)
+            samples_input
             .rename({old: new for new, old in self.column_name_map.items()})
             .select(set(self.column_name_map.keys()))
             .drop_nulls([pl.col(COLLECTION_DATE)])
         )
-        samples_input = self.fill_missing_required_cols(samples_input)
-        # unique by accession? No, leave it out for now to force errors on conflict.
-
-        geo_locations = await self._insert_geo_locations(samples_input)
-        existing_samples = await get_samples_accession_and_id_as_pl_df()
+        return self.fill_missing_required_cols(samples_input)
 
-        samples_finished: pl.DataFrame = (
+    @staticmethod
+    def _finish_samples(samples_input: pl.LazyFrame, geo_locations: pl.DataFrame) -> pl.DataFrame:
+        samples_finished = (
             samples_input
             .join(geo_locations.lazy(), on=pl.col(GEO_LOCATION), how='left')
             .drop(pl.col(GEO_LOCATION))
             .with_columns(
-                pl.col(COLLECTION_DATE).map_elements(
-                    parse_collection_start_and_end,
-                    return_dtype=pl.List(pl.Date)
-                )
+                parse_collection_start_and_end_expr(pl.col(COLLECTION_DATE))
+                .struct.rename_fields([ColumnNames.collection_start_date, ColumnNames.collection_end_date])
+                .alias(COLLECTION_DATES)
             )
-            .with_columns(
-                pl.col(COLLECTION_DATE).list.to_struct(
-                    fields=[ColumnNames.collection_start_date, ColumnNames.collection_end_date]
-                )
-            )
-            .unnest(COLLECTION_DATE)
             .collect()
         )
-        setup_elapsed = perf_counter() - start
-        print(f'samples: starting db ops. setup took {round(setup_elapsed, 2)}s')
-        await self._insert_new_samples(samples_finished, existing_samples)
-        await self._update_existing_samples(samples_finished, existing_samples)
+        # the expression gives nulls where parse_collection_start_and_end would have raised, so raise here instead
+        unparseable = samples_finished.filter(
+            pl.col(COLLECTION_DATES).struct.field(ColumnNames.collection_start_date).is_null()
+            | pl.col(COLLECTION_DATES).struct.field(ColumnNames.collection_end_date).is_null()
+        )
+        if unparseable.height > 0:
+            raise ValueError(f'Unable to parse: {unparseable.get_column(COLLECTION_DATE)[0]}')
+        return samples_finished.drop(COLLECTION_DATE).unnest(COLLECTION_DATES)
 
     async def _insert_geo_locations(self, samples_input: pl.LazyFrame) -> pl.DataFrame:
         """
@@ -70,7 +147,6 @@ class Sc2SamplesParser(FileParser):
         :param samples_input:
         :return: geo_location <str>, id <int> to be joined with samples
         """
-        # this is still done the slow way, it doesn't take long enough to be worth updating yet
         start = time.perf_counter()
         geo_locations = (
             samples_input
@@ -101,53 +177,43 @@ class Sc2SamplesParser(FileParser):
             .collect()
         )
 
-        ids = []
-        for row in geo_locations.iter_rows(named=True):
-            ids.append(
-                await find_or_insert_geo_location(
-                    GeoLocation(
-                        country_name=row[ColumnNames.country_name],
-                        admin1_name=row[ColumnNames.admin1_name],
-                        admin2_name=row[ColumnNames.admin2_name],
-                        admin3_name=row[ColumnNames.admin3_name]
-                    )
-                )
-            )
-
         geo_locations = (
-            geo_locations
-            .select(pl.col(GEO_LOCATION))
-            .with_columns(pl.Series(ids).alias(ColumnNames.geo_location_id))
+            (await find_or_insert_geo_locations(geo_locations))
+            .select(pl.col(GEO_LOCATION), pl.col(ColumnNames.geo_location_id))
         )
         print(f'geo locations took {round(time.perf_counter() - start, 2)}s')
         return geo_locations
 
     @staticmethod
-    async def _insert_new_samples(samples_finished: pl.DataFrame, existing_samples: pl.DataFrame):
-        new_samples = samples_finished.join(
-            existing_samples,
-            on=pl.col(ColumnNames.accession),
-            how='anti'
-        )
-        copy_status = await copy_insert_samples(new_samples)
-        print(f'new samples: {copy_status}')
-
-    @staticmethod
-    async def _update_existing_samples(samples_finished: pl.DataFrame, existing_samples: pl.DataFrame):
-        updated_samples = samples_finished.join(
-            existing_samples,
-            on=pl.col(ColumnNames.accession),
-            how='inner'
-        )
-        await batch_upsert_samples(updated_samples)
+    async def _upsert_samples(samples_finished: pl.DataFrame):
+        inserted, updated, unchanged = await copy_upsert_samples(samples_finished)
+        print(f'samples: {inserted} inserted, {updated} updated, {unchanged} unchanged')
 
     def _verify_header(self):
-        with open(self.samples_filename, 'r') as f:
+        with open_input_text(self.samples_filename) as f:
             reader = csv.DictReader(f, delimiter=self.samples_delimiter)
             required_columns = set(self.column_name_map.values())
             if not set(reader.fieldnames) >= required_columns:
                 raise ValueError(f'Missing required fields: {required_columns - set(reader.fieldnames)}')
 
+    def _parse_extra_args(self, extra_args: List[str]):
+        for arg in extra_args:
+            try:
+                name, value = arg.split('=')
+                if name == 'batch_rows':
+                    value = int(value)
+                    if value < 1:
+                        raise ValueError
+                else:
+                    # skip setting value and print a warning
+                    raise ValueError
+
+                self.__setattr__(name, value)
+                print(f'set {name} to {value}')
+
+            except ValueError:
+                print(f'Warning: unable to parse extra parameter: {arg}')
+
     @classmethod
     def get_required_column_set(cls) -> Set[str]:
         return set(cls.column_name_map.keys())
@@ -161,8 +227,13 @@ class Sc2SamplesParser(FileParser):
 
 class Sc2SdSamplesParser(Sc2SamplesParser):
 
-    def __init__(self, samples_filename: str, unique_sequences_filename: str | None = None):
-        super().__init__(samples_filename)
+    def __init__(
+        self,
+        samples_filename: str,
+        unique_sequences_filename: str | None = None,
+        parser_extras: List[str] | None = None
+    ):
+        super().__init__(samples_filename, parser_extras=parser_extras)
 
     def fill_missing_required_cols(self, samples_input: pl.LazyFrame) -> pl.LazyFrame:
         return samples_input.with_columns(
@@ -179,8 +250,13 @@ class Sc2SdSamplesParser(Sc2SamplesParser):
 
 
 class Sc2WastewaterSamplesParser(Sc2SamplesParser):
-    def __init__(self, samples_filename: str, unique_sequences_filename: str | None = None):
-        super().__init__(samples_filename)
+    def __init__(
+        self,
+        samples_filename: str,
+        unique_sequences_filename: str | None = None,
+        parser_extras: List[str] | None = None
+    ):
+        super().__init__(samples_filename, parser_extras=parser_extras)
 
     def fill_missing_required_cols(self, samples_input: pl.LazyFrame) -> pl.LazyFrame:
         return samples_input.with_columns(
@@ -207,8 +283,13 @@ class Sc2WastewaterSamplesParser(Sc2SamplesParser):
 
 
 class Sc2NcbiSamplesParser(Sc2SamplesParser):
-    def __init__(self, samples_filename: str, unique_sequences_filename: str | None = None):
-        super().__init__(samples_filename, geo_location_levels_delimiter=':')
+    def __init__(
+        self,
+        samples_filename: str,
+        unique_sequences_filename: str | None = None,
+        parser_extras: List[str] | None = None
+    ):
+        super().__init__(samples_filename, geo_location_levels_delimiter=':', parser_extras=parser_extras)
 
     def fill_missing_required_cols(self, samples_input: pl.LazyFrame) -> pl.LazyFrame:
         return samples_input.with_columns(
@@ -1,19 +1,19 @@
 import csv
-import re
 from csv import DictReader
 from typing import Set
 
-from sqlalchemy.exc import IntegrityError
+import polars as pl
 
 from DB.inserts.file_parsers.file_parser import FileParser
 from DB.inserts.lineage_systems import find_or_insert_lineage_system
-from DB.inserts.lineages import find_or_insert_lineage
-from DB.inserts.samples import get_sample_id_by_accession
-from DB.inserts.samples_lineages import insert_sample_lineage
-from DB.models import LineageSystem, Lineage, SampleLineage
+from DB.inserts.lineages import copy_insert_lineages, get_all_lineages_by_lineage_system_as_pl_df
+from DB.inserts.samples import get_samples_accession_and_id_as_pl_df
+from DB.inserts.samples_lineages import copy_upsert_samples_lineages
+from DB.models import LineageSystem
 from utils.constants import ColumnNames, LineageSystemNames
-from utils.csv_helpers import get_value
-from utils.errors import NotFoundError
+from utils.input_files import open_input_text, get_polars_source
+
+ROW_COUNT = 'row_count'
 
 
 class SimpleLineageParser(FileParser):
@@ -29,11 +29,9 @@ class SimpleLineageParser(FileParser):
             'skipped_sample_not_found': 0,
             'skipped_duplicate_for_sample': 0,
             'genotype_not_assigned': 0,
-            'integrity_errors': 0
+            'skipped_already_assigned': 0
         }
 
-        accessions_seen = set()
-
         # we only use a single lineage system, so just store it
         lineage_system_id = await find_or_insert_lineage_system(
             LineageSystem(
@@ -41,61 +39,70 @@ class SimpleLineageParser(FileParser):
             )
         )
 
-        # since we always have the same system id, we only need: name -> id
-        cache_lineage_ids = dict()
-
-        with open(self.filename, 'r') as f:
-            reader = csv.DictReader(f, delimiter=self.delimiter)
-            self._verify_header(reader)
-
-            for row in reader:
-                try:
-                    sample_accession = get_value(row, self.column_name_map[ColumnNames.accession])
-                    genotype = get_value(row, self.column_name_map[ColumnNames.lineage_name])
-                except ValueError:
-                    debug_info['skipped_malformed'] += 1
-                    continue
-
-                if re.match(r'not assigned', genotype, re.IGNORECASE):
-                    debug_info['genotype_not_assigned'] += 1
-                    continue
-
-                # find sample
-                if sample_accession in accessions_seen:
-                    debug_info['skipped_duplicate_for_sample'] += 1
-                    continue
-                try:
-                    sample_id = await get_sample_id_by_accession(sample_accession)
-                except NotFoundError:
-                    debug_info['skipped_sample_not_found'] += 1
-                    continue
-
-                # find lineage
-                try:
-                    lineage_id = cache_lineage_ids[genotype]
-                except KeyError:
-                    lineage_id = await find_or_insert_lineage(
-                        Lineage(
-                            lineage_name=genotype,
-                            lineage_system_id=lineage_system_id
-                        )
-                    )
-                    cache_lineage_ids[genotype] = lineage_id
-
-                # insert sample-lineage
-                try:
-                    await insert_sample_lineage(
-                        SampleLineage(
-                            sample_id=sample_id,
-                            lineage_id=lineage_id,
-                            abundance=None,
-                            is_consensus_call=True
-                        )
-                    )
-                except IntegrityError:
-                    debug_info['integrity_errors'] += 1
-
-                accessions_seen.add(sample_accession)
+        with open_input_text(self.filename) as f:
+            self._verify_header(csv.DictReader(f, delimiter=self.delimiter))
+
+        assignments = (
+            pl.scan_csv(get_polars_source(self.filename), separator=self.delimiter, infer_schema=False)
+            .select(
+                pl.col(self.column_name_map[ColumnNames.accession]).alias(ColumnNames.accession),
+                pl.col(self.column_name_map[ColumnNames.lineage_name]).alias(ColumnNames.lineage_name),
+            )
+            .collect()
+        )
+
+        valid = assignments.drop_nulls()
+        debug_info['skipped_malformed'] = assignments.height - valid.height
+
+        not_assigned = pl.col(ColumnNames.lineage_name).str.contains(r'(?i)^not assigned')
+        debug_info['genotype_not_assigned'] = valid.filter(not_assigned).height
+        valid = valid.filter(not_assigned.not_())
+
+        # Only the first assignment for each sample is used.
+        # Rows for samples that don't exist are all counted as not found, rather than as duplicates.
+        existing_samples = await get_samples_accession_and_id_as_pl_df()
+        first_by_accession = (
+            valid
+            .unique(subset=ColumnNames.accession, keep='first', maintain_order=True)
+            .join(
+                valid.group_by(ColumnNames.accession).agg(pl.len().alias(ROW_COUNT)),
+                on=ColumnNames.accession
+            )
+            .join(existing_samples, on=ColumnNames.accession, how='left')
+        )
+        found = pl.col(ColumnNames.sample_id).is_not_null()
+        debug_info['skipped_sample_not_found'] = first_by_accession.filter(found.not_())[ROW_COUNT].sum()
+        debug_info['skipped_duplicate_for_sample'] = first_by_accession.filter(found)[ROW_COUNT].sum() - \
+            first_by_accession.filter(found).height
+        first_by_accession = first_by_accession.filter(found)
+
+        # add any lineages we haven't seen yet
+        existing_lineages = await get_all_lineages_by_lineage_system_as_pl_df(self.lineage_system_name)
+        missing_lineages = (
+            first_by_accession
+            .select(ColumnNames.lineage_name)
+            .unique()
+            .join(existing_lineages, on=ColumnNames.lineage_name, how='anti')
+            .with_columns(pl.lit(lineage_system_id).alias(ColumnNames.lineage_system_id))
+        )
+        if missing_lineages.height > 0:
+            await copy_insert_lineages(missing_lineages)
+            existing_lineages = await get_all_lineages_by_lineage_system_as_pl_df(self.lineage_system_name)
+
+        samples_lineages = (
+            first_by_accession
+            .join(existing_lineages, on=ColumnNames.lineage_name, how='inner')
+            .select(
+                pl.col(ColumnNames.sample_id),
+                pl.col(ColumnNames.lineage_id),
+                pl.lit(True).alias(ColumnNames.is_consensus_call),
+                pl.lit(None, dtype=pl.Float64).alias(ColumnNames.abundance)
+            )
+        )
+        if samples_lineages.height > 0:
+            # consensus calls have no abundance, so there is never anything to update on conflict
+            inserted, _ = await copy_upsert_samples_lineages(samples_lineages)
+            debug_info['skipped_already_assigned'] = samples_lineages.height - inserted
 
         print(debug_info)
 
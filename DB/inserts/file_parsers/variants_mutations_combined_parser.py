@@ -1,20 +1,35 @@
+import asyncio
 import csv
+import io
 from datetime import datetime
+from decimal import Decimal
 from enum import Enum
-from os import path
-from typing import Set, List
+from itertools import islice
+from os import path, cpu_count
+from typing import Set, List, Callable, AsyncIterator, Iterator, Tuple
 
+import asyncpg
+import polars as pl
 from sqlalchemy.ext.asyncio.session import AsyncSession
 from sqlalchemy.sql.expression import text
 
 from DB.engine import get_async_write_session, get_async_session
 from DB.inserts.file_parsers.file_parser import FileParser
+from DB.inserts.ingest_runs import start_or_resume_ingest_run, insert_ingest_run_stage, finish_ingest_run, \
+    find_lost_stage_outputs, record_ingest_run_stage
+from DB.inserts.roaring_bitmaps import read_tmp_table, build_bitmaps, copy_bitmaps_into_table, BITMAP
+from DB.inserts.stages import Stage, StagePipeline, StageResult, format_stage_report
 from DB.structure import ih_samples_by_allele, ih_samples_by_amino_acid
 from DB.structure.constraint_manager import ConstraintManager
+from DB.structure.utils import run_statements_in_parallel
 from utils.constants import ColumnNames, CONTAINER_DATA_DIRECTORY, Env, ConstraintNames, TableNames, CODONS_AMINO_ACIDS
+from utils.csv_helpers import bool_from_str
+from utils.input_files import open_input_text, open_input_decompressed, is_compressed, split_archive_member, ARCHIVE_MEMBER_SEPARATOR
 
 AMINO_ACID_REF_CONFLICTS_FILE = '/tmp/amino_acid_ref_conflicts.csv'
 ALLELE_REF_CONFLICTS_FILE = '/tmp/allele_ref_conflicts.csv'
+IH_SAMPLES_BY_ALLELE_VIOLATIONS_FILE = '/tmp/ih_samples_by_allele_violations.csv'
+IH_SAMPLES_BY_AMINO_ACID_VIOLATIONS_FILE = '/tmp/ih_samples_by_amino_acid_violations.csv'
 
 
 class RecordType(Enum):
@@ -23,90 +38,537 @@ class RecordType(Enum):
     ih_codons = 3
 
 
+class BitmapEngine(Enum):
+    # bitmaps are aggregated by the database with rb_build_agg
+    server = 'server'
+    # bitmaps are aggregated with pyroaring in worker processes and copied into the staging tables
+    client = 'client'
+
+
 class VariantsMutationsCombinedParser(FileParser):
 
-    def __init__(self, filenames: List[str], extras: list[str] | None = None):
+    def __init__(self, filenames: List[str], extras: list[str] | None = None, resume: bool = False):
         self.delimiter = '\t'
-        # All validation now handled in the InputFile class
-        self.input_files = [
-            VariantsMutationsCombinedParser.InputFile(name, delimiter=self.delimiter) for name in filenames
-            if len(name.strip()) > 0
-        ]
+        # pick up the last unfinished run of this parser from its last completed stage
+        self.resume = resume
         self.n_freq_bins = 20
         self.ih_nt_min_depth = 10
         self.ih_codons_min_depth = 10
         self.ih_nt_min_freq = 0.02
         self.ih_codons_min_freq = 0.02
+        # If true, input files are streamed from this process instead of being read by the DB server
+        self.client_side_copy = False
+        self.copy_chunk_rows = 100_000
+        # max number of connections used at once for loading and indexing the tmp tables
+        self.load_parallelism = 4
+        # If true, accessions already merged with identical content (per the ingest ledger) are skipped,
+        # and accessions whose content changed have their previously merged data replaced.
+        self.incremental = False
+        # If true, the by-sample tables are rebuilt from the whole of the by-change bitmap tables
+        # rather than only from the rows staged in this run. Use to backfill them.
+        self.full_transpose = False
+        # Where the staged bitmaps are built, see BitmapEngine
+        self.bitmap_engine = BitmapEngine.server
+        # max number of worker processes used per staging step when bitmaps are built client side
+        self.bitmap_workers = cpu_count() or 1
 
         if extras is not None:
             self._parse_extra_args(extras)
+        # shared between all input files, caps the number of connections copying at once
+        self._load_slots = asyncio.Semaphore(self.load_parallelism)
+        self._sample_ids: asyncio.Task | None = None
+        self._ingest_run_id: int | None = None
+
+        # All validation now handled in the InputFile class
+        self.input_files = [
+            VariantsMutationsCombinedParser.InputFile(
+                name,
+                delimiter=self.delimiter,
+                client_side_copy=self.client_side_copy,
+                chunk_rows=self.copy_chunk_rows
+            )
+            for name in filenames
+            if len(name.strip()) > 0
+        ]
 
     async def parse_and_insert(self):
-        print(f'{self._get_timestamp()} setup')
-        await self._set_up_codon_translation()
-        await self._set_up_freq_bins()
-
-        print(f'{self._get_timestamp()} read mutations')
-        await self._read_mutations_input()
-
-        print(f'{self._get_timestamp()} read intrahost nt')
-        await self._read_ih_nts_input()
-
-        print(f'{self._get_timestamp()} insert alleles')
-        await self._stage_alleles()
-        await self._write_allele_ref_conflicts()
-        await self._drop_fks_using_allele_id()
-        await self._drop_alleles_indexes()
-        await self._insert_alleles()
-        await self._restore_alleles_indexes()
-
-        print(f'{self._get_timestamp()} read intrahost codons')
-        await self._read_ih_codons_input()
-
-        print(f'{self._get_timestamp()} insert amino acids')
-        await self._stage_amino_acids()
-        await self._write_amino_acid_ref_conflicts()
-        await self._drop_fks_using_amino_acid_id()
-        await self._drop_amino_acids_indexes()
-        await self._insert_amino_acids()
-        await self._restore_amino_acids_indexes()
-        await self._restore_fks_using_amino_acid_id()
-
-        print(f'{self._get_timestamp()} insert intrahost samples - alleles')
-        await self._stage_ih_samples_by_allele()
-        await self._drop_ih_samples_by_allele_indexes()
-        await self._insert_ih_samples_by_allele()
-        await self._restore_ih_samples_by_allele_indexes()
-
-        print(f'{self._get_timestamp()} insert consensus samples - alleles')
-        await self._stage_cns_samples_by_allele()
-        await self._insert_cns_samples_by_allele()
-        await self._restore_cns_samples_by_allele_indexes()
-
-        print(f'{self._get_timestamp()} insert intrahost samples - amino acids')
-        await self._stage_ih_samples_by_amino_acid()
-        await self._drop_ih_samples_by_amino_acid_indexes()
-        await self._insert_ih_samples_by_amino_acid()
-        await self._restore_ih_samples_by_amino_acid_indexes()
-
-        print(f'{self._get_timestamp()} insert consensus samples - amino acids')
-        await self._stage_cns_samples_by_amino_acid()
-        await self._insert_cns_samples_by_amino_acid()
-        await self._restore_cns_samples_by_amino_acid_indexes()
-
-        print(f'{self._get_timestamp()} clean up tmp tables')
-        await self._clean_up_tmp_tables()
-
-        print(f'{self._get_timestamp()} transpose consensus alleles')
-        await self._transpose_cns_alleles()
-
-        print(f'{self._get_timestamp()} transpose consensus amino acids')
-        await self._transpose_cns_amino_acids()
+        input_files = [f.raw_name for f in self.input_files]
+        ingest_run_id, completed_stages = await start_or_resume_ingest_run(
+            type(self).__name__,
+            input_files,
+            self.resume
+        )
+        if len(completed_stages) > 0:
+            lost = await find_lost_stage_outputs(ingest_run_id, self._get_stages())
+            if len(lost) > 0:
+                # every stage is safe to run again from the start, unlike from the middle with its inputs gone
+                print(
+                    f'Cannot resume ingest run {ingest_run_id}: {", ".join(lost)} lost their contents, '
+                    f'likely in a database crash. Starting over.'
+                )
+                ingest_run_id, completed_stages = await start_or_resume_ingest_run(
+                    type(self).__name__,
+                    input_files,
+                    resume=False
+                )
+        self._ingest_run_id = ingest_run_id
+        if len(completed_stages) == 0:
+            # drop anything left behind by an earlier run that failed
+            await self._clean_up_tmp_tables()
+
+        async def record_stage(result: StageResult):
+            await insert_ingest_run_stage(ingest_run_id, result)
+
+        pipeline = StagePipeline(self._get_stages(), max_parallel=self.load_parallelism)
+        try:
+            results = await pipeline.run(completed_stages, on_stage_done=record_stage)
+        except Exception:
+            print(
+                f'Ingest run {ingest_run_id} failed. Completed stages have been recorded, '
+                f'rerun with --resume to pick up from them.'
+            )
+            raise
+        await finish_ingest_run(ingest_run_id)
 
+        print(format_stage_report(results))
         print(f'Finished at {self._get_timestamp()}')
 
+    def _get_stages(self) -> List[Stage]:
+        reads = ['read_mutations_input', 'read_ih_nts_input', 'read_ih_codons_input']
+        # merges into the bitmap tables have to wait until data for changed accessions has been taken out
+        merge_deps = ['remove_changed_accessions'] if self.incremental else []
+        # By default only the rows staged in this run are transposed, which can start as soon as they are staged.
+        # A full transposition reads the whole bitmap table, so it has to wait for the merge into it.
+        if self.full_transpose:
+            transpose_deps = {
+                t: [f'restore_{t}_indexes'] for t in
+                ['cns_samples_by_allele', 'cns_samples_by_amino_acid', 'ih_samples_by_allele', 'ih_samples_by_amino_acid']
+            }
+        else:
+            transpose_deps = {
+                'cns_samples_by_allele': ['stage_cns_samples_by_allele', *merge_deps],
+                'cns_samples_by_amino_acid': ['stage_cns_samples_by_amino_acid', *merge_deps],
+                'ih_samples_by_allele': ['stage_ih_samples_by_allele', *merge_deps],
+                'ih_samples_by_amino_acid': ['stage_ih_samples_by_amino_acid', *merge_deps],
+            }
+
+        stages = [
+            Stage('set_up_codon_translation', self._set_up_codon_translation),
+            Stage('set_up_freq_bins', self._set_up_freq_bins),
+            # the three record types are independent until alleles are staged, so they are loaded concurrently
+            Stage('read_mutations_input', self._read_mutations_input, output_table='tmp_mutations'),
+            Stage('read_ih_nts_input', self._read_ih_nts_input, output_table='tmp_ih_nt'),
+            Stage('read_ih_codons_input', self._read_ih_codons_input, output_table='tmp_ih_codons'),
+            Stage('hash_staged_accessions', self._hash_staged_accessions, reads, 'tmp_accession_hashes'),
+        ]
+        if self.incremental:
+            stages += [
+                Stage(
+                    'find_removed_accessions',
+                    self._find_removed_accessions,
+                    ['hash_staged_accessions'],
+                    'tmp_removed_accessions'
+                ),
+                # the removed accessions are found from the full set of hashes, before unchanged ones are dropped
+                Stage(
+                    'drop_unchanged_accessions',
+                    self._drop_unchanged_accessions,
+                    ['hash_staged_accessions', 'find_removed_accessions'],
+                    'tmp_accession_hashes'
+                ),
+                Stage('remove_changed_accessions', self._remove_changed_accessions, ['drop_unchanged_accessions']),
+            ]
+        # a full load only needs the hashes for the ledger, so they are computed alongside everything else
+        index_deps = ['drop_unchanged_accessions'] if self.incremental else reads
+
+        stages += [
+            Stage('index_tmp_tables', self._index_tmp_tables, index_deps),
+
+            # alleles
+            Stage('stage_alleles', self._stage_alleles, ['index_tmp_tables'], 'tmp_alleles'),
+            Stage('write_allele_ref_conflicts', self._write_allele_ref_conflicts, ['stage_alleles']),
+            Stage('drop_fks_using_allele_id', self._drop_fks_using_allele_id, ['stage_alleles']),
+            Stage('drop_alleles_indexes', self._drop_alleles_indexes, ['drop_fks_using_allele_id']),
+            Stage('insert_alleles', self._insert_alleles, ['drop_alleles_indexes']),
+            Stage('restore_alleles_indexes', self._restore_alleles_indexes, ['insert_alleles']),
+
+            # amino acids
+            Stage(
+                'stage_amino_acids',
+                self._stage_amino_acids,
+                ['index_tmp_tables', 'set_up_codon_translation'],
+                'tmp_amino_acids'
+            ),
+            Stage('write_amino_acid_ref_conflicts', self._write_amino_acid_ref_conflicts, ['stage_amino_acids']),
+            Stage('drop_fks_using_amino_acid_id', self._drop_fks_using_amino_acid_id, ['stage_amino_acids']),
+            Stage('drop_amino_acids_indexes', self._drop_amino_acids_indexes, ['drop_fks_using_amino_acid_id']),
+            Stage('insert_amino_acids', self._insert_amino_acids, ['drop_amino_acids_indexes']),
+            Stage('restore_amino_acids_indexes', self._restore_amino_acids_indexes, ['insert_amino_acids']),
+            Stage(
+                'restore_fks_using_amino_acid_id',
+                self._restore_fks_using_amino_acid_id,
+                ['restore_amino_acids_indexes']
+            ),
+
+            # intrahost samples - alleles
+            Stage(
+                'stage_ih_samples_by_allele',
+                self._stage_ih_samples_by_allele,
+                ['restore_alleles_indexes', 'set_up_freq_bins'],
+                'tmp_ih_samples_alleles_staging'
+            ),
+            Stage(
+                'drop_ih_samples_by_allele_indexes',
+                self._drop_ih_samples_by_allele_indexes,
+                ['stage_ih_samples_by_allele']
+            ),
+            Stage(
+                'insert_ih_samples_by_allele',
+                self._insert_ih_samples_by_allele,
+                ['drop_ih_samples_by_allele_indexes', *merge_deps]
+            ),
+            Stage(
+                'restore_ih_samples_by_allele_indexes',
+                self._restore_ih_samples_by_allele_indexes,
+                ['insert_ih_samples_by_allele']
+            ),
+
+            Stage(
+                'validate_ih_samples_by_allele',
+                self._validate_ih_samples_by_allele,
+                ['restore_ih_samples_by_allele_indexes']
+            ),
+
+            # consensus samples - alleles
+            Stage(
+                'stage_cns_samples_by_allele',
+                self._stage_cns_samples_by_allele,
+                ['restore_alleles_indexes'],
+                'tmp_mutations_staging'
+            ),
+            Stage(
+                'insert_cns_samples_by_allele',
+                self._insert_cns_samples_by_allele,
+                ['stage_cns_samples_by_allele', *merge_deps]
+            ),
+            Stage(
+                'restore_cns_samples_by_allele_indexes',
+                self._restore_cns_samples_by_allele_indexes,
+                ['insert_cns_samples_by_allele']
+            ),
+
+            # intrahost samples - amino acids
+            Stage(
+                'stage_ih_samples_by_amino_acid',
+                self._stage_ih_samples_by_amino_acid,
+                ['restore_amino_acids_indexes', 'set_up_freq_bins'],
+                'tmp_ih_samples_by_amino_acid_staging'
+            ),
+            Stage(
+                'drop_ih_samples_by_amino_acid_indexes',
+                self._drop_ih_samples_by_amino_acid_indexes,
+                ['stage_ih_samples_by_amino_acid']
+            ),
+            Stage(
+                'insert_ih_samples_by_amino_acid',
+                self._insert_ih_samples_by_amino_acid,
+                ['drop_ih_samples_by_amino_acid_indexes', *merge_deps]
+            ),
+            Stage(
+                'restore_ih_samples_by_amino_acid_indexes',
+                self._restore_ih_samples_by_amino_acid_indexes,
+                ['insert_ih_samples_by_amino_acid']
+            ),
+
+            Stage(
+                'validate_ih_samples_by_amino_acid',
+                self._validate_ih_samples_by_amino_acid,
+                ['restore_ih_samples_by_amino_acid_indexes']
+            ),
+
+            # consensus samples - amino acids
+            Stage(
+                'stage_cns_samples_by_amino_acid',
+                self._stage_cns_samples_by_amino_acid,
+                ['restore_amino_acids_indexes'],
+                'tmp_mutation_translations_staging'
+            ),
+            Stage(
+                'insert_cns_samples_by_amino_acid',
+                self._insert_cns_samples_by_amino_acid,
+                ['stage_cns_samples_by_amino_acid', *merge_deps]
+            ),
+            Stage(
+                'restore_cns_samples_by_amino_acid_indexes',
+                self._restore_cns_samples_by_amino_acid_indexes,
+                ['insert_cns_samples_by_amino_acid']
+            ),
+
+            # transpositions
+            Stage('transpose_cns_alleles', self._transpose_cns_alleles, transpose_deps['cns_samples_by_allele']),
+            Stage(
+                'transpose_cns_amino_acids',
+                self._transpose_cns_amino_acids,
+                transpose_deps['cns_samples_by_amino_acid']
+            ),
+            Stage('transpose_ih_alleles', self._transpose_ih_alleles, transpose_deps['ih_samples_by_allele']),
+            Stage(
+                'transpose_ih_amino_acids',
+                self._transpose_ih_amino_acids,
+                transpose_deps['ih_samples_by_amino_acid']
+            ),
+
+            # only record accessions as merged once everything depending on them is done
+            Stage(
+                'update_ingest_ledger',
+                self._update_ingest_ledger,
+                [
+                    'hash_staged_accessions',
+                    'write_allele_ref_conflicts',
+                    'write_amino_acid_ref_conflicts',
+                    'restore_fks_using_amino_acid_id',
+                    'validate_ih_samples_by_allele',
+                    'validate_ih_samples_by_amino_acid',
+                    'transpose_cns_alleles',
+                    'transpose_cns_amino_acids',
+                    'transpose_ih_alleles',
+                    'transpose_ih_amino_acids',
+                ]
+            ),
+            Stage('clean_up_tmp_tables', self._clean_up_tmp_tables, ['update_ingest_ledger']),
+        ]
+        return stages
+
+    async def _copy_files_into_table(self, record_type: RecordType, tablename: str):
+        files = [f for f in self.input_files if f.record_type == record_type]
+        await asyncio.gather(
+            *[
+                file.copy_into_table_in_parallel(
+                    tablename,
+                    self._load_slots,
+                    n_shards=self.load_parallelism,
+                    row_filter=self._get_row_filter(file)
+                )
+                for file in files
+            ]
+        )
+
+    def _get_row_filter(self, file: 'VariantsMutationsCombinedParser.InputFile') -> Callable[[List[str]], bool] | None:
+        if file.record_type == RecordType.ih_nts:
+            return self._get_ih_nt_row_filter(file.header_order)
+        return None
+
+    async def _index_tmp_tables(self):
+        await run_statements_in_parallel(
+            [
+                'create index if not exists ix_tmp_mutations_accession on tmp_mutations (accession);',
+                'create index if not exists ix_tmp_ih_nt_accession on tmp_ih_nt (accession);',
+                'create index if not exists ix_tmp_ih_codons_accession on tmp_ih_codons (accession);',
+                'create index if not exists ix_tmp_mutations_nt_values on tmp_mutations (region, position_nt, ref_nt, alt_nt);',
+                'create index if not exists ix_tmp_ih_nt_nt_values on tmp_ih_nt (region, position_nt, ref_nt, alt_nt);',
+                'create index if not exists ix_tmp_mutations_aa_values on tmp_mutations (gff_feature, position_aa, alt_aa, alt_codon, ref_aa, ref_codon);',
+                'create index if not exists ix_tmp_ih_codons_aa_values on tmp_ih_codons (gff_feature, position_aa, alt_codon, ref_codon);',
+                # partial index on tmp_mutations to help with distinct when staging consensus amino acids
+                'create index if not exists ix_tmp_mutations_sample_aa\n'
+                '    on tmp_mutations (accession, gff_feature, position_aa, alt_aa, alt_codon)\n'
+                '    where gff_feature is not null\n'
+                '        and position_aa is not null\n'
+                '        and alt_aa is not null\n'
+                '        and ref_aa is not null;',
+            ],
+            self.load_parallelism
+        )
+
+    async def _hash_staged_accessions(self):
+        """
+        Hash the loaded content of each accession, per record type, for comparison against the ingest ledger.
+        Hashes are taken after filtering, so they reflect what actually gets merged.
+        """
+        async with get_async_write_session() as session:
+            await session.execute(text('drop table if exists tmp_accession_hashes;'))
+            await session.execute(
+                text(
+                    f'create unlogged table tmp_accession_hashes (\n'
+                    f'    {ColumnNames.record_type}  text not null,\n'
+                    f'    {ColumnNames.accession}    text not null,\n'
+                    f'    {ColumnNames.source_file}  text not null,\n'
+                    f'    {ColumnNames.content_hash} text not null\n'
+                    f');'
+                )
+            )
+            await session.commit()
+
+        statements = []
+        for record_type, tablename in self.tmp_tables_by_record_type.items():
+            source_files = ','.join(f.raw_name for f in self.input_files if f.record_type == record_type)
+            source_files = source_files.replace("'", "''")
+            statements.append(
+                f'insert into tmp_accession_hashes (\n'
+                f'    {ColumnNames.record_type}, {ColumnNames.accession}, {ColumnNames.source_file}, {ColumnNames.content_hash}\n'
+                f')\n'
+                f'select \'{record_type.name}\', t.accession, \'{source_files}\', md5(string_agg(t::text, E\'\\n\' order by t::text))\n'
+                f'from {tablename} t\n'
+                f'group by t.accession;'
+            )
+        await run_statements_in_parallel(statements, self.load_parallelism)
+
+        async with get_async_write_session() as session:
+            await session.execute(
+                text(
+                    f'create index ix_tmp_accession_hashes on tmp_accession_hashes '
+                    f'({ColumnNames.record_type}, {ColumnNames.accession});'
+                )
+            )
+            await session.commit()
+
+    async def _find_removed_accessions(self):
+        """
+        Accessions in the ledger for a record type being ingested that no longer appear in its input.
+        Record types without input files in this run are left alone, so ingesting e.g. only mutations
+        doesn't remove the intra-host data of every accession.
+        """
+        record_types = list({f.record_type.name for f in self.input_files})
+        async with get_async_write_session() as session:
+            await session.execute(text('drop table if exists tmp_removed_accessions;'))
+            await session.execute(
+                text(
+                    f'create unlogged table tmp_removed_accessions as\n'
+                    f'select l.{ColumnNames.record_type}, l.{ColumnNames.accession}\n'
+                    f'from {TableNames.ingest_ledger} l\n'
+                    f'where l.{ColumnNames.record_type} = any(:record_types)\n'
+                    f'  and not exists (\n'
+                    f'      select 1\n'
+                    f'      from tmp_accession_hashes h\n'
+                    f'      where h.{ColumnNames.record_type} = l.{ColumnNames.record_type}\n'
+                    f'        and h.{ColumnNames.accession} = l.{ColumnNames.accession}\n'
+                    f'  );'
+                ),
+                {'record_types': record_types}
+            )
+            await session.commit()
+
+    async def _drop_unchanged_accessions(self):
+        statements = [
+            f'delete from {tablename} t\n'
+            f'using tmp_accession_hashes h\n'
+            f'inner join {TableNames.ingest_ledger} l using ({ColumnNames.record_type}, {ColumnNames.accession}, {ColumnNames.content_hash})\n'
+            f'where h.{ColumnNames.record_type} = \'{record_type.name}\'\n'
+            f'  and h.{ColumnNames.accession} = t.{ColumnNames.accession};'
+            for record_type, tablename in self.tmp_tables_by_record_type.items()
+        ]
+        statements.append(
+            f'delete from tmp_accession_hashes h\n'
+            f'using {TableNames.ingest_ledger} l\n'
+            f'where l.{ColumnNames.record_type} = h.{ColumnNames.record_type}\n'
+            f'  and l.{ColumnNames.accession} = h.{ColumnNames.accession}\n'
+            f'  and l.{ColumnNames.content_hash} = h.{ColumnNames.content_hash};'
+        )
+        # the tmp table deletes must see the full set of hashes, so the last statement has to run on its own
+        await run_statements_in_parallel(statements[:-1], self.load_parallelism)
+        async with get_async_write_session() as session:
+            await session.execute(text(statements[-1]))
+            await session.commit()
+
+    @staticmethod
+    async def _remove_changed_accessions():
+        """
+        Bitmaps are merged with OR, so samples whose content changed since their last ingest
+        have to be taken out of every table fed by that record type before the new content is merged.
+        Samples that are gone from the input altogether are taken out the same way.
+        """
+        tables_by_record_type = {
+            RecordType.mutations: [
+                (TableNames.cns_samples_by_allele, ColumnNames.samples_present),
+                (TableNames.cns_samples_by_amino_acid, ColumnNames.samples_present),
+            ],
+            RecordType.ih_nts: [(TableNames.ih_samples_by_allele, ColumnNames.samples_present)],
+            RecordType.ih_codons: [(TableNames.ih_samples_by_amino_acid, ColumnNames.samples_present)],
+        }
+        by_sample_tables_by_record_type = {
+            RecordType.mutations: [TableNames.cns_alleles_by_sample, TableNames.cns_amino_acids_by_sample],
+            RecordType.ih_nts: [TableNames.ih_alleles_by_sample],
+            RecordType.ih_codons: [TableNames.ih_amino_acids_by_sample],
+        }
+        async with get_async_write_session() as session:
+            for record_type, tables in tables_by_record_type.items():
+                changed_samples = (
+                    f'with changed as (\n'
+                    f'    select rb_build_agg(s.id) as bm\n'
+                    f'    from (\n'
+                    f'        select h.{ColumnNames.accession}\n'
+                    f'        from tmp_accession_hashes h\n'
+                    f'        inner join {TableNames.ingest_ledger} l using ({ColumnNames.record_type}, {ColumnNames.accession})\n'
+                    f'        where h.{ColumnNames.record_type} = \'{record_type.name}\'\n'
+                    f'        union\n'
+                    f'        select r.{ColumnNames.accession}\n'
+                    f'        from tmp_removed_accessions r\n'
+                    f'        where r.{ColumnNames.record_type} = \'{record_type.name}\'\n'
+                    f'    ) a\n'
+                    f'    inner join {TableNames.samples} s on s.{ColumnNames.accession} = a.{ColumnNames.accession}\n'
+                    f')\n'
+                )
+                for tablename, bitmap_col in tables:
+                    # rows left with no samples at all are removed rather than kept as empty bitmaps
+                    await session.execute(
+                        text(
+                            f'{changed_samples}'
+                            f'delete from {tablename} t\n'
+                            f'using changed\n'
+                            f'where rb_intersect(t.{bitmap_col}, changed.bm)\n'
+                            f'  and rb_andnot_cardinality(t.{bitmap_col}, changed.bm) = 0;'
+                        )
+                    )
+                    await session.execute(
+                        text(
+                            f'{changed_samples}'
+                            f'update {tablename} t\n'
+                            f'set {bitmap_col} = rb_andnot(t.{bitmap_col}, changed.bm)\n'
+                            f'from changed\n'
+                            f'where rb_intersect(t.{bitmap_col}, changed.bm);'
+                        )
+                    )
+                for tablename in by_sample_tables_by_record_type.get(record_type, []):
+                    await session.execute(
+                        text(
+                            f'{changed_samples}'
+                            f'delete from {tablename} t\n'
+                            f'using changed\n'
+                            f'where rb_contains(changed.bm, t.{ColumnNames.sample_id});'
+                        )
+                    )
+            await session.commit()
+
+    async def _update_ingest_ledger(self):
+        async with get_async_write_session() as session:
+            if self.incremental:
+                await session.execute(
+                    text(
+                        f'delete from {TableNames.ingest_ledger} l\n'
+                        f'using tmp_removed_accessions r\n'
+                        f'where l.{ColumnNames.record_type} = r.{ColumnNames.record_type}\n'
+                        f'  and l.{ColumnNames.accession} = r.{ColumnNames.accession};'
+                    )
+                )
+            await session.execute(
+                text(
+                    f'insert into {TableNames.ingest_ledger} as target (\n'
+                    f'    {ColumnNames.accession}, {ColumnNames.record_type}, {ColumnNames.source_file}, {ColumnNames.content_hash}\n'
+                    f')\n'
+                    f'select {ColumnNames.accession}, {ColumnNames.record_type}, {ColumnNames.source_file}, {ColumnNames.content_hash}\n'
+                    f'from tmp_accession_hashes\n'
+                    f'on conflict on constraint {ConstraintNames.pk_ingest_ledger} do update\n'
+                    f'set {ColumnNames.source_file} = excluded.{ColumnNames.source_file},\n'
+                    f'    {ColumnNames.content_hash} = excluded.{ColumnNames.content_hash},\n'
+                    f'    {ColumnNames.ingested_at} = now()\n'
+                    f'where target.{ColumnNames.content_hash} <> excluded.{ColumnNames.content_hash};'
+                )
+            )
+            await session.commit()
+
     async def _read_mutations_input(self):
         async with get_async_write_session() as session:
+            # loading spans several transactions, so a resumed run may find a partially loaded table
+            await session.execute(text('drop table if exists tmp_mutations;'))
             await session.execute(
                 text(
                     f'create unlogged table tmp_mutations\n'
@@ -125,10 +587,11 @@ class VariantsMutationsCombinedParser(FileParser):
                     f');'
                 )
             )
-            for file in self.input_files:
-                if file.record_type == RecordType.mutations:
-                    await file.copy_into_table('tmp_mutations', session)
+            await session.commit()
+
+        await self._copy_files_into_table(RecordType.mutations, 'tmp_mutations')
 
+        async with get_async_write_session() as session:
             await session.execute(
                 text(
                     'delete from tmp_mutations\n'
@@ -149,12 +612,11 @@ class VariantsMutationsCombinedParser(FileParser):
                 text('delete from tmp_mutations where ref_nt is null;')
             )
 
-            await session.execute(text('create index ix_tmp_mutations_accession on tmp_mutations (accession);'))
-
             await session.commit()
 
     async def _read_ih_nts_input(self):
         async with get_async_write_session() as session:
+            await session.execute(text('drop table if exists tmp_ih_nt;'))
             await session.execute(
                 text(
                     'create unlogged table tmp_ih_nt (\n'
@@ -189,22 +651,24 @@ class VariantsMutationsCombinedParser(FileParser):
                     ');'
                 )
             )
+            await session.commit()
 
-            for file in self.input_files:
-                if file.record_type == RecordType.ih_nts:
-                    await file.copy_into_table('tmp_ih_nt', session)
+        await self._copy_files_into_table(RecordType.ih_nts, 'tmp_ih_nt')
 
-            await session.execute(text('delete from tmp_ih_nt where alt_nt = ref_nt;'))
+        async with get_async_write_session() as session:
+            if not self.client_side_copy:
+                # rows are filtered while streaming in client side mode
+                await session.execute(text('delete from tmp_ih_nt where alt_nt = ref_nt;'))
 
-            await session.execute(
-                text('delete from tmp_ih_nt where gapped_freq < :threshold;'),
-                {'threshold': self.ih_nt_min_freq}
-            )
+                await session.execute(
+                    text('delete from tmp_ih_nt where gapped_freq < :threshold;'),
+                    {'threshold': self.ih_nt_min_freq}
+                )
 
-            await session.execute(
-                text('delete from tmp_ih_nt where gapped_dp < :threshold;'),
-                {'threshold': self.ih_nt_min_depth}
-            )
+                await session.execute(
+                    text('delete from tmp_ih_nt where gapped_dp < :threshold;'),
+                    {'threshold': self.ih_nt_min_depth}
+                )
 
             await session.execute(
                 text(
@@ -215,11 +679,11 @@ class VariantsMutationsCombinedParser(FileParser):
                     ');'
                 )
             )
-            await session.execute(text('create index ix_tmp_ih_nt_accession on tmp_ih_nt (accession);'))
             await session.commit()
 
     async def _read_ih_codons_input(self):
         async with get_async_write_session() as session:
+            await session.execute(text('drop table if exists tmp_ih_codons;'))
             await session.execute(
                 text(
                     'create unlogged table tmp_ih_codons (\n'
@@ -237,10 +701,11 @@ class VariantsMutationsCombinedParser(FileParser):
                     ');'
                 )
             )
-            for file in self.input_files:
-                if file.record_type == RecordType.ih_codons:
-                    await file.copy_into_table('tmp_ih_codons', session)
+            await session.commit()
 
+        await self._copy_files_into_table(RecordType.ih_codons, 'tmp_ih_codons')
+
+        async with get_async_write_session() as session:
             await session.execute(text('delete from tmp_ih_codons where alt_codon = ref_codon;'))
 
             await session.execute(
@@ -263,12 +728,13 @@ class VariantsMutationsCombinedParser(FileParser):
                     ');'
                 )
             )
-            await session.execute(text('create index ix_tmp_ih_codons_accession on tmp_ih_codons (accession);'))
             await session.commit()
 
     @staticmethod
     async def _stage_alleles():
         async with get_async_write_session() as session:
+            # left behind if the run died after this stage committed but before it was recorded as done
+            await session.execute(text('drop table if exists tmp_alleles;'))
             await session.execute(
                 text(
                     'create unlogged table tmp_alleles\n'
@@ -281,13 +747,6 @@ class VariantsMutationsCombinedParser(FileParser):
                 )
             )
 
-            await session.execute(
-                text('create index ix_tmp_mutations_nt_values on tmp_mutations (region, position_nt, ref_nt, alt_nt);')
-            )
-            await session.execute(
-                text('create index ix_tmp_ih_nt_nt_values on tmp_ih_nt (region, position_nt, ref_nt, alt_nt);')
-            )
-
             # get allele values from mutations
             await session.execute(
                 text(
@@ -334,11 +793,10 @@ class VariantsMutationsCombinedParser(FileParser):
 
             await session.commit()
 
-    @staticmethod
-    async def _insert_alleles():
+    async def _insert_alleles(self) -> int:
         async with get_async_write_session() as session:
             # insert, takes the first value in ref conflicts
-            await session.execute(
+            res = await session.execute(
                 text(
                     'insert into alleles (\n'
                     '    region, position_nt, alt_nt, ref_nt\n'
@@ -347,8 +805,10 @@ class VariantsMutationsCombinedParser(FileParser):
                     'from tmp_alleles;'
                 )
             )
-
+            # with the unique indexes dropped, running this again would insert every allele twice
+            await record_ingest_run_stage(session, self._ingest_run_id, 'insert_alleles')
             await session.commit()
+        return res.rowcount
 
     @staticmethod
     async def _write_allele_ref_conflicts():
@@ -377,6 +837,7 @@ class VariantsMutationsCombinedParser(FileParser):
     @staticmethod
     async def _stage_amino_acids():
         async with get_async_write_session() as session:
+            await session.execute(text('drop table if exists tmp_amino_acids;'))
             await session.execute(
                 text(
                     'create unlogged table tmp_amino_acids\n'
@@ -391,16 +852,21 @@ class VariantsMutationsCombinedParser(FileParser):
                 )
             )
 
+            # codons containing an N translate to X, add those seen in this run to the translation table
             await session.execute(
                 text(
-                    'create index ix_tmp_mutations_aa_values on tmp_mutations (gff_feature, position_aa, alt_aa, alt_codon, ref_aa, ref_codon);'
-                )
-            )
-            await session.execute(
-                text(
-                    'create index ix_tmp_ih_codons_aa_values on tmp_ih_codons (gff_feature, position_aa, alt_codon, ref_codon);'
+                    'insert into tmp_codon_translations (codon, aa)\n'
+                    'select codon, \'X\'\n'
+                    'from (\n'
+                    '    select alt_codon as codon from tmp_ih_codons\n'
+                    '    union\n'
+                    '    select ref_codon as codon from tmp_ih_codons\n'
+                    ') codons\n'
+                    'where codon like \'%N%\'\n'
+                    'on conflict (codon) do nothing;'
                 )
             )
+            await session.execute(text('analyze tmp_codon_translations;'))
 
             # from intrahost codons
             await session.execute(
@@ -408,14 +874,16 @@ class VariantsMutationsCombinedParser(FileParser):
                     'insert into tmp_amino_acids (\n'
                     '    gff_feature, position_aa, alt_aa, alt_codon, ref_aa, ref_codon\n'
                     ')\n'
-                    'select distinct on (gff_feature, position_aa, alt_codon, ref_codon)\n'
-                    '       gff_feature,\n'
-                    '       position_aa,\n'
-                    '       translate_codon(alt_codon) as alt_aa,\n'
-                    '       alt_codon,\n'
-                    '       translate_codon(ref_codon) as ref_aa,\n'
-                    '       ref_codon\n'
-                    'from tmp_ih_codons;\n'
+                    'select distinct on (tic.gff_feature, tic.position_aa, tic.alt_codon, tic.ref_codon)\n'
+                    '       tic.gff_feature,\n'
+                    '       tic.position_aa,\n'
+                    '       alt_t.aa as alt_aa,\n'
+                    '       tic.alt_codon,\n'
+                    '       ref_t.aa as ref_aa,\n'
+                    '       tic.ref_codon\n'
+                    'from tmp_ih_codons tic\n'
+                    'left join tmp_codon_translations alt_t on alt_t.codon = tic.alt_codon\n'
+                    'left join tmp_codon_translations ref_t on ref_t.codon = tic.ref_codon;\n'
                 )
             )
 
@@ -464,11 +932,10 @@ class VariantsMutationsCombinedParser(FileParser):
             )
             await session.commit()
 
-    @staticmethod
-    async def _insert_amino_acids():
+    async def _insert_amino_acids(self) -> int:
         async with get_async_write_session() as session:
             # insert, takes the first value seen in ref conflicts
-            await session.execute(
+            res = await session.execute(
                 text(
                     'insert into amino_acids (\n'
                     '    gff_feature, position_aa, alt_aa, alt_codon, ref_aa, ref_codon\n'
@@ -483,8 +950,10 @@ class VariantsMutationsCombinedParser(FileParser):
                     'from tmp_amino_acids;'
                 )
             )
-
+            # with the unique indexes dropped, running this again would insert every amino acid twice
+            await record_ingest_run_stage(session, self._ingest_run_id, 'insert_amino_acids')
             await session.commit()
+        return res.rowcount
 
     @staticmethod
     async def _write_amino_acid_ref_conflicts():
@@ -526,9 +995,12 @@ class VariantsMutationsCombinedParser(FileParser):
             else:
                 print('no conflicts found', file=f)
 
-    @staticmethod
-    async def _stage_cns_samples_by_allele():
+    async def _stage_cns_samples_by_allele(self):
+        if self.bitmap_engine == BitmapEngine.client:
+            await self._stage_cns_samples_by_allele_client_side()
+            return
         async with get_async_write_session() as session:
+            await session.execute(text('drop table if exists tmp_mutations_staging;'))
             await session.execute(
                 text(
                     'create unlogged table tmp_mutations_staging as\n'
@@ -543,9 +1015,9 @@ class VariantsMutationsCombinedParser(FileParser):
             await session.commit()
 
     @staticmethod
-    async def _insert_cns_samples_by_allele():
+    async def _insert_cns_samples_by_allele() -> int:
         async with get_async_write_session() as session:
-            await session.execute(
+            res = await session.execute(
                 text(
                     f'insert into {TableNames.cns_samples_by_allele} as target ({ColumnNames.allele_id}, {ColumnNames.samples_present})\n'
                     f'select allele_id, s_present\n'
@@ -555,26 +1027,48 @@ class VariantsMutationsCombinedParser(FileParser):
                 )
             )
             await session.commit()
+        return res.rowcount
 
-    async def _set_up_freq_bins(self):
+    def _get_freq_bin_bounds(self) -> List[Tuple[float, float, bool]]:
+        """
+        :return: (lower, upper, upper inclusive) for each frequency bin, in order.
+        All bins are half-open except the last, which is closed so that it ends at 1.
+        """
         if 1000 % self.n_freq_bins != 0:
             raise ValueError(f'Invalid number of bins: {self.n_freq_bins}. We require 1000 % nbins == 0.')
         width = int(1000 / self.n_freq_bins)
         breaks = [i / 1000 for i in range(0, 1000, width)]
+        bounds = [(breaks[i], breaks[i + 1], False) for i in range(len(breaks) - 1)]
+        bounds.append((breaks[-1], 1, True))
+        return bounds
+
+    def _get_freq_bin_ranges(self) -> List[asyncpg.Range]:
+        # built from the same literals as tmp_freq_bins, so that the numrange values come out identical
+        return [
+            asyncpg.Range(Decimal(str(lower)), Decimal(str(upper)), upper_inc=upper_inc)
+            for lower, upper, upper_inc in self._get_freq_bin_bounds()
+        ]
+
+    def _get_freq_bin_expr(self, freq_col: str) -> pl.Expr:
+        """
+        :return: expression giving the index of the frequency bin containing freq_col, or null if there is none
+        """
+        expr = pl.lit(None, dtype=pl.UInt8)
+        for i, (lower, upper, upper_inc) in reversed(list(enumerate(self._get_freq_bin_bounds()))):
+            below_upper = pl.col(freq_col) <= upper if upper_inc else pl.col(freq_col) < upper
+            expr = pl.when((pl.col(freq_col) >= lower) & below_upper).then(pl.lit(i, dtype=pl.UInt8)).otherwise(expr)
+        return expr
 
+    async def _set_up_freq_bins(self):
         bin_ranges = []
-        # all but the last range, all half-open
-        for i in range(len(breaks)):
-            start = breaks[i]
-            try:
-                end = breaks[i + 1]
-            except IndexError:
-                break
-            bin_ranges.append(f'(numrange({start}, {end}))')
-        # add the last bin ending at 1 and closed
-        bin_ranges.append(f"(numrange({breaks[-1]}, 1, '[]'))")
+        for lower, upper, upper_inc in self._get_freq_bin_bounds():
+            if upper_inc:
+                bin_ranges.append(f"(numrange({lower}, {upper}, '[]'))")
+            else:
+                bin_ranges.append(f'(numrange({lower}, {upper}))')
 
         async with get_async_write_session() as session:
+            await session.execute(text('drop table if exists tmp_freq_bins;'))
             await session.execute(
                 text(
                     'create unlogged table tmp_freq_bins (\n'
@@ -588,9 +1082,12 @@ class VariantsMutationsCombinedParser(FileParser):
 
             await session.commit()
 
-    @staticmethod
-    async def _stage_ih_samples_by_allele():
+    async def _stage_ih_samples_by_allele(self):
+        if self.bitmap_engine == BitmapEngine.client:
+            await self._stage_ih_samples_by_allele_client_side()
+            return
         async with get_async_write_session() as session:
+            await session.execute(text('drop table if exists tmp_ih_samples_alleles_staging;'))
             await session.execute(
                 text(
                     'create unlogged table tmp_ih_samples_alleles_staging as\n'
@@ -605,9 +1102,9 @@ class VariantsMutationsCombinedParser(FileParser):
             await session.commit()
 
     @staticmethod
-    async def _insert_ih_samples_by_allele():
+    async def _insert_ih_samples_by_allele() -> int:
         async with get_async_write_session() as session:
-            await session.execute(
+            res = await session.execute(
                 text(
                     'insert into ih_samples_by_allele as target (allele_id, alt_freq_range, samples_present)\n'
                     'select allele_id, freq_bin, s_present\n'
@@ -617,23 +1114,72 @@ class VariantsMutationsCombinedParser(FileParser):
                 )
             )
             await session.commit()
+        return res.rowcount
 
     @staticmethod
-    async def _stage_cns_samples_by_amino_acid():
-        async with get_async_write_session() as session:
-            # create a partial index on tmp_mutations to help with distinct in the next step
-            await session.execute(
+    async def _validate_ih_samples_by_allele():
+        await VariantsMutationsCombinedParser._write_ih_violations(
+            TableNames.ih_samples_by_allele,
+            ColumnNames.allele_id,
+            'select allele_id from tmp_ih_samples_alleles_staging',
+            IH_SAMPLES_BY_ALLELE_VIOLATIONS_FILE
+        )
+
+    @staticmethod
+    async def _validate_ih_samples_by_amino_acid():
+        await VariantsMutationsCombinedParser._write_ih_violations(
+            TableNames.ih_samples_by_amino_acid,
+            ColumnNames.amino_acid_id,
+            'select amino_acid_id from tmp_ih_samples_by_amino_acid_staging',
+            IH_SAMPLES_BY_AMINO_ACID_VIOLATIONS_FILE
+        )
+
+    @staticmethod
+    async def _write_ih_violations(tablename: str, change_id_col: str, touched_ids: str, filename: str):
+        """
+        Set-based equivalent of the row triggers on the intra-host tables, run over the change ids touched
+        by this ingest only: for each change, its frequency ranges must not overlap, and no sample may
+        appear in more than one of them.
+        Sorted by lower bound, any overlap shows up between neighbouring ranges, and a sample in more
+        than one range makes the sum of the cardinalities exceed the cardinality of the union.
+        """
+        async with get_async_session() as session:
+            res = await session.execute(
                 text(
-                    'create index ix_tmp_mutations_sample_aa\n'
-                    '    on tmp_mutations (accession, gff_feature, position_aa, alt_aa, alt_codon)\n'
-                    '    where gff_feature is not null\n'
-                    '        and position_aa is not null\n'
-                    '        and alt_aa is not null\n'
-                    '        and ref_aa is not null;'
+                    f'select {change_id_col},\n'
+                    f'       bool_or(overlaps_next) as overlapping_ranges,\n'
+                    f'       sum(rb_cardinality({ColumnNames.samples_present})) - rb_or_cardinality_agg({ColumnNames.samples_present})\n'
+                    f'           as samples_in_several_ranges\n'
+                    f'from (\n'
+                    f'    select {change_id_col},\n'
+                    f'           {ColumnNames.samples_present},\n'
+                    f'           {ColumnNames.alt_freq_range} && lead({ColumnNames.alt_freq_range}) over (\n'
+                    f'               partition by {change_id_col} order by {ColumnNames.alt_freq_range}\n'
+                    f'           ) as overlaps_next\n'
+                    f'    from {tablename}\n'
+                    f'    where {change_id_col} in ({touched_ids})\n'
+                    f') ranges\n'
+                    f'group by {change_id_col}\n'
+                    f'having bool_or(overlaps_next)\n'
+                    f'    or sum(rb_cardinality({ColumnNames.samples_present})) > rb_or_cardinality_agg({ColumnNames.samples_present});'
                 )
             )
+        violations = res.mappings().all()
+        with open(filename, 'w+') as f:
+            if len(violations) > 0:
+                print(f'Warning: {len(violations)} {change_id_col}s in {tablename} failed validation. See {filename}')
+                writer = csv.DictWriter(f, fieldnames=violations[0].keys())
+                writer.writeheader()
+                writer.writerows(violations)
+            else:
+                print('no violations found', file=f)
 
-            # create staging table
+    async def _stage_cns_samples_by_amino_acid(self):
+        if self.bitmap_engine == BitmapEngine.client:
+            await self._stage_cns_samples_by_amino_acid_client_side()
+            return
+        async with get_async_write_session() as session:
+            await session.execute(text('drop table if exists tmp_mutation_translations_staging;'))
             await session.execute(
                 text(
                     'create unlogged table tmp_mutation_translations_staging as\n'
@@ -657,9 +1203,9 @@ class VariantsMutationsCombinedParser(FileParser):
             await session.commit()
 
     @staticmethod
-    async def _insert_cns_samples_by_amino_acid():
+    async def _insert_cns_samples_by_amino_acid() -> int:
         async with get_async_write_session() as session:
-            await session.execute(
+            res = await session.execute(
                 text(
                     f'insert into {TableNames.cns_samples_by_amino_acid} as target (amino_acid_id, {ColumnNames.samples_present})\n'
                     f'select amino_acid_id, s_present\n'
@@ -669,10 +1215,14 @@ class VariantsMutationsCombinedParser(FileParser):
                 )
             )
             await session.commit()
+        return res.rowcount
 
-    @staticmethod
-    async def _stage_ih_samples_by_amino_acid():
+    async def _stage_ih_samples_by_amino_acid(self):
+        if self.bitmap_engine == BitmapEngine.client:
+            await self._stage_ih_samples_by_amino_acid_client_side()
+            return
         async with get_async_write_session() as session:
+            await session.execute(text('drop table if exists tmp_ih_samples_by_amino_acid_staging;'))
             await session.execute(
                 text(
                     'create unlogged table tmp_ih_samples_by_amino_acid_staging as (\n'
@@ -692,9 +1242,9 @@ class VariantsMutationsCombinedParser(FileParser):
             await session.commit()
 
     @staticmethod
-    async def _insert_ih_samples_by_amino_acid():
+    async def _insert_ih_samples_by_amino_acid() -> int:
         async with get_async_write_session() as session:
-            await session.execute(
+            res = await session.execute(
                 text(
                     'insert into ih_samples_by_amino_acid as target (amino_acid_id, alt_freq_range, samples_present)\n'
                     'select amino_acid_id, alt_freq_bin, s_present\n'
@@ -704,53 +1254,268 @@ class VariantsMutationsCombinedParser(FileParser):
                 )
             )
             await session.commit()
+        return res.rowcount
+
+    async def _get_sample_ids(self) -> pl.DataFrame:
+        # shared by the client side staging steps, which may run at the same time
+        if self._sample_ids is None:
+            self._sample_ids = asyncio.create_task(
+                read_tmp_table(f'select id as {ColumnNames.sample_id}, {ColumnNames.accession} from {TableNames.samples}')
+            )
+        return await self._sample_ids
+
+    async def _stage_cns_samples_by_allele_client_side(self):
+        mutations = await read_tmp_table('select accession, region, position_nt, alt_nt from tmp_mutations')
+        alleles = await read_tmp_table(f'select id as allele_id, region, position_nt, alt_nt from {TableNames.alleles}')
+        pairs = (
+            mutations
+            .join(alleles, on=['region', 'position_nt', 'alt_nt'])
+            .join(await self._get_sample_ids(), on=ColumnNames.accession)
+        )
+        bitmaps = await build_bitmaps(pairs, ['allele_id'], ColumnNames.sample_id, self.bitmap_workers)
 
-    @staticmethod
-    async def _transpose_cns_alleles():
         async with get_async_write_session() as session:
+            await session.execute(text('drop table if exists tmp_mutations_staging;'))
             await session.execute(
                 text(
-                    f'insert into {TableNames.cns_alleles_by_sample} as target ({ColumnNames.sample_id}, {ColumnNames.alleles_present}) (\n'
-                    f'    with pairs as (\n'
-                    f'    select {ColumnNames.allele_id}, unnest(rb_to_array({ColumnNames.samples_present})) as {ColumnNames.sample_id} from {TableNames.cns_samples_by_allele}\n'
-                    f'    )\n'
-                    f'    select {ColumnNames.sample_id}, rb_build_agg({ColumnNames.allele_id})\n'
-                    f'    from pairs\n'
-                    f'    group by {ColumnNames.sample_id}\n'
-                    f')\n'
-                    f'on conflict on constraint {ConstraintNames.pk_cns_alleles_by_sample} do update\n'
-                    f'set {ColumnNames.alleles_present} = target.{ColumnNames.alleles_present} | excluded.{ColumnNames.alleles_present};'
+                    'create unlogged table tmp_mutations_staging (\n'
+                    '    allele_id integer,\n'
+                    '    s_present roaringbitmap\n'
+                    ');'
                 )
             )
+            await copy_bitmaps_into_table(
+                session,
+                'tmp_mutations_staging',
+                ['allele_id', 's_present'],
+                bitmaps.select('allele_id', BITMAP).iter_rows()
+            )
             await session.commit()
 
-    @staticmethod
-    async def _transpose_cns_amino_acids():
+    async def _stage_ih_samples_by_allele_client_side(self):
+        ih_nts = await read_tmp_table(
+            'select accession, region, position_nt, alt_nt, ref_nt, gapped_freq::float8 as gapped_freq from tmp_ih_nt'
+        )
+        alleles = await read_tmp_table(
+            f'select id as allele_id, region, position_nt, alt_nt, ref_nt from {TableNames.alleles}'
+        )
+        pairs = (
+            ih_nts
+            .join(await self._get_sample_ids(), on=ColumnNames.accession, how='left')
+            .join(alleles, on=['region', 'position_nt', 'alt_nt', 'ref_nt'], how='left')
+            .with_columns(self._get_freq_bin_expr('gapped_freq').alias('freq_bin'))
+        )
+        bitmaps = await build_bitmaps(pairs, ['allele_id', 'freq_bin'], ColumnNames.sample_id, self.bitmap_workers)
+        bin_ranges = self._get_freq_bin_ranges()
+
         async with get_async_write_session() as session:
+            await session.execute(text('drop table if exists tmp_ih_samples_alleles_staging;'))
             await session.execute(
                 text(
-                    f'insert into {TableNames.cns_amino_acids_by_sample} as target ({ColumnNames.sample_id}, {ColumnNames.amino_acids_present}) (\n'
+                    'create unlogged table tmp_ih_samples_alleles_staging (\n'
+                    '    allele_id integer,\n'
+                    '    freq_bin  numrange,\n'
+                    '    s_present roaringbitmap\n'
+                    ');'
+                )
+            )
+            await copy_bitmaps_into_table(
+                session,
+                'tmp_ih_samples_alleles_staging',
+                ['allele_id', 'freq_bin', 's_present'],
+                (
+                    (allele_id, None if freq_bin is None else bin_ranges[freq_bin], bitmap)
+                    for allele_id, freq_bin, bitmap in bitmaps.select('allele_id', 'freq_bin', BITMAP).iter_rows()
+                )
+            )
+            await session.commit()
+
+    async def _stage_cns_samples_by_amino_acid_client_side(self):
+        mutations = await read_tmp_table(
+            'select accession, gff_feature, position_aa, alt_aa, alt_codon\n'
+            'from tmp_mutations\n'
+            'where gff_feature is not null\n'
+            '  and position_aa is not null\n'
+            '  and alt_aa is not null\n'
+            '  and ref_aa is not null'
+        )
+        amino_acids = await read_tmp_table(
+            f'select id as amino_acid_id, gff_feature, position_aa, alt_aa, alt_codon from {TableNames.amino_acids}'
+        )
+        pairs = (
+            mutations
+            .join(amino_acids, on=['gff_feature', 'position_aa', 'alt_aa', 'alt_codon'])
+            .join(await self._get_sample_ids(), on=ColumnNames.accession)
+        )
+        bitmaps = await build_bitmaps(pairs, ['amino_acid_id'], ColumnNames.sample_id, self.bitmap_workers)
+
+        async with get_async_write_session() as session:
+            await session.execute(text('drop table if exists tmp_mutation_translations_staging;'))
+            await session.execute(
+                text(
+                    'create unlogged table tmp_mutation_translations_staging (\n'
+                    '    amino_acid_id integer,\n'
+                    '    s_present     roaringbitmap\n'
+                    ');'
+                )
+            )
+            await copy_bitmaps_into_table(
+                session,
+                'tmp_mutation_translations_staging',
+                ['amino_acid_id', 's_present'],
+                bitmaps.select('amino_acid_id', BITMAP).iter_rows()
+            )
+            await session.commit()
+
+    async def _stage_ih_samples_by_amino_acid_client_side(self):
+        ih_codons = await read_tmp_table(
+            'select accession, gff_feature, position_aa, alt_codon, alt_freq from tmp_ih_codons'
+        )
+        amino_acids = await read_tmp_table(
+            f'select id as amino_acid_id, gff_feature, position_aa, alt_codon from {TableNames.amino_acids}'
+        )
+        pairs = (
+            ih_codons
+            .with_columns(self._get_freq_bin_expr('alt_freq').alias('alt_freq_bin'))
+            .join(amino_acids, on=['gff_feature', 'position_aa', 'alt_codon'], how='left')
+            .join(await self._get_sample_ids(), on=ColumnNames.accession, how='left')
+        )
+        bitmaps = await build_bitmaps(
+            pairs,
+            ['amino_acid_id', 'alt_freq_bin'],
+            ColumnNames.sample_id,
+            self.bitmap_workers
+        )
+        bin_ranges = self._get_freq_bin_ranges()
+
+        async with get_async_write_session() as session:
+            await session.execute(text('drop table if exists tmp_ih_samples_by_amino_acid_staging;'))
+            await session.execute(
+                text(
+                    'create unlogged table tmp_ih_samples_by_amino_acid_staging (\n'
+                    '    amino_acid_id integer,\n'
+                    '    alt_freq_bin  numrange,\n'
+                    '    s_present     roaringbitmap\n'
+                    ');'
+                )
+            )
+            await copy_bitmaps_into_table(
+                session,
+                'tmp_ih_samples_by_amino_acid_staging',
+                ['amino_acid_id', 'alt_freq_bin', 's_present'],
+                (
+                    (amino_acid_id, None if freq_bin is None else bin_ranges[freq_bin], bitmap)
+                    for amino_acid_id, freq_bin, bitmap
+                    in bitmaps.select('amino_acid_id', 'alt_freq_bin', BITMAP).iter_rows()
+                )
+            )
+            await session.commit()
+
+    async def _transpose_cns_alleles(self) -> int:
+        if self.full_transpose:
+            source = f'select {ColumnNames.allele_id}, {ColumnNames.samples_present} as s_present from {TableNames.cns_samples_by_allele}'
+        else:
+            source = 'select allele_id, s_present from tmp_mutations_staging'
+        return await self._transpose(
+            source,
+            ColumnNames.allele_id,
+            TableNames.cns_alleles_by_sample,
+            ColumnNames.alleles_present,
+            ConstraintNames.pk_cns_alleles_by_sample
+        )
+
+    async def _transpose_cns_amino_acids(self) -> int:
+        if self.full_transpose:
+            source = f'select {ColumnNames.amino_acid_id}, {ColumnNames.samples_present} as s_present from {TableNames.cns_samples_by_amino_acid}'
+        else:
+            source = 'select amino_acid_id, s_present from tmp_mutation_translations_staging'
+        return await self._transpose(
+            source,
+            ColumnNames.amino_acid_id,
+            TableNames.cns_amino_acids_by_sample,
+            ColumnNames.amino_acids_present,
+            ConstraintNames.pk_cns_amino_acids_by_sample
+        )
+
+    async def _transpose_ih_alleles(self) -> int:
+        if self.full_transpose:
+            source = (
+                f'select {ColumnNames.allele_id}, {ColumnNames.alt_freq_range}, {ColumnNames.samples_present} as s_present '
+                f'from {TableNames.ih_samples_by_allele}'
+            )
+        else:
+            source = f'select allele_id, freq_bin as {ColumnNames.alt_freq_range}, s_present from tmp_ih_samples_alleles_staging'
+        return await self._transpose(
+            source,
+            ColumnNames.allele_id,
+            TableNames.ih_alleles_by_sample,
+            ColumnNames.alleles_present,
+            ConstraintNames.pk_ih_alleles_by_sample,
+            by_freq_range=True
+        )
+
+    async def _transpose_ih_amino_acids(self) -> int:
+        if self.full_transpose:
+            source = (
+                f'select {ColumnNames.amino_acid_id}, {ColumnNames.alt_freq_range}, {ColumnNames.samples_present} as s_present '
+                f'from {TableNames.ih_samples_by_amino_acid}'
+            )
+        else:
+            source = (
+                f'select amino_acid_id, alt_freq_bin as {ColumnNames.alt_freq_range}, s_present '
+                f'from tmp_ih_samples_by_amino_acid_staging'
+            )
+        return await self._transpose(
+            source,
+            ColumnNames.amino_acid_id,
+            TableNames.ih_amino_acids_by_sample,
+            ColumnNames.amino_acids_present,
+            ConstraintNames.pk_ih_amino_acids_by_sample,
+            by_freq_range=True
+        )
+
+    @staticmethod
+    async def _transpose(
+        source: str,
+        change_id_col: str,
+        target_table: str,
+        present_col: str,
+        pk_name: str,
+        by_freq_range: bool = False
+    ) -> int:
+        """
+        Regroup (change id, samples bitmap) rows by sample and OR the result into a by-sample table.
+        :param source: query producing the change id column and s_present, plus alt_freq_range if by_freq_range
+        :param by_freq_range: if true, the by-sample table keeps one row per sample and frequency bin
+        """
+        freq_col = f', {ColumnNames.alt_freq_range}' if by_freq_range else ''
+        async with get_async_write_session() as session:
+            res = await session.execute(
+                text(
+                    f'insert into {target_table} as target ({ColumnNames.sample_id}{freq_col}, {present_col}) (\n'
                     f'    with pairs as (\n'
-                    f'    select {ColumnNames.amino_acid_id}, unnest(rb_to_array({ColumnNames.samples_present})) as {ColumnNames.sample_id} from {TableNames.cns_samples_by_amino_acid}\n'
+                    f'    select {change_id_col}{freq_col}, unnest(rb_to_array(s_present)) as {ColumnNames.sample_id} from ({source}) src\n'
                     f'    )\n'
-                    f'    select {ColumnNames.sample_id}, rb_build_agg({ColumnNames.amino_acid_id})\n'
+                    f'    select {ColumnNames.sample_id}{freq_col}, rb_build_agg({change_id_col})\n'
                     f'    from pairs\n'
-                    f'    group by {ColumnNames.sample_id}\n'
+                    f'    group by {ColumnNames.sample_id}{freq_col}\n'
                     f')\n'
-                    f'on conflict on constraint {ConstraintNames.pk_cns_amino_acids_by_sample} do update\n'
-                    f'set {ColumnNames.amino_acids_present} = target.{ColumnNames.amino_acids_present} | excluded.{ColumnNames.amino_acids_present};'
+                    f'on conflict on constraint {pk_name} do update\n'
+                    f'set {present_col} = target.{present_col} | excluded.{present_col};'
                 )
             )
             await session.commit()
+        return res.rowcount
 
     @staticmethod
     async def _set_up_codon_translation():
 
         async with get_async_write_session() as session:
+            await session.execute(text('drop table if exists tmp_codon_translations;'))
             await session.execute(
                 text(
                     'create unlogged table tmp_codon_translations (\n'
-                    '    codon text not null unique,\n'
+                    '    codon text not null primary key,\n'
                     '    aa    text not null\n'
                     ');'
                 )
@@ -761,28 +1526,6 @@ class VariantsMutationsCombinedParser(FileParser):
                     f"values {','.join(str(t) for t in CODONS_AMINO_ACIDS)};"
                 )
             )
-            await session.execute(
-                text(
-                    "create or replace function translate_codon(codon_in text)\n"
-                    "    returns text as\n"
-                    "$$\n"
-                    "declare\n"
-                    "    aa_out text;\n"
-                    "begin\n"
-                    "    if codon_in ~ '.*N.*' then\n"
-                    "        select 'X' into aa_out;\n"
-                    "    else\n"
-                    "        select aa\n"
-                    "        from tmp_codon_translations\n"
-                    "        where codon = codon_in\n"
-                    "        into aa_out;\n"
-                    "    end if;\n"
-                    "    return aa_out;\n"
-                    "end;\n"
-                    "$$\n"
-                    "    language plpgsql;"
-                )
-            )
             await session.commit()
 
     @staticmethod
@@ -801,6 +1544,8 @@ class VariantsMutationsCombinedParser(FileParser):
             'tmp_intra_host_translations_staging',
             'tmp_codon_translations',
             'tmp_freq_bins',
+            'tmp_accession_hashes',
+            'tmp_removed_accessions',
         ]
         async with get_async_write_session() as session:
             for t in temp_tables:
@@ -808,6 +1553,7 @@ class VariantsMutationsCombinedParser(FileParser):
                     text(f'drop table if exists {t};')
                 )
 
+            # left behind by runs from before translation was done with a join
             await session.execute(
                 text(
                     'drop function if exists translate_codon(codon_in text);'
@@ -816,6 +1562,30 @@ class VariantsMutationsCombinedParser(FileParser):
 
             await session.commit()
 
+    def _get_ih_nt_row_filter(self, header_order: List[str]) -> Callable[[List[str]], bool]:
+        """
+        Build a filter equivalent to the deletes run against tmp_ih_nt after a server side copy,
+        for use while streaming intrahost nt rows in client side mode.
+        :param header_order: column names of the input file, in file order
+        :return: function taking a raw row and returning False if the row should be rejected
+        """
+        i_ref_nt = header_order.index(ColumnNames.ref_nt)
+        i_alt_nt = header_order.index(ColumnNames.alt_nt)
+        i_gapped_freq = header_order.index('gapped_freq')
+        i_gapped_dp = header_order.index('gapped_dp')
+
+        def keep_row(row: List[str]) -> bool:
+            if row[i_alt_nt] == row[i_ref_nt]:
+                return False
+            # blank values are copied as null, which is never deleted by the server side filters
+            if row[i_gapped_freq] != '' and float(row[i_gapped_freq]) < self.ih_nt_min_freq:
+                return False
+            if row[i_gapped_dp] != '' and float(row[i_gapped_dp]) < self.ih_nt_min_depth:
+                return False
+            return True
+
+        return keep_row
+
     def _get_header_order(self, filename, column_name_mapping):
         proper_col_names = {
             v: k for k, v in column_name_mapping.items()
@@ -832,10 +1602,17 @@ class VariantsMutationsCombinedParser(FileParser):
         for arg in extra_args:
             try:
                 name, value = arg.split('=')
-                if name in {'n_freq_bins', 'ih_nt_min_depth', 'ih_codons_min_depth'}:
+                if name in {
+                    'n_freq_bins', 'ih_nt_min_depth', 'ih_codons_min_depth', 'copy_chunk_rows', 'load_parallelism',
+                    'bitmap_workers'
+                }:
                     value = int(value)
                 elif name in {'ih_nt_min_freq', 'ih_codons_min_freq'}:
                     value = float(value)
+                elif name in {'client_side_copy', 'incremental', 'full_transpose'}:
+                    value = bool_from_str(value)
+                elif name == 'bitmap_engine':
+                    value = BitmapEngine(value)
                 else:
                     # skip setting value and print a warning
                     raise ValueError
@@ -993,6 +1770,12 @@ class VariantsMutationsCombinedParser(FileParser):
             ]
         )
 
+    tmp_tables_by_record_type = {
+        RecordType.mutations: 'tmp_mutations',
+        RecordType.ih_nts: 'tmp_ih_nt',
+        RecordType.ih_codons: 'tmp_ih_codons',
+    }
+
     mutations_column_mapping = {
         ColumnNames.accession: 'sra',
         ColumnNames.position_nt: 'pos',
@@ -1054,12 +1837,39 @@ class VariantsMutationsCombinedParser(FileParser):
     }
 
     class InputFile:
-        def __init__(self, filename: str, delimiter: str = '\t'):
+        def __init__(
+            self,
+            filename: str,
+            delimiter: str = '\t',
+            client_side_copy: bool = False,
+            chunk_rows: int = 100_000
+        ):
             self.delimiter = delimiter
             self.raw_name = filename
-            self.relative_name, self.local_name = (
-                VariantsMutationsCombinedParser._find_relative_and_local_abs_paths(self.raw_name)
-            )
+            self.client_side_copy = client_side_copy
+            self.chunk_rows = chunk_rows
+            self.n_rows_rejected = 0
+            archive_member = split_archive_member(self.raw_name)
+            if client_side_copy and archive_member is not None:
+                # streamed out of the archive by this process, which the DB server could not do
+                archive, member = archive_member
+                self.relative_name = None
+                self.local_name = f'{path.abspath(archive)}{ARCHIVE_MEMBER_SEPARATOR}{member}'
+            elif client_side_copy and path.isfile(self.raw_name):
+                # the file only has to be readable by this process, not by the DB server
+                self.relative_name, self.local_name = None, path.abspath(self.raw_name)
+            elif archive_member is not None:
+                raise ValueError(
+                    f'Files within archives can only be read with client_side_copy=true: {self.raw_name}'
+                )
+            else:
+                self.relative_name, self.local_name = (
+                    VariantsMutationsCombinedParser._find_relative_and_local_abs_paths(self.raw_name)
+                )
+            if is_compressed(self.local_name) and not client_side_copy:
+                raise ValueError(
+                    f'Compressed input files can only be read with client_side_copy=true: {self.raw_name}'
+                )
             self.record_type: RecordType = self._choose_record_type()
             self.header_order: List[str] = self._get_header_order()
 
@@ -1068,7 +1878,7 @@ class VariantsMutationsCombinedParser(FileParser):
             intrahost_nts_columns = set(VariantsMutationsCombinedParser.intrahost_nts_column_mapping.values())
             intrahost_codons_columns = set(VariantsMutationsCombinedParser.intrahost_codons_column_mapping.values())
 
-            with open(self.local_name, 'r') as f:
+            with open_input_text(self.local_name) as f:
                 reader = csv.DictReader(f, delimiter=self.delimiter)
                 fieldnames = set(reader.fieldnames)
 
@@ -1095,25 +1905,158 @@ class VariantsMutationsCombinedParser(FileParser):
                 v: k for k, v in column_name_mapping.items()
             }
             ordered_header = []
-            with open(self.local_name, 'r') as f:
+            with open_input_text(self.local_name) as f:
                 header = f.readline().split(self.delimiter)
                 ordered_header = [proper_col_names[h.strip()] for h in header]
             if len(ordered_header) != len(proper_col_names.keys()):
                 raise ValueError(f'Failed to construct header ordering for file: {self.raw_name}')
             return ordered_header
 
-        async def copy_into_table(self, tablename: str, session: AsyncSession):
-            await session.execute(
-                text(
-                    f"copy {tablename} ({', '.join(self.header_order)})\n"
-                    f"from '/muninn/data/{self.relative_name}' delimiter E'{self.delimiter}' csv header;"
+        async def copy_into_table(
+            self,
+            tablename: str,
+            session: AsyncSession,
+            row_filter: Callable[[List[str]], bool] | None = None
+        ):
+            """
+            Copy this file into the given table within the session's transaction.
+            :param tablename: name of the table to copy into
+            :param session: session holding the open transaction
+            :param row_filter: applied to each raw row in client side mode, rows for which it returns False are skipped.
+            Ignored for server side copies.
+            """
+            if self.client_side_copy:
+                await self._stream_into_table(tablename, session, row_filter)
+            else:
+                await session.execute(
+                    text(
+                        f"copy {tablename} ({', '.join(self.header_order)})\n"
+                        f"from '/muninn/data/{self.relative_name}' delimiter E'{self.delimiter}' csv header;"
+                    )
                 )
+
+        async def copy_into_table_in_parallel(
+            self,
+            tablename: str,
+            load_slots: asyncio.Semaphore,
+            n_shards: int,
+            row_filter: Callable[[List[str]], bool] | None = None
+        ):
+            """
+            Copy this file into the given table using sessions of its own, each committed separately,
+            so the table must already be visible to other connections.
+            In client side mode the file is split into up to n_shards chunk streams copied over separate connections.
+            The file itself is still read by a single thread, so sharding only helps while the server's side of the copy
+            is slower than reading the file, see benchmarks/client_side_copy.py.
+            :param tablename: name of the table to copy into
+            :param load_slots: limits the number of connections copying at once, shared between files
+            :param n_shards: number of connections to spread this file over in client side mode
+            :param row_filter: see copy_into_table
+            """
+            if not self.client_side_copy or n_shards <= 1:
+                async with load_slots:
+                    async with get_async_write_session() as session:
+                        await self.copy_into_table(tablename, session, row_filter)
+                        await session.commit()
+                return
+
+            chunks = asyncio.Queue(maxsize=2 * n_shards)
+
+            async def read_chunks():
+                try:
+                    async for chunk in self._iter_copy_chunks(row_filter):
+                        await chunks.put(chunk)
+                finally:
+                    # one end marker per shard
+                    for _ in range(n_shards):
+                        await chunks.put(None)
+
+            async def drain_chunks() -> AsyncIterator[bytes]:
+                while (chunk := await chunks.get()) is not None:
+                    yield chunk
+
+            async def copy_shard():
+                async with load_slots:
+                    async with get_async_write_session() as session:
+                        await self._copy_chunks_into_table(tablename, session, drain_chunks())
+                        await session.commit()
+
+            await asyncio.gather(read_chunks(), *[copy_shard() for _ in range(n_shards)])
+            self._report_rejected_rows()
+
+        async def _stream_into_table(
+            self,
+            tablename: str,
+            session: AsyncSession,
+            row_filter: Callable[[List[str]], bool] | None
+        ):
+            await self._copy_chunks_into_table(tablename, session, self._iter_copy_chunks(row_filter))
+            self._report_rejected_rows()
+
+        async def _copy_chunks_into_table(self, tablename: str, session: AsyncSession, chunks: AsyncIterator[bytes]):
+            # use the session's own connection so that the copy lands in the same transaction
+            connection = await session.connection()
+            raw_connection = await connection.get_raw_connection()
+            await raw_connection.driver_connection.copy_to_table(
+                tablename,
+                source=chunks,
+                columns=self.header_order,
+                format='csv',
+                delimiter=self.delimiter
             )
 
+        def _report_rejected_rows(self):
+            if self.n_rows_rejected > 0:
+                print(f'{self.n_rows_rejected} rows from {self.raw_name} were filtered out while streaming')
+
+        async def _iter_copy_chunks(self, row_filter: Callable[[List[str]], bool] | None) -> AsyncIterator[bytes]:
+            """
+            Yield the input file as csv encoded chunks of at most self.chunk_rows rows,
+            so that memory use stays bounded regardless of file size.
+            Each chunk is read in a worker thread, so that reading, decompressing and filtering the file
+            don't hold up the event loop, and with it the copies of other shards and files.
+            """
+            chunks = self._read_copy_chunks(row_filter)
+            try:
+                while (chunk := await asyncio.to_thread(next, chunks, None)) is not None:
+                    yield chunk
+            finally:
+                await asyncio.to_thread(chunks.close)
+
+        def _read_copy_chunks(self, row_filter: Callable[[List[str]], bool] | None) -> Iterator[bytes]:
+            self.n_rows_rejected = 0
+            if row_filter is None:
+                # nothing to filter out, so the lines are passed through as they are and only parsed by the copy
+                with open_input_decompressed(self.local_name) as f:
+                    f.readline()  # skip header
+                    while len(chunk := b''.join(islice(f, self.chunk_rows))) > 0:
+                        yield chunk
+                return
+
+            buffer = io.StringIO()
+            writer = csv.writer(buffer, delimiter=self.delimiter, lineterminator='\n')
+            n_buffered = 0
+            with open_input_text(self.local_name) as f:
+                reader = csv.reader(f, delimiter=self.delimiter)
+                next(reader)  # skip header
+                for row in reader:
+                    if not row_filter(row):
+                        self.n_rows_rejected += 1
+                        continue
+                    writer.writerow(row)
+                    n_buffered += 1
+                    if n_buffered >= self.chunk_rows:
+                        yield buffer.getvalue().encode()
+                        buffer.seek(0)
+                        buffer.truncate()
+                        n_buffered = 0
+            if n_buffered > 0:
+                yield buffer.getvalue().encode()
+
 
 class VariantsMutationsCombinedParserBig(VariantsMutationsCombinedParser):
-    def __init__(self, filenames: List[str], extras: list[str] | None):
-        super().__init__(filenames, extras)
+    def __init__(self, filenames: List[str], extras: list[str] | None, resume: bool = False):
+        super().__init__(filenames, extras, resume)
         self.tmp_wal_size_mb = 1024 * 20
         self.tmp_checkpoint_timeout_s = 3600
 
@@ -1,30 +1,63 @@
+import polars as pl
 from sqlalchemy.sql.expression import text
 
 from DB.engine import get_async_write_session
-from DB.models import GeoLocation
-from utils.constants import TableNames, ColumnNames
+from utils.constants import TableNames, ColumnNames, ConstraintNames
 
 
-async def find_or_insert_geo_location(gl: GeoLocation) -> int:
+async def find_or_insert_geo_locations(geo_locations: pl.DataFrame) -> pl.DataFrame:
+    """
+    Find or insert all the given geo locations at once.
+    The locations are copied into a temp table, any that are missing are inserted in a single statement,
+    and the ids for all of them are read back in the same transaction.
+    :param geo_locations: columns country_name, admin1_name, admin2_name and admin3_name.
+    Any other columns are passed through.
+    :return: geo_locations with a geo_location_id column added
+    """
+    division_columns = [
+        ColumnNames.country_name,
+        ColumnNames.admin1_name,
+        ColumnNames.admin2_name,
+        ColumnNames.admin3_name
+    ]
+    tmp_geo_locations = 'tmp_geo_locations'
+    columns_str = ', '.join(division_columns)
+
     async with get_async_write_session() as session:
-        id_ = await session.scalar(text(
-            f'select id from {TableNames.geo_locations}\n'
-            f'where {ColumnNames.country_name} = :country_name\n'
-            f'and ({ColumnNames.admin1_name} = :admin1_name or num_nulls({ColumnNames.admin1_name}, :admin1_name) = 2)\n'
-            f'and ({ColumnNames.admin2_name} = :admin2_name or num_nulls({ColumnNames.admin2_name}, :admin2_name) = 2)\n'
-            f'and ({ColumnNames.admin3_name} = :admin3_name or num_nulls({ColumnNames.admin3_name}, :admin3_name) = 2);\n'
-        ),
-            {
-                'country_name': gl.country_name,
-                'admin1_name': gl.admin1_name,
-                'admin2_name': gl.admin2_name,
-                'admin3_name': gl.admin3_name
-            }
+        await session.execute(text(
+            f'create temporary table {tmp_geo_locations} (\n'
+            f'{", ".join(f"{cn} text" for cn in division_columns)}\n'
+            f') on commit drop;'
+        ))
+
+        connection = await session.connection()
+        raw_connection = await connection.get_raw_connection()
+        await raw_connection.driver_connection.copy_records_to_table(
+            tmp_geo_locations,
+            records=geo_locations.select(division_columns).unique().iter_rows(),
+            columns=division_columns
+        )
+
+        await session.execute(text(
+            f'insert into {TableNames.geo_locations} ({columns_str})\n'
+            f'select distinct {columns_str} from {tmp_geo_locations}\n'
+            f'on conflict on constraint {ConstraintNames.uq_geo_locations_division_names} do nothing;'
+        ))
+
+        res = await session.execute(text(
+            f'select {", ".join(f"t.{cn}" for cn in division_columns)}, gl.id\n'
+            f'from {tmp_geo_locations} t\n'
+            f'inner join {TableNames.geo_locations} gl\n'
+            f'on gl.{ColumnNames.country_name} = t.{ColumnNames.country_name}\n'
+            f'and gl.{ColumnNames.admin1_name} is not distinct from t.{ColumnNames.admin1_name}\n'
+            f'and gl.{ColumnNames.admin2_name} is not distinct from t.{ColumnNames.admin2_name}\n'
+            f'and gl.{ColumnNames.admin3_name} is not distinct from t.{ColumnNames.admin3_name};'
+        ))
+        ids = pl.DataFrame(
+            res.all(),
+            schema={cn: pl.String for cn in division_columns} | {ColumnNames.geo_location_id: pl.Int64},
+            orient='row'
         )
+        await session.commit()
 
-        if id_ is None:
-            session.add(gl)
-            await session.commit()
-            await session.refresh(gl)
-            id_ = gl.id
-    return id_
+    return geo_locations.join(ids, on=division_columns, how='left', nulls_equal=True)
@@ -0,0 +1,166 @@
+from typing import Iterable, List
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql.expression import text
+
+from DB.engine import get_async_write_session
+from DB.inserts.stages import StageResult, Stage
+from utils.constants import TableNames, ColumnNames, IngestRunStatuses, ConstraintNames
+
+
+async def start_or_resume_ingest_run(parser_name: str, input_files: list[str], resume: bool) -> tuple[int, set[str]]:
+    """
+    Find the most recent unfinished run of the given parser if resuming, otherwise start a new run.
+    Starting a new run marks any unfinished runs of the same parser as abandoned.
+    :param parser_name: name identifying the parser
+    :param input_files: input files given to the parser
+    :param resume: whether to pick up an unfinished run
+    :return: (ingest run id, names of stages already completed within that run)
+    """
+    if resume:
+        async with get_async_write_session() as session:
+            res = await session.execute(
+                text(
+                    f'select id, {ColumnNames.input_files}\n'
+                    f'from {TableNames.ingest_runs}\n'
+                    f'where {ColumnNames.parser_name} = :parser_name\n'
+                    f'  and {ColumnNames.status} = :status\n'
+                    f'order by {ColumnNames.started_at} desc\n'
+                    f'limit 1;'
+                ),
+                {'parser_name': parser_name, 'status': IngestRunStatuses.running}
+            )
+            run = res.one_or_none()
+        if run is None:
+            print(f'No unfinished run of {parser_name} to resume, starting a new one')
+        elif list(run.input_files) != input_files:
+            raise ValueError(
+                f'Cannot resume ingest run {run.id}: it was started with different input files: {run.input_files}'
+            )
+        else:
+            completed = await get_completed_stages(run.id)
+            print(f'Resuming ingest run {run.id}, skipping {len(completed)} completed stages')
+            return run.id, completed
+
+    async with get_async_write_session() as session:
+        await session.execute(
+            text(
+                f'update {TableNames.ingest_runs}\n'
+                f'set {ColumnNames.status} = :abandoned\n'
+                f'where {ColumnNames.parser_name} = :parser_name\n'
+                f'  and {ColumnNames.status} = :running;'
+            ),
+            {
+                'parser_name': parser_name,
+                'abandoned': IngestRunStatuses.abandoned,
+                'running': IngestRunStatuses.running
+            }
+        )
+        id_ = await session.scalar(
+            text(
+                f'insert into {TableNames.ingest_runs} (\n'
+                f'    {ColumnNames.parser_name}, {ColumnNames.input_files}, {ColumnNames.status}\n'
+                f')\n'
+                f'values (:parser_name, :input_files, :status)\n'
+                f'returning id;'
+            ),
+            {'parser_name': parser_name, 'input_files': input_files, 'status': IngestRunStatuses.running}
+        )
+        await session.commit()
+    return id_, set()
+
+
+async def get_completed_stages(ingest_run_id: int) -> set[str]:
+    async with get_async_write_session() as session:
+        res = await session.scalars(
+            text(
+                f'select {ColumnNames.stage_name}\n'
+                f'from {TableNames.ingest_run_stages}\n'
+                f'where {ColumnNames.ingest_run_id} = :ingest_run_id;'
+            ),
+            {'ingest_run_id': ingest_run_id}
+        )
+        return set(res.all())
+
+
+async def find_lost_stage_outputs(ingest_run_id: int, stages: Iterable[Stage]) -> List[str]:
+    """
+    Output tables of completed stages that had rows when their stage finished but are now empty or missing.
+    Staging tables are unlogged, so postgres empties them when it recovers from a crash, and stages
+    depending on them would then merge nothing without any error.
+    :return: names of the tables whose contents were lost
+    """
+    output_tables = {s.name: s.output_table for s in stages if s.output_table is not None}
+    async with get_async_write_session() as session:
+        res = await session.execute(
+            text(
+                f'select {ColumnNames.stage_name}\n'
+                f'from {TableNames.ingest_run_stages}\n'
+                f'where {ColumnNames.ingest_run_id} = :ingest_run_id\n'
+                f'  and {ColumnNames.row_count} > 0\n'
+                f'  and {ColumnNames.stage_name} = any(:stage_names);'
+            ),
+            {'ingest_run_id': ingest_run_id, 'stage_names': list(output_tables.keys())}
+        )
+        lost = []
+        for tablename in sorted({output_tables[name] for name in res.scalars().all()}):
+            exists = await session.scalar(text('select to_regclass(:name) is not null;'), {'name': tablename})
+            if not exists or not await session.scalar(text(f'select exists (select 1 from {tablename});')):
+                lost.append(tablename)
+    return lost
+
+
+async def record_ingest_run_stage(session: AsyncSession, ingest_run_id: int, stage_name: str):
+    """
+    Record a stage as completed within the caller's transaction, for stages that are not safe to run twice:
+    the stage's writes and the record of them then commit or roll back together.
+    The timings are filled in afterwards by insert_ingest_run_stage.
+    """
+    await session.execute(
+        text(
+            f'insert into {TableNames.ingest_run_stages} (\n'
+            f'    {ColumnNames.ingest_run_id}, {ColumnNames.stage_name}, {ColumnNames.started_at}, '
+            f'{ColumnNames.finished_at}\n'
+            f')\n'
+            f'values (:ingest_run_id, :stage_name, now(), now());'
+        ),
+        {'ingest_run_id': ingest_run_id, 'stage_name': stage_name}
+    )
+
+
+async def insert_ingest_run_stage(ingest_run_id: int, result: StageResult):
+    async with get_async_write_session() as session:
+        await session.execute(
+            text(
+                f'insert into {TableNames.ingest_run_stages} (\n'
+                f'    {ColumnNames.ingest_run_id}, {ColumnNames.stage_name}, {ColumnNames.started_at}, '
+                f'{ColumnNames.finished_at}, {ColumnNames.row_count}\n'
+                f')\n'
+                f'values (:ingest_run_id, :stage_name, :started_at, :finished_at, :row_count)\n'
+                f'on conflict on constraint {ConstraintNames.pk_ingest_run_stages} do update\n'
+                f'set {ColumnNames.started_at} = excluded.{ColumnNames.started_at},\n'
+                f'    {ColumnNames.finished_at} = excluded.{ColumnNames.finished_at},\n'
+                f'    {ColumnNames.row_count} = excluded.{ColumnNames.row_count};'
+            ),
+            {
+                'ingest_run_id': ingest_run_id,
+                'stage_name': result.name,
+                'started_at': result.started_at,
+                'finished_at': result.finished_at,
+                'row_count': result.row_count,
+            }
+        )
+        await session.commit()
+
+
+async def finish_ingest_run(ingest_run_id: int):
+    async with get_async_write_session() as session:
+        await session.execute(
+            text(
+                f'update {TableNames.ingest_runs}\n'
+                f'set {ColumnNames.status} = :status, {ColumnNames.finished_at} = now()\n'
+                f'where id = :ingest_run_id;'
+            ),
+            {'ingest_run_id': ingest_run_id, 'status': IngestRunStatuses.finished}
+        )
+        await session.commit()
@@ -1,7 +1,10 @@
+import polars as pl
 from sqlalchemy import select, and_
+from sqlalchemy.sql.expression import text
 
 from DB.engine import get_async_write_session
 from DB.models import Paper
+from utils.constants import ColumnNames, ConstraintNames, TableNames
 
 
 async def find_or_insert_paper(p: Paper) -> int:
@@ -22,3 +25,54 @@ async def find_or_insert_paper(p: Paper) -> int:
             await session.refresh(p)
             id_ = p.id
     return id_
+
+
+async def find_or_insert_papers(papers: pl.DataFrame) -> pl.DataFrame:
+    """
+    Bulk version of find_or_insert_paper.
+    :param papers: authors, title, publication_year, may contain repeats
+    :return: authors, title, publication_year, paper_id for each distinct paper
+    """
+    columns = [ColumnNames.authors, ColumnNames.title, ColumnNames.publication_year]
+    papers = papers.select(columns).unique()
+    params = {
+        'authors': papers.get_column(ColumnNames.authors).to_list(),
+        'titles': papers.get_column(ColumnNames.title).to_list(),
+        'years': papers.get_column(ColumnNames.publication_year).to_list(),
+    }
+    input_papers = (
+        f'unnest(cast(:authors as text[]), cast(:titles as text[]), cast(:years as bigint[]))\n'
+        f'as t({", ".join(columns)})\n'
+    )
+    async with get_async_write_session() as session:
+        await session.execute(
+            text(
+                f'insert into {TableNames.papers} ({", ".join(columns)})\n'
+                f'select {", ".join(columns)} from {input_papers}'
+                f'on conflict on constraint {ConstraintNames.uq_papers_authors_title_year} do nothing;'
+            ),
+            params
+        )
+        res = await session.execute(
+            text(
+                f'select {", ".join(f"p.{cn}" for cn in columns)}, p.id\n'
+                f'from {TableNames.papers} p\n'
+                f'inner join {input_papers}'
+                f'on p.{ColumnNames.authors} = t.{ColumnNames.authors}\n'
+                f'and p.{ColumnNames.title} = t.{ColumnNames.title}\n'
+                f'and p.{ColumnNames.publication_year} = t.{ColumnNames.publication_year};'
+            ),
+            params
+        )
+        papers = pl.DataFrame(
+            res.all(),
+            schema={
+                ColumnNames.authors: pl.String,
+                ColumnNames.title: pl.String,
+                ColumnNames.publication_year: pl.Int64,
+                ColumnNames.paper_id: pl.Int64,
+            },
+            orient='row'
+        )
+        await session.commit()
+    return papers
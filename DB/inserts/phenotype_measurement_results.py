@@ -1,7 +1,11 @@
+import polars as pl
 from sqlalchemy import select, and_
+from sqlalchemy.sql.expression import text
 
 from DB.engine import get_async_write_session
+from DB.inserts.amino_acids import AMINO_ACID_KEY_COLUMNS
 from DB.models import PhenotypeMetricValues
+from utils.constants import ColumnNames, TableNames, ConstraintNames
 
 
 async def insert_pheno_measurement_result(pmr: PhenotypeMetricValues, upsert: bool = False) -> bool:
@@ -27,3 +31,89 @@ async def insert_pheno_measurement_result(pmr: PhenotypeMetricValues, upsert: bo
             else:
                 raise ValueError('phenotype measurement result value mismatch')
         return updated_existing
+
+
+async def copy_upsert_pheno_measurement_results(values: pl.DataFrame) -> (int, int, pl.DataFrame):
+    """
+    Bulk version of insert_pheno_measurement_result with upsert=True.
+    Values are copied into a temp table, matched to every equivalent amino acid inside the db, and upserted in one
+    statement. Existing values are only touched if they changed. Values for amino acids that don't exist are skipped,
+    we don't want to create orphaned amino acids just for phenotype data.
+    :param values: gff_feature, position_aa, ref_aa, alt_aa, phenotype_metric_id, value.
+    If there are several values for the same amino acid and metric, the last one is used.
+    :return: (int: count of values inserted, int: count of existing values updated,
+    DataFrame: gff_feature, position_aa, ref_aa, alt_aa for each amino acid that wasn't found)
+    """
+    columns = AMINO_ACID_KEY_COLUMNS + [ColumnNames.phenotype_metric_id, ColumnNames.value]
+    values = values.select(columns).unique(
+        subset=AMINO_ACID_KEY_COLUMNS + [ColumnNames.phenotype_metric_id],
+        keep='last',
+        maintain_order=True
+    )
+    tmp_values = 'tmp_phenotype_metric_values'
+    amino_acids_match = (
+        f'aa.{ColumnNames.gff_feature} = t.{ColumnNames.gff_feature}\n'
+        f'and aa.{ColumnNames.position_aa} = t.{ColumnNames.position_aa}\n'
+        f'and aa.{ColumnNames.ref_aa} = t.{ColumnNames.ref_aa}\n'
+        f'and aa.{ColumnNames.alt_aa} = t.{ColumnNames.alt_aa}\n'
+    )
+
+    async with get_async_write_session() as session:
+        await session.execute(text(
+            f'create temporary table {tmp_values} (\n'
+            f'{ColumnNames.gff_feature} text not null,\n'
+            f'{ColumnNames.position_aa} integer not null,\n'
+            f'{ColumnNames.ref_aa} text not null,\n'
+            f'{ColumnNames.alt_aa} text not null,\n'
+            f'{ColumnNames.phenotype_metric_id} bigint not null,\n'
+            f'{ColumnNames.value} double precision not null\n'
+            f') on commit drop;'
+        ))
+
+        connection = await session.connection()
+        raw_connection = await connection.get_raw_connection()
+        await raw_connection.driver_connection.copy_records_to_table(
+            tmp_values,
+            records=values.iter_rows(),
+            columns=columns
+        )
+
+        # xmax is only zero for newly inserted rows
+        res = await session.execute(text(
+            f'insert into {TableNames.phenotype_metric_values} '
+            f'({ColumnNames.phenotype_metric_id}, {ColumnNames.amino_acid_id}, {ColumnNames.value})\n'
+            f'select t.{ColumnNames.phenotype_metric_id}, aa.id, t.{ColumnNames.value}\n'
+            f'from {tmp_values} t\n'
+            f'inner join {TableNames.amino_acids} aa on\n'
+            f'{amino_acids_match}'
+            # in a fixed order, so that loaders upserting the same values at the same time can't deadlock
+            f'order by aa.id, t.{ColumnNames.phenotype_metric_id}\n'
+            f'on conflict on constraint {ConstraintNames.uq_phenotype_metric_values_metric_and_amino_acid}\n'
+            f'do update set {ColumnNames.value} = excluded.{ColumnNames.value}\n'
+            f'where {TableNames.phenotype_metric_values}.{ColumnNames.value} is distinct from excluded.{ColumnNames.value}\n'
+            f'returning (xmax = 0) as inserted;'
+        ))
+        inserted = [r[0] for r in res.all()]
+
+        res = await session.execute(text(
+            f'select distinct {", ".join(f"t.{cn}" for cn in AMINO_ACID_KEY_COLUMNS)}\n'
+            f'from {tmp_values} t\n'
+            f'where not exists (\n'
+            f'select 1 from {TableNames.amino_acids} aa where\n'
+            f'{amino_acids_match}'
+            f');'
+        ))
+        not_found = pl.DataFrame(
+            res.all(),
+            schema={
+                ColumnNames.gff_feature: pl.String,
+                ColumnNames.position_aa: pl.Int64,
+                ColumnNames.ref_aa: pl.String,
+                ColumnNames.alt_aa: pl.String,
+            },
+            orient='row'
+        )
+        await session.commit()
+
+    count_inserted = sum(inserted)
+    return count_inserted, len(inserted) - count_inserted, not_found
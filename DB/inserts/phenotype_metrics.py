@@ -1,11 +1,23 @@
 from sqlalchemy import select
+from sqlalchemy.sql.expression import text
 
 from DB.engine import get_async_write_session
 from DB.models import PhenotypeMetric
+from utils.constants import ColumnNames, ConstraintNames, TableNames
 
 
 async def find_or_insert_metric(pm: PhenotypeMetric) -> int:
     async with get_async_write_session() as session:
+        # do nothing on conflict, in case another loader running at the same time inserted the same metric
+        await session.execute(
+            text(
+                f'insert into {TableNames.phenotype_metrics} '
+                f'({ColumnNames.phenotype_metric_name}, {ColumnNames.phenotype_metric_assay_type})\n'
+                f'values (:name, :assay_type)\n'
+                f'on conflict on constraint {ConstraintNames.uq_phenotype_metrics_name} do nothing;'
+            ),
+            {'name': pm.phenotype_metric_name, 'assay_type': pm.phenotype_metric_assay_type}
+        )
         id_ = await session.scalar(
             select(PhenotypeMetric.id)
             .where(
@@ -13,9 +25,5 @@ async def find_or_insert_metric(pm: PhenotypeMetric) -> int:
                 PhenotypeMetric.phenotype_metric_name == pm.phenotype_metric_name
             )
         )
-        if id_ is None:
-            session.add(pm)
-            await session.commit()
-            await session.refresh(pm)
-            id_ = pm.id
-    return id_
\ No newline at end of file
+        await session.commit()
+    return id_
@@ -0,0 +1,82 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Iterable, Tuple
+
+import polars as pl
+from pyroaring import BitMap
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from DB.engine import get_uri_for_polars
+
+BITMAP = 's_present'
+SHARD = 'shard'
+
+
+async def read_tmp_table(query: str) -> pl.DataFrame:
+    """
+    Read the result of a query into polars without blocking the event loop.
+    Uses the write user, since the unlogged tmp tables used during ingestion are not readable by the readonly user.
+    """
+    return await asyncio.to_thread(pl.read_database_uri, query=query, uri=get_uri_for_polars(readonly=False))
+
+
+async def build_bitmaps(pairs: pl.DataFrame, key_columns: List[str], id_column: str, n_workers: int) -> pl.DataFrame:
+    """
+    Equivalent of rb_build_agg(id_column) ... group by key_columns, with the bitmaps built across worker processes.
+    :param pairs: one row per (key, id) pair, duplicates allowed
+    :param key_columns: columns to group by. Null keys form their own group, as in postgres.
+    :param id_column: integer column aggregated into the bitmaps. Nulls are ignored.
+    :param n_workers: number of worker processes
+    :return: key_columns plus BITMAP, holding each group's bitmap in the portable serialization format
+    """
+    pairs = pairs.select(*key_columns, id_column).filter(pl.col(id_column).is_not_null())
+    # Every row of a group hashes to the same shard, so the shards can be aggregated independently
+    shards = pairs.with_columns(
+        (pl.struct(key_columns).hash() % n_workers).alias(SHARD)
+    ).partition_by(SHARD, include_key=False)
+    if len(shards) == 0:
+        return pl.DataFrame(schema={**pairs.select(key_columns).schema, BITMAP: pl.Binary})
+
+    def run_pool() -> List[pl.DataFrame]:
+        # polars' thread pool does not survive a fork, so the workers have to be spawned
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            return list(
+                executor.map(
+                    _build_bitmaps_in_worker,
+                    shards,
+                    [key_columns] * len(shards),
+                    [id_column] * len(shards)
+                )
+            )
+
+    return pl.concat(await asyncio.to_thread(run_pool))
+
+
+async def copy_bitmaps_into_table(session: AsyncSession, tablename: str, columns: List[str], records: Iterable[Tuple]):
+    """
+    COPY rows holding serialized bitmaps into a table, using the binary COPY format asyncpg always uses.
+    roaringbitmap has no builtin codec in asyncpg, but its binary wire format is the portable serialization,
+    so the serialized bytes are passed through as they are.
+    The codec is reset afterwards, as the connection goes back to the pool, and its later users read bitmaps as text.
+    """
+    connection = await session.connection()
+    raw_connection = (await connection.get_raw_connection()).driver_connection
+    await raw_connection.set_type_codec(
+        'roaringbitmap',
+        schema='public',
+        encoder=bytes,
+        decoder=bytes,
+        format='binary'
+    )
+    try:
+        await raw_connection.copy_records_to_table(tablename, records=records, columns=columns)
+    finally:
+        await raw_connection.reset_type_codec('roaringbitmap', schema='public')
+
+
+def _build_bitmaps_in_worker(pairs: pl.DataFrame, key_columns: List[str], id_column: str) -> pl.DataFrame:
+    # Module level so that it can be pickled and sent to the process pool.
+    grouped = pairs.group_by(key_columns).agg(pl.col(id_column))
+    bitmaps = [BitMap(ids).serialize() for ids in grouped.get_column(id_column).to_list()]
+    return grouped.drop(id_column).with_columns(pl.Series(BITMAP, bitmaps, dtype=pl.Binary))
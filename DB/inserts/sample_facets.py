@@ -0,0 +1,32 @@
+from sqlalchemy.sql.expression import text
+
+from DB.engine import get_async_write_session
+from utils.constants import TableNames, ColumnNames, SAMPLE_FACET_FIELDS
+
+
+async def refresh_sample_facets() -> int:
+    """
+    Rebuild sample_facets from samples and geo_locations, in a single pass over samples.
+    Readers keep seeing the previous facets until the rebuild commits.
+    :return: number of (facet, value) rows
+    """
+    facet_values = ',\n'.join(f"('{field.value}', {field.value}::text)" for field in SAMPLE_FACET_FIELDS)
+    async with get_async_write_session() as session:
+        await session.execute(text(f'delete from {TableNames.sample_facets};'))
+        res = await session.execute(
+            text(
+                f'insert into {TableNames.sample_facets} (\n'
+                f'    {ColumnNames.facet}, {ColumnNames.value}, {ColumnNames.samples_present}\n'
+                f')\n'
+                f'select f.{ColumnNames.facet}, f.{ColumnNames.value}, rb_build_agg(s.id)\n'
+                f'from {TableNames.samples} s\n'
+                f'left join {TableNames.geo_locations} gl on gl.id = s.{ColumnNames.geo_location_id}\n'
+                f'cross join lateral (values\n'
+                f'{facet_values}\n'
+                f') as f({ColumnNames.facet}, {ColumnNames.value})\n'
+                f'where f.{ColumnNames.value} is not null\n'
+                f'group by f.{ColumnNames.facet}, f.{ColumnNames.value};'
+            )
+        )
+        await session.commit()
+    return res.rowcount
@@ -0,0 +1,164 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql.expression import text
+
+from DB.engine import get_async_write_session
+from DB.inserts.data_generation import bump_data_generation
+from DB.queries.date_count_helpers import MID_COLLECTION_DATE_CALCULATION
+from DB.structure import ih_samples_by_allele, ih_samples_by_amino_acid, cache_samples_by_collection_date, \
+    cache_cns_pmv_sums
+from DB.structure.constraint_manager import ConstraintManager
+from utils.constants import TableNames, ColumnNames, ConstraintNames
+
+# (table, column) holding sample ids as plain integers
+SAMPLE_ID_COLUMNS = [
+    (TableNames.samples, 'id'),
+    (TableNames.samples_lineages, ColumnNames.sample_id),
+    (TableNames.cns_alleles_by_sample, ColumnNames.sample_id),
+    (TableNames.cns_amino_acids_by_sample, ColumnNames.sample_id),
+    (TableNames.ih_alleles_by_sample, ColumnNames.sample_id),
+    (TableNames.ih_amino_acids_by_sample, ColumnNames.sample_id),
+]
+
+# tables holding sample ids in their samples_present bitmaps
+SAMPLE_BITMAP_TABLES = [
+    TableNames.cns_samples_by_allele,
+    TableNames.cns_samples_by_amino_acid,
+    TableNames.ih_samples_by_allele,
+    TableNames.ih_samples_by_amino_acid,
+    TableNames.sample_facets,
+]
+
+# Foreign keys to samples go first, as pk_samples cannot be dropped while they reference it.
+# Unique constraints over sample ids are dropped as well: while ids are being swapped they would collide.
+SAMPLE_ID_CONSTRAINTS = [
+    ConstraintNames.fk_samples_lineages_sample_id_samples,
+    ConstraintNames.fk_cns_alleles_by_sample_sample_id_samples,
+    ConstraintNames.fk_cns_amino_acids_by_sample_sample_id_samples,
+    ConstraintNames.fk_ih_alleles_by_sample_sample_id_samples,
+    ConstraintNames.fk_ih_amino_acids_by_sample_sample_id_samples,
+    ConstraintNames.pk_samples,
+    ConstraintNames.uq_samples_lineages_sample_id_lineage_id_is_consensus_call,
+    ConstraintNames.pk_cns_alleles_by_sample,
+    ConstraintNames.pk_cns_amino_acids_by_sample,
+    ConstraintNames.pk_ih_alleles_by_sample,
+    ConstraintNames.pk_ih_amino_acids_by_sample,
+]
+
+
+async def compact_sample_ids() -> int:
+    """
+    Renumber samples 1..n in order of collection midpoint, collection span and geo location, and rewrite every
+    sample id and sample bitmap to match, in one transaction. Samples collected close together then have close ids,
+    so the sample bitmaps are mostly runs, and the ids of each collection date are recorded in
+    sample_ids_by_collection_date.
+    Meant to be run offline: processes holding sample ids, like a running API, see a mix of old and new ids until
+    they pick up the data generation bumped at the end.
+    If this fails part way, the dropped constraints can be restored with: python constraints.py restore --all-pending
+    :return: number of samples renumbered
+    """
+    await ConstraintManager.drop_constraints(SAMPLE_ID_CONSTRAINTS)
+    try:
+        # they compare a row's new samples with other rows' samples, which may not have been renumbered yet
+        await ih_samples_by_allele.drop_triggers()
+        await ih_samples_by_amino_acid.drop_triggers()
+        async with get_async_write_session() as session:
+            n_samples = await _create_sample_id_map(session)
+            for table, column in SAMPLE_ID_COLUMNS:
+                await session.execute(
+                    text(
+                        f'update {table} t\n'
+                        f'set {column} = m.new_id\n'
+                        f'from tmp_sample_id_map m\n'
+                        f'where m.old_id = t.{column};'
+                    )
+                )
+            for table in SAMPLE_BITMAP_TABLES:
+                # ids with no sample left to map them to are dropped
+                await session.execute(
+                    text(
+                        f'update {table} t\n'
+                        f"set {ColumnNames.samples_present} = (\n"
+                        f"    select coalesce(rb_build_agg(m.new_id), rb_build('{{}}'))\n"
+                        f'    from rb_iterate(t.{ColumnNames.samples_present}) as u(old_id)\n'
+                        f'    inner join tmp_sample_id_map m on m.old_id = u.old_id\n'
+                        f');'
+                    )
+                )
+            await session.execute(
+                text(
+                    f"select setval(pg_get_serial_sequence('{TableNames.samples}', 'id'), greatest(:n_samples, 1), "
+                    f':n_samples > 0);'
+                ),
+                {'n_samples': n_samples}
+            )
+            await _record_sample_ids_by_collection_date(session)
+            await session.commit()
+    finally:
+        # the triggers are restored even if the constraints can't be, which can be retried with constraints.py
+        try:
+            await ConstraintManager.restore_constraints(SAMPLE_ID_CONSTRAINTS)
+        finally:
+            try:
+                await ih_samples_by_allele.restore_triggers()
+            finally:
+                await ih_samples_by_amino_acid.restore_triggers()
+
+    await cache_samples_by_collection_date.refresh()
+    await cache_cns_pmv_sums.refresh()
+    await bump_data_generation('compact_sample_ids')
+    return n_samples
+
+
+async def clear_sample_ids_by_collection_date():
+    """
+    Samples ingestion appends new ids and may change the collection dates of existing samples, so the ranges
+    recorded by the last compaction no longer hold afterwards.
+    """
+    async with get_async_write_session() as session:
+        await session.execute(text(f'delete from {TableNames.sample_ids_by_collection_date};'))
+        await session.commit()
+
+
+async def _create_sample_id_map(session: AsyncSession) -> int:
+    await session.execute(
+        text(
+            f'create temp table tmp_sample_id_map on commit drop as\n'
+            f'select s.id as old_id,\n'
+            f'       (row_number() over (\n'
+            f'           order by s.{ColumnNames.mid_collection_date} nulls last,\n'
+            f'                    s.{ColumnNames.collection_span} nulls last,\n'
+            f'                    s.{ColumnNames.geo_location_id} nulls last,\n'
+            f'                    s.id\n'
+            f'       ))::integer as new_id\n'
+            f'from (\n'
+            f'    select id, {ColumnNames.geo_location_id},\n'
+            f'           {ColumnNames.collection_end_date} - {ColumnNames.collection_start_date} '
+            f'as {ColumnNames.collection_span},\n'
+            f'           {MID_COLLECTION_DATE_CALCULATION}\n'
+            f'    from {TableNames.samples}\n'
+            f') s;'
+        )
+    )
+    await session.execute(text('create unique index on tmp_sample_id_map (old_id);'))
+    await session.execute(text('analyze tmp_sample_id_map;'))
+    return await session.scalar(text('select count(*) from tmp_sample_id_map;'))
+
+
+async def _record_sample_ids_by_collection_date(session: AsyncSession):
+    # ordered by midpoint first, the samples of each date are exactly the ids between the first and the last
+    await session.execute(text(f'delete from {TableNames.sample_ids_by_collection_date};'))
+    await session.execute(
+        text(
+            f'insert into {TableNames.sample_ids_by_collection_date} (\n'
+            f'    {ColumnNames.mid_collection_date}, {ColumnNames.first_sample_id}, {ColumnNames.last_sample_id}\n'
+            f')\n'
+            f'select {ColumnNames.mid_collection_date}, min(id), max(id)\n'
+            f'from (\n'
+            f'    select id, {MID_COLLECTION_DATE_CALCULATION}\n'
+            f'    from {TableNames.samples}\n'
+            f'    where num_nulls({ColumnNames.collection_end_date}, {ColumnNames.collection_start_date}) = 0\n'
+            f') s\n'
+            f'group by {ColumnNames.mid_collection_date};'
+        )
+    )
+
@@ -1,12 +1,12 @@
-from math import floor
+from typing import List
 
 import polars as pl
 from sqlalchemy import select
-from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.sql.expression import text
 
 from DB.engine import get_async_write_session, get_asyncpg_connection, get_async_session, get_uri_for_polars
 from DB.models import Sample
-from utils.constants import ASYNCPG_MAX_QUERY_ARGS, ColumnNames, ConstraintNames
+from utils.constants import ColumnNames, ConstraintNames, TableNames
 from utils.errors import NotFoundError
 
 
@@ -48,7 +48,60 @@ async def copy_insert_samples(samples: pl.DataFrame) -> str:
     return res
 
 
-async def batch_upsert_samples(samples: pl.DataFrame):
+async def copy_upsert_samples(samples: pl.DataFrame) -> (int, int, int):
+    """
+    Insert new samples and update existing ones with the same accession, in one statement.
+    Samples are binary-copied into a temp table first, rather than sent as parameters, and existing samples are only
+    touched if one of the updatable columns changed.
+    An accession repeated within samples is an error, as with copy_insert_samples.
+    :param samples: columns of the samples table, including accession
+    :return: (int: count of samples inserted, int: count of existing samples updated,
+    int: count of existing samples left as they were)
+    """
+    columns = list(samples.columns)
+    update_columns = _get_update_columns(samples)
+    tmp_samples = 'tmp_samples'
+    columns_str = ', '.join(columns)
+
+    async with get_async_write_session() as session:
+        await session.execute(text(
+            f'create temporary table {tmp_samples} on commit drop as\n'
+            f'select {columns_str} from {TableNames.samples}\n'
+            f'with no data;'
+        ))
+
+        connection = await session.connection()
+        raw_connection = await connection.get_raw_connection()
+        await raw_connection.driver_connection.copy_records_to_table(
+            tmp_samples,
+            records=samples.iter_rows(),
+            columns=columns
+        )
+
+        # xmax is only zero for newly inserted rows
+        res = await session.execute(text(
+            f'with upserted as (\n'
+            f'insert into {TableNames.samples} ({columns_str})\n'
+            f'select {columns_str} from {tmp_samples}\n'
+            f'on conflict on constraint {ConstraintNames.uq_samples_accession}\n'
+            f'do update set {", ".join(f"{cn} = excluded.{cn}" for cn in update_columns)}\n'
+            f'where ({", ".join(f"{TableNames.samples}.{cn}" for cn in update_columns)})\n'
+            f'is distinct from ({", ".join(f"excluded.{cn}" for cn in update_columns)})\n'
+            f'returning (xmax = 0) as inserted\n'
+            f')\n'
+            f'select count(*) filter (where inserted), count(*) filter (where not inserted)\n'
+            f'from upserted;'
+        ))
+        count_inserted, count_updated = res.one()
+        await session.commit()
+
+    return count_inserted, count_updated, samples.height - count_inserted - count_updated
+
+
+def _get_update_columns(samples: pl.DataFrame) -> List[str]:
+    """
+    :return: columns replaced when a sample with the same accession already exists
+    """
     update_columns = [
         ColumnNames.organism,
         ColumnNames.is_retracted,
@@ -65,6 +118,7 @@ async def batch_upsert_samples(samples: pl.DataFrame):
         ColumnNames.serotype,
         ColumnNames.avg_spot_length,
         ColumnNames.bio_project,
+        ColumnNames.bio_sample,
         ColumnNames.bio_sample_model,
         ColumnNames.center_name,
         ColumnNames.experiment,
@@ -88,31 +142,7 @@ async def batch_upsert_samples(samples: pl.DataFrame):
         if colname in samples.columns:
             update_columns.append(colname)
 
-    all_columns = update_columns + [ColumnNames.accession]
-
-    batch_size = floor(ASYNCPG_MAX_QUERY_ARGS / len(all_columns))
-    slice_start = 0
-    while slice_start < len(samples):
-        updates_slice = samples.slice(slice_start, batch_size)
-        slice_start += batch_size
-
-        base_insert = (
-            insert(Sample)
-            .values(
-                updates_slice
-                .select([pl.col(cn) for cn in all_columns])
-                .to_dicts()
-            )
-        )
-
-        async with get_async_write_session() as session:
-            await session.execute(
-                base_insert.on_conflict_do_update(
-                    constraint=ConstraintNames.uq_samples_accession,
-                    set_={k: getattr(base_insert.excluded, k) for k in update_columns}
-                )
-            )
-            await session.commit()
+    return update_columns
 
 
 async def get_sample_id_by_accession(accession: str) -> int:
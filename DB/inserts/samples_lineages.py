@@ -1,6 +1,10 @@
+import polars as pl
+from sqlalchemy import select, and_
+from sqlalchemy.sql.expression import text
+
 from DB.engine import get_async_write_session
 from DB.models import SampleLineage
-from sqlalchemy import select, and_
+from utils.constants import ColumnNames, ConstraintNames, TableNames
 
 
 async def insert_sample_lineage(sl: SampleLineage) -> int:
@@ -35,4 +39,57 @@ async def upsert_sample_lineage(sl: SampleLineage) -> bool:
             modified = True
         # if the existing is a consensus call, then we know that the new one is too
         # and there's no real update to do, since abundance must be null.
-    return modified
\ No newline at end of file
+    return modified
+
+
+async def copy_upsert_samples_lineages(samples_lineages: pl.DataFrame) -> (int, int):
+    """
+    Bulk version of upsert_sample_lineage.
+    The rows are copied into a temp table and upserted in one statement. Existing records are only touched if their
+    abundance changed.
+    :param samples_lineages: sample_id, lineage_id, is_consensus_call, abundance.
+    Must be unique on (sample_id, lineage_id, is_consensus_call).
+    :return: (int: count of records inserted, int: count of existing records modified)
+    """
+    columns = [
+        ColumnNames.sample_id,
+        ColumnNames.lineage_id,
+        ColumnNames.is_consensus_call,
+        ColumnNames.abundance
+    ]
+    tmp_samples_lineages = 'tmp_samples_lineages'
+    columns_str = ', '.join(columns)
+
+    async with get_async_write_session() as session:
+        await session.execute(text(
+            f'create temporary table {tmp_samples_lineages} (\n'
+            f'{ColumnNames.sample_id} integer not null,\n'
+            f'{ColumnNames.lineage_id} bigint not null,\n'
+            f'{ColumnNames.is_consensus_call} boolean not null,\n'
+            f'{ColumnNames.abundance} double precision\n'
+            f') on commit drop;'
+        ))
+
+        connection = await session.connection()
+        raw_connection = await connection.get_raw_connection()
+        await raw_connection.driver_connection.copy_records_to_table(
+            tmp_samples_lineages,
+            records=samples_lineages.select(columns).iter_rows(),
+            columns=columns
+        )
+
+        # xmax is only zero for newly inserted rows
+        res = await session.execute(text(
+            f'insert into {TableNames.samples_lineages} ({columns_str})\n'
+            f'select {columns_str} from {tmp_samples_lineages}\n'
+            f'on conflict on constraint {ConstraintNames.uq_samples_lineages_sample_id_lineage_id_is_consensus_call}\n'
+            f'do update set {ColumnNames.abundance} = excluded.{ColumnNames.abundance}\n'
+            f'where {TableNames.samples_lineages}.{ColumnNames.abundance} '
+            f'is distinct from excluded.{ColumnNames.abundance}\n'
+            f'returning (xmax = 0) as inserted;'
+        ))
+        inserted = [r[0] for r in res.all()]
+        await session.commit()
+
+    count_inserted = sum(inserted)
+    return count_inserted, len(inserted) - count_inserted
@@ -0,0 +1,155 @@
+import asyncio
+from datetime import datetime, timezone, timedelta
+from typing import Callable, Awaitable, Iterable, List
+
+from sqlalchemy.sql.expression import text
+
+from DB.engine import get_async_write_session
+
+
+class Stage:
+    def __init__(
+        self,
+        name: str,
+        run: Callable[[], Awaitable[int | None]],
+        depends_on: Iterable[str] = (),
+        output_table: str | None = None
+    ):
+        """
+        :param name: unique name of the stage within its pipeline
+        :param run: coroutine function doing the work. May return the number of rows it wrote.
+        :param depends_on: names of stages that must complete before this one starts
+        :param output_table: table whose row count is recorded after the stage, if run doesn't return a count
+        """
+        self.name = name
+        self.run = run
+        self.depends_on = tuple(depends_on)
+        self.output_table = output_table
+
+
+class StageResult:
+    def __init__(self, name: str, started_at: datetime, finished_at: datetime, row_count: int | None):
+        self.name = name
+        self.started_at = started_at
+        self.finished_at = finished_at
+        self.row_count = row_count
+
+    @property
+    def elapsed(self) -> timedelta:
+        return self.finished_at - self.started_at
+
+
+class StagePipeline:
+    """
+    Runs a graph of stages, starting each one as soon as all of its dependencies have completed.
+    """
+
+    def __init__(self, stages: List[Stage], max_parallel: int = 1):
+        names = [stage.name for stage in stages]
+        if len(set(names)) != len(names):
+            raise ValueError(f'Stage names must be unique: {names}')
+        for stage in stages:
+            for dependency in stage.depends_on:
+                if dependency not in names:
+                    raise ValueError(f'Stage {stage.name} depends on unknown stage {dependency}')
+        self.stages = {stage.name: stage for stage in stages}
+        self.max_parallel = max_parallel
+
+    async def run(
+        self,
+        completed: Iterable[str] = (),
+        on_stage_done: Callable[[StageResult], Awaitable[None]] | None = None
+    ) -> List[StageResult]:
+        """
+        Run all stages not already completed.
+        If a stage fails, no new stages are started, but stages already running are allowed to finish
+        (and are reported to on_stage_done) before the error is raised.
+        :param completed: names of stages to skip, e.g. completed in an earlier attempt
+        :param on_stage_done: called after each stage completes successfully
+        :return: results of the stages run, in order of completion
+        """
+        done = {name for name in completed if name in self.stages}
+        pending = {name: stage for name, stage in self.stages.items() if name not in done}
+        running: dict[asyncio.Task, str] = dict()
+        results = []
+        error = None
+
+        while len(running) > 0 or (len(pending) > 0 and error is None):
+            if error is None:
+                ready = [stage for stage in pending.values() if all(d in done for d in stage.depends_on)]
+                for stage in ready[:max(self.max_parallel - len(running), 0)]:
+                    pending.pop(stage.name)
+                    running[asyncio.create_task(self._run_stage(stage))] = stage.name
+                if len(running) == 0:
+                    raise ValueError(f'Stages can never be started, check for dependency cycles: {", ".join(pending)}')
+
+            finished, _ = await asyncio.wait(running.keys(), return_when=asyncio.FIRST_COMPLETED)
+            for task in finished:
+                name = running.pop(task)
+                if task.exception() is not None:
+                    print(f'Stage {name} failed')
+                    error = error or task.exception()
+                    continue
+                done.add(name)
+                results.append(task.result())
+                if on_stage_done is not None:
+                    await on_stage_done(task.result())
+
+        if error is not None:
+            raise error
+        return results
+
+    @staticmethod
+    async def _run_stage(stage: Stage) -> StageResult:
+        print(f'{datetime.now().isoformat(timespec="seconds")} {stage.name}')
+        started_at = datetime.now(timezone.utc)
+        row_count = await stage.run()
+        if row_count is None and stage.output_table is not None:
+            row_count = await _count_rows(stage.output_table)
+        return StageResult(stage.name, started_at, datetime.now(timezone.utc), row_count)
+
+
+async def _count_rows(tablename: str) -> int:
+    async with get_async_write_session() as session:
+        return await session.scalar(text(f'select count(*) from {tablename};'))
+
+
+def format_stage_report(results: List[StageResult]) -> str:
+    name_width = max([len(r.name) for r in results] + [len('stage')])
+    lines = [f'{"stage":<{name_width}}  {"elapsed":>10}  {"rows":>12}']
+    for r in results:
+        rows = '' if r.row_count is None else f'{r.row_count:,}'
+        lines.append(f'{r.name:<{name_width}}  {str(r.elapsed).split(".")[0]:>10}  {rows:>12}')
+    return '\n'.join(lines)
+
+
+def get_critical_path(stages: List[Stage], results: List[StageResult]) -> List[StageResult]:
+    """
+    The chain of dependent stages with the longest total elapsed time, i.e. the one that bounds the wall time
+    of the pipeline no matter how many stages run in parallel.
+    Stages without a result, e.g. completed in an earlier attempt, count as taking no time.
+    :return: results of the stages on the critical path, in order of execution
+    """
+    results_by_name = {r.name: r for r in results}
+    stages_by_name = {s.name: s for s in stages}
+    # total elapsed time of the longest chain ending at each stage, and the stage before it in that chain
+    longest: dict[str, tuple[timedelta, str | None]] = dict()
+
+    def visit(name: str) -> timedelta:
+        if name not in longest:
+            before, total = None, timedelta(0)
+            for dependency in stages_by_name[name].depends_on:
+                if visit(dependency) > total:
+                    before, total = dependency, longest[dependency][0]
+            if name in results_by_name:
+                total += results_by_name[name].elapsed
+            longest[name] = (total, before)
+        return longest[name][0]
+
+    end = max(stages_by_name, key=visit, default=None)
+    path = []
+    while end is not None:
+        if end in results_by_name:
+            path.append(results_by_name[end])
+        end = longest[end][1]
+    return path[::-1]
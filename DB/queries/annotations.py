@@ -5,8 +5,9 @@ from sqlalchemy import text
 
 from DB.engine import get_async_session
 from DB.queries.date_count_helpers import get_extract_clause, get_group_by_clause, get_order_by_cause, \
-    MID_COLLECTION_DATE_CALCULATION, YEAR, CHUNK, BIN_START, BIN_END
-from parser.parser import parser
+    get_collection_date_bins_cte, YEAR, CHUNK, BIN_START, BIN_END
+from DB.queries.sample_subsets import get_sample_subset_bitmap, SampleSubsetJoins, SAMPLE_SUBSET_BM_SELECT, \
+    SAMPLE_SUBSET_BM_PARAM
 from utils.constants import DateBinOpt, COLLECTION_DATE, TableNames, ColumnNames
 
 
@@ -26,9 +27,7 @@ async def _annotations_by_collection_date(
     where: str | None,
     intra_host: bool,
 ) -> List[Dict]:
-    user_where_clause = ''
-    if where is not None:
-        user_where_clause = f'and ({parser.parse(where)})'
+    sample_subset_bm = await get_sample_subset_bitmap(where, SampleSubsetJoins.assigned_lineages)
 
     # Which samples carry each annotated change, as (aa_id, bitmap). This is the only thing that
     # separates the consensus and intra-host halves of this endpoint; the rest of the query is shared.
@@ -56,6 +55,7 @@ async def _annotations_by_collection_date(
     extract_clause = get_extract_clause(COLLECTION_DATE, date_bin, days)
     group_by_clause = get_group_by_clause(date_bin)
     order_by_clause = get_order_by_cause(date_bin)
+    bins_cte = get_collection_date_bins_cte(extract_clause, group_by_clause)
 
     match date_bin:
         case DateBinOpt.week | DateBinOpt.month:
@@ -66,24 +66,10 @@ async def _annotations_by_collection_date(
             raise NotImplementedError
 
     query = f'''
-        with binned_samples as (
-            select s.id as sample_id,
-                {MID_COLLECTION_DATE_CALCULATION}
-            from {TableNames.samples} s
-            left join {TableNames.geo_locations} gl on gl.id = s.{ColumnNames.geo_location_id}
-            inner join {TableNames.samples_lineages} sl on sl.{ColumnNames.sample_id} = s.id
-            inner join {TableNames.lineages} l on l.id = sl.{ColumnNames.lineage_id}
-            inner join {TableNames.lineage_systems} ls on ls.id = l.{ColumnNames.lineage_system_id}
-            where num_nulls({ColumnNames.collection_end_date}, {ColumnNames.collection_start_date}) = 0
-              and ({ColumnNames.collection_end_date} - {ColumnNames.collection_start_date}) <= :max_span_days
-              {user_where_clause}
-        ),
-        bins as (
-            select {extract_clause},
-                   rb_build_agg(sample_id) as bm
-            from binned_samples
-            {group_by_clause}
+        with sample_subset_bm as (
+            {SAMPLE_SUBSET_BM_SELECT}
         ),
+        {bins_cte},
         annotated as (
             select aaa.{ColumnNames.amino_acid_id} as aa_id,
                    bool_or(e.{ColumnNames.detail} = :effect_detail) as has_effect
@@ -118,6 +104,7 @@ async def _annotations_by_collection_date(
             {
                 'effect_detail': effect_detail,
                 'max_span_days': max_span_days,
+                SAMPLE_SUBSET_BM_PARAM: sample_subset_bm,
             }
         )
         rows = res.all()
@@ -170,9 +157,7 @@ async def _annotations_by_amino_acid_position(
     where: str | None,
     intra_host: bool,
 ) -> Dict:
-    user_where_clause = ''
-    if where is not None:
-        user_where_clause = f'and ({parser.parse(where)})'
+    sample_subset_bm = await get_sample_subset_bitmap(where, SampleSubsetJoins.assigned_lineages)
 
     # Which samples carry each annotated change, as (aa_id, bitmap). This is the only thing that
     # separates the consensus and intra-host halves of this endpoint; the rest of the query is shared.
@@ -198,13 +183,7 @@ async def _annotations_by_amino_acid_position(
 
     query = f'''
         with matching_bm as (
-            select rb_build_agg(s.id) as bm
-            from {TableNames.samples} s
-            left join {TableNames.geo_locations} gl on gl.id = s.{ColumnNames.geo_location_id}
-            inner join {TableNames.samples_lineages} sl on sl.{ColumnNames.sample_id} = s.id
-            inner join {TableNames.lineages} l on l.id = sl.{ColumnNames.lineage_id}
-            inner join {TableNames.lineage_systems} ls on ls.id = l.{ColumnNames.lineage_system_id}
-            where true {user_where_clause}
+            {SAMPLE_SUBSET_BM_SELECT}
         ),
         annotated as (
             select aa.id as aa_id,
@@ -233,7 +212,10 @@ async def _annotations_by_amino_acid_position(
         having sum(card) > 0
     '''
     async with get_async_session() as session:
-        res = await session.execute(text(query), {'effect_detail': effect_detail})
+        res = await session.execute(
+            text(query),
+            {'effect_detail': effect_detail, SAMPLE_SUBSET_BM_PARAM: sample_subset_bm}
+        )
         rows = res.all()
     out = defaultdict(list)
     for r in rows:
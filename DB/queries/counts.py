@@ -4,10 +4,12 @@ from sqlalchemy import text, Result
 
 from DB.engine import get_async_session
 from DB.queries.helpers import get_ih_table_and_change_cols
+from DB.queries.sample_subsets import get_sample_subset_bitmap, SampleSubsetJoins, SAMPLE_SUBSET_BM_SELECT, \
+    SAMPLE_SUBSET_BM_PARAM
 from DB.queries.date_count_helpers import get_extract_clause, get_group_by_clause, get_order_by_cause, \
     MID_COLLECTION_DATE_CALCULATION
 from parser.parser import parser
-from utils.constants import DateBinOpt, NtOrAa, ColumnNames, COLLECTION_DATE
+from utils.constants import DateBinOpt, NtOrAa, ColumnNames, COLLECTION_DATE, TableNames
 
 
 async def count_samples_by_column(by_col: str, where: str | None = None):
@@ -38,6 +40,7 @@ async def count_variants_by_column(
     # Counts are of (sample, change) observations. The frequency bins of a single change are collapsed
     # with rb_or_agg *before* counting, so a sample that appears in two bins for the same change is
     # counted once; summing rb_cardinality per bin would count it twice.
+    query_params = dict()
     if where is None:
         subset_cte = ''
         per_change_count = f'rb_or_cardinality_agg(v.{ColumnNames.samples_present})'
@@ -45,15 +48,12 @@ async def count_variants_by_column(
     else:
         subset_cte = f'''
             with sample_subset_bm as (
-                select coalesce(rb_build_agg(s.id), rb_build('{{}}')) as bm
-                from samples s
-                left join geo_locations gl on gl.id = s.geo_location_id
-                left join samples_lineages sl on sl.sample_id = s.id
-                left join lineages l on l.id = sl.lineage_id
-                left join lineage_systems ls on ls.id = l.lineage_system_id
-                where {parser.parse(where)}
+                {SAMPLE_SUBSET_BM_SELECT}
             )
         '''
+        query_params = {
+            SAMPLE_SUBSET_BM_PARAM: await get_sample_subset_bitmap(where, SampleSubsetJoins.lineages)
+        }
         per_change_count = \
             f'rb_and_cardinality(rb_or_agg(v.{ColumnNames.samples_present}), (select bm from sample_subset_bm))'
         having_clause = 'having sum(n) > 0'
@@ -75,7 +75,7 @@ async def count_variants_by_column(
     '''
 
     async with get_async_session() as session:
-        res = await session.execute(text(query))
+        res = await session.execute(text(query), query_params)
         return await _package_count_by_column(res)
 
 
@@ -163,38 +163,39 @@ async def count_samples_by_collection_date(
     where: str | None,
     max_span_days: int,
 ) -> Dict[str, int]:
-    user_where_clause = ''
-    if where is not None:
-        user_where_clause = f'where {parser.parse(where)}'
-
     extract_clause = get_extract_clause(COLLECTION_DATE, date_bin, days)
     group_by_clause = get_group_by_clause(date_bin)
     order_by_clause = get_order_by_cause(date_bin)
 
+    params = {'max_span_days': max_span_days}
+    subset_cte = ''
+    count_expression = f'rb_or_cardinality_agg(d.{ColumnNames.samples_present})'
+    having_clause = ''
+    if where is not None:
+        params[SAMPLE_SUBSET_BM_PARAM] = await get_sample_subset_bitmap(where, SampleSubsetJoins.geo_locations)
+        subset_cte = f'with sample_subset_bm as ({SAMPLE_SUBSET_BM_SELECT})'
+        count_expression = (
+            f'rb_and_cardinality(rb_or_agg(d.{ColumnNames.samples_present}), (select bm from sample_subset_bm))'
+        )
+        # bins are only reported if they hold at least one matching sample
+        having_clause = f'having {count_expression} > 0'
+
     async with get_async_session() as session:
         res = await session.execute(
             text(
                 f'''
+                {subset_cte}
                 select
                     {extract_clause},
-                    count(*)
-                from (
-                    select
-                    {MID_COLLECTION_DATE_CALCULATION}
-                    from (
-                        select
-                        *,
-                        collection_end_date - collection_start_date as collection_span
-                        from samples s
-                        left join geo_locations gl on gl.id = s.geo_location_id
-                        {user_where_clause}
-                    )
-                    where collection_span <= {max_span_days}
-                )
-               {group_by_clause}
-               {order_by_clause}
+                    {count_expression}
+                from {TableNames.cache_samples_by_collection_date} d
+                where d.{ColumnNames.collection_span} <= :max_span_days
+                {group_by_clause}
+                {having_clause}
+                {order_by_clause}
                 '''
-            )
+            ),
+            params
         )
     out_data = dict()
     for r in res:
@@ -0,0 +1,27 @@
+import time
+
+from sqlalchemy import text
+
+from DB.engine import get_async_session
+from utils.constants import TableNames, DATA_GENERATION_TTL_SECONDS
+
+_last_generation: int | None = None
+_last_checked: float = float('-inf')
+
+
+async def get_data_generation() -> int:
+    """
+    The data generation increases every time an ingest changes the data. It is read from the database
+    at most once every DATA_GENERATION_TTL_SECONDS, so that checking it on every request stays cheap.
+    :return: the current data generation, 0 if nothing has been ingested since the table was created
+    """
+    global _last_generation, _last_checked
+    now = time.monotonic()
+    if _last_generation is None or now - _last_checked >= DATA_GENERATION_TTL_SECONDS:
+        async with get_async_session() as session:
+            generation = await session.scalar(
+                text(f'select coalesce(max(id), 0) from {TableNames.data_generation};')
+            )
+        _last_generation = generation
+        _last_checked = now
+    return _last_generation
@@ -1,7 +1,7 @@
 import datetime
 from typing import List
 
-from utils.constants import DateBinOpt, COLLECTION_DATE
+from utils.constants import DateBinOpt, COLLECTION_DATE, TableNames, ColumnNames
 
 MID_COLLECTION_DATE = 'mid_collection_date'
 MID_COLLECTION_DATE_CALCULATION = \
@@ -61,3 +61,18 @@ def get_order_by_cause(date_bin: DateBinOpt) -> str:
             return f'order by {BIN_START}'
         case _:
             raise NotImplementedError
+
+
+def get_collection_date_bins_cte(extract_clause: str, group_by_clause: str) -> str:
+    """
+    CTE "bins": the bitmap of the samples in sample_subset_bm per collection date bin, with the bin columns given
+    by the extract clause. Unions the per-day bitmaps of the collection date cache rather than binning every sample.
+    Bins are limited to samples spanning at most :max_span_days, and bins left empty by the subset are kept.
+    """
+    return f'''bins as (
+            select {extract_clause},
+                   rb_and(rb_or_agg(d.{ColumnNames.samples_present}), (select bm from sample_subset_bm)) as bm
+            from {TableNames.cache_samples_by_collection_date} d
+            where d.{ColumnNames.collection_span} <= :max_span_days
+            {group_by_clause}
+        )'''
@@ -18,9 +18,9 @@ from utils.constants import (
 def get_ih_table_and_change_cols(change_bin: NtOrAa):
     """
     (bitmap table, change id col, change catalog table, feature col, ref col, pos col, alt col) for
-    the intra-host tables. Unlike the cns_* pair there is no by-sample transposition of these: they
-    are keyed (change id, alt_freq_range) only, with one row per 0.05-wide frequency bin, so a sample
-    restriction has to be applied by intersecting bitmaps rather than by joining on sample_id.
+    the intra-host tables. These are keyed (change id, alt_freq_range), with one row per 0.05-wide
+    frequency bin, so a sample restriction has to be applied by intersecting bitmaps rather than by
+    joining on sample_id. Their by-sample transpositions are ih_alleles_by_sample and ih_amino_acids_by_sample.
     """
     if change_bin == NtOrAa.nt:
         return (
@@ -4,8 +4,10 @@ from sqlalchemy import text
 
 from DB.engine import get_async_session
 from DB.queries.date_count_helpers import get_extract_clause, get_group_by_clause, get_order_by_cause, \
-    MID_COLLECTION_DATE_CALCULATION, YEAR, CHUNK, BIN_START, BIN_END
+    get_collection_date_bins_cte, MID_COLLECTION_DATE_CALCULATION, YEAR, CHUNK, BIN_START, BIN_END
 from DB.queries.helpers import get_appropriate_translations_table_and_id
+from DB.queries.sample_subsets import get_sample_subset_bitmap, SampleSubsetJoins, SAMPLE_SUBSET_BM_SELECT, \
+    SAMPLE_SUBSET_BM_PARAM
 from api.models import PhenotypeMetricInfo
 from parser.parser import parser
 from utils.constants import DateBinOpt, COLLECTION_DATE, ColumnNames, TableNames
@@ -125,13 +127,12 @@ async def count_mutations_gte_pheno_value_by_collection_date(
     max_span_days: int,
     where: str | None,
 ) -> List[Dict]:
-    user_where_clause = ''
-    if where is not None:
-        user_where_clause = f'and ({parser.parse(where)})'
+    sample_subset_bm = await get_sample_subset_bitmap(where, SampleSubsetJoins.assigned_lineages)
 
     extract_clause = get_extract_clause(COLLECTION_DATE, date_bin, days)
     group_by_clause = get_group_by_clause(date_bin)
     order_by_clause = get_order_by_cause(date_bin)
+    bins_cte = get_collection_date_bins_cte(extract_clause, group_by_clause)
 
     match date_bin:
         case DateBinOpt.week | DateBinOpt.month:
@@ -142,24 +143,10 @@ async def count_mutations_gte_pheno_value_by_collection_date(
             raise NotImplementedError
 
     query = f'''
-        with binned_samples as (
-            select s.id as sample_id,
-                {MID_COLLECTION_DATE_CALCULATION}
-            from {TableNames.samples} s
-            left join {TableNames.geo_locations} gl on gl.id = s.{ColumnNames.geo_location_id}
-            inner join {TableNames.samples_lineages} sl on sl.{ColumnNames.sample_id} = s.id
-            inner join {TableNames.lineages} l on l.id = sl.{ColumnNames.lineage_id}
-            inner join {TableNames.lineage_systems} ls on ls.id = l.{ColumnNames.lineage_system_id}
-            where num_nulls({ColumnNames.collection_end_date}, {ColumnNames.collection_start_date}) = 0
-              and ({ColumnNames.collection_end_date} - {ColumnNames.collection_start_date}) <= :max_span_days
-              {user_where_clause}
-        ),
-        bins as (
-            select {extract_clause},
-                   rb_build_agg(sample_id) as bm
-            from binned_samples
-            {group_by_clause}
+        with sample_subset_bm as (
+            {SAMPLE_SUBSET_BM_SELECT}
         ),
+        {bins_cte},
         scored as (
             select pmv.{ColumnNames.amino_acid_id} as aa_id, pmv.value as value
             from {TableNames.phenotype_metric_values} pmv
@@ -189,6 +176,7 @@ async def count_mutations_gte_pheno_value_by_collection_date(
                 'pm_name': phenotype_metric_name,
                 'threshold': phenotype_metric_value_threshold,
                 'max_span_days': max_span_days,
+                SAMPLE_SUBSET_BM_PARAM: sample_subset_bm,
             }
         )
         rows = res.all()
@@ -215,13 +203,12 @@ async def count_variants_gte_pheno_value_by_collection_date(
     min_alt_freq: float | None = None,
     max_alt_freq: float | None = None,
 ) -> List[Dict]:
-    user_where_clause = ''
-    if where is not None:
-        user_where_clause = f'and ({parser.parse(where)})'
+    sample_subset_bm = await get_sample_subset_bitmap(where, SampleSubsetJoins.assigned_lineages)
 
     extract_clause = get_extract_clause(COLLECTION_DATE, date_bin, days)
     group_by_clause = get_group_by_clause(date_bin)
     order_by_clause = get_order_by_cause(date_bin)
+    bins_cte = get_collection_date_bins_cte(extract_clause, group_by_clause)
 
     match date_bin:
         case DateBinOpt.week | DateBinOpt.month:
@@ -232,24 +219,10 @@ async def count_variants_gte_pheno_value_by_collection_date(
             raise NotImplementedError
 
     query = f'''
-        with binned_samples as (
-            select s.id as sample_id,
-                {MID_COLLECTION_DATE_CALCULATION}
-            from {TableNames.samples} s
-            left join {TableNames.geo_locations} gl on gl.id = s.{ColumnNames.geo_location_id}
-            inner join {TableNames.samples_lineages} sl on sl.{ColumnNames.sample_id} = s.id
-            inner join {TableNames.lineages} l on l.id = sl.{ColumnNames.lineage_id}
-            inner join {TableNames.lineage_systems} ls on ls.id = l.{ColumnNames.lineage_system_id}
-            where num_nulls({ColumnNames.collection_end_date}, {ColumnNames.collection_start_date}) = 0
-              and ({ColumnNames.collection_end_date} - {ColumnNames.collection_start_date}) <= :max_span_days
-              {user_where_clause}
-        ),
-        bins as (
-            select {extract_clause},
-                   rb_build_agg(sample_id) as bm
-            from binned_samples
-            {group_by_clause}
+        with sample_subset_bm as (
+            {SAMPLE_SUBSET_BM_SELECT}
         ),
+        {bins_cte},
         scored as (
             select pmv.{ColumnNames.amino_acid_id} as aa_id, pmv.value as value
             from {TableNames.phenotype_metric_values} pmv
@@ -287,6 +260,7 @@ async def count_variants_gte_pheno_value_by_collection_date(
                 'pm_name': phenotype_metric_name,
                 'threshold': phenotype_metric_value_threshold,
                 'max_span_days': max_span_days,
+                SAMPLE_SUBSET_BM_PARAM: sample_subset_bm,
                 'min_alt_freq': min_alt_freq,
                 'max_alt_freq': max_alt_freq,
             }
@@ -431,17 +405,46 @@ async def get_pheno_value_for_variants_by_sample_and_collection_date(
         user_where_clause = f'and ({parser.parse(where)})'
 
     # Per sample: the summed metric value over the scored changes it carries, and how many it carries.
-    # This is the only part that differs between the consensus and intra-host halves, and the two get
-    # there from opposite directions.
+    # This is the only part that differs between the consensus and intra-host halves.
 
     extract_clause = get_extract_clause(COLLECTION_DATE, date_bin, days)
     group_by_clause = get_group_by_clause(date_bin)
     order_by_clause = get_order_by_cause(date_bin)
 
-    # There is no by-sample transposition of the intra-host data, so the per-sample view has to be
-    # rebuilt: collapse each scored change's frequency bins into one bitmap, intersect that with
-    # the sample subset, then unnest back to sample ids.
-    per_sample_cte = f'''
+    if await _ih_amino_acids_by_sample_is_built():
+        # The by-sample transposition keeps one row per sample and frequency bin. A sample may carry the
+        # same change in more than one bin, so its bins are merged before the changes are counted.
+        per_sample_cte = f'''
+          scored_bm as (
+              select rb_build_agg(aa_id) as bm
+              from scored
+          ),
+          carried as (
+              select v.{ColumnNames.sample_id} as sample_id,
+                     rb_or_agg(v.{ColumnNames.amino_acids_present}) as bm
+              from {TableNames.ih_amino_acids_by_sample} v
+              where v.{ColumnNames.sample_id} in (select sample_id from matching_samples)
+              group by v.{ColumnNames.sample_id}
+          ),
+          per_sample as (
+              select ms.sample_id,
+                     ms.collection_start_date,
+                     ms.collection_end_date,
+                     sum(sc.value) as aggregate_value,
+                     count(sc.aa_id) as n_amino_acid_mutations
+              from matching_samples ms
+              inner join carried c on c.sample_id = ms.sample_id
+              cross join lateral unnest(
+                  rb_to_array(c.bm & (select bm from scored_bm))
+              ) as u(aa_id)
+              inner join scored sc on sc.aa_id = u.aa_id
+              group by ms.sample_id, ms.collection_start_date, ms.collection_end_date
+          )'''
+    else:
+        # Until the by-sample table is backfilled, rebuild the per-sample view from the by-change bitmaps:
+        # collapse each scored change's frequency bins into one bitmap, intersect that with the sample subset,
+        # then unnest back to sample ids.
+        per_sample_cte = f'''
           matching_bm as (
               select coalesce(rb_build_agg(sample_id), rb_build('{{}}')) as bm
               from matching_samples
@@ -532,3 +535,17 @@ async def get_pheno_value_for_variants_by_sample_and_collection_date(
             }
         )
     return out_data
+
+
+async def _ih_amino_acids_by_sample_is_built() -> bool:
+    """
+    Whether ih_amino_acids_by_sample can be read in place of ih_samples_by_amino_acid. It is only empty while the
+    latter is, unless it has not been backfilled yet in a database ingested before it existed.
+    """
+    async with get_async_session() as session:
+        return await session.scalar(
+            text(
+                f'select exists (select 1 from {TableNames.ih_amino_acids_by_sample})\n'
+                f'    or not exists (select 1 from {TableNames.ih_samples_by_amino_acid});'
+            )
+        )
@@ -4,6 +4,8 @@ from sqlalchemy import text
 
 from DB.engine import get_async_session
 from DB.queries.helpers import get_ih_table_and_change_cols
+from DB.queries.sample_subsets import get_sample_subset_bitmap, SampleSubsetJoins, SAMPLE_SUBSET_BM_SELECT, \
+    SAMPLE_SUBSET_BM_PARAM
 from api.models import VariantFreqInfo, VariantCountPhenoScoreInfo, MutationCountInfo
 from parser.parser import parser
 from utils.constants import ColumnNames, NtOrAa, TableNames
@@ -185,18 +187,19 @@ async def get_pheno_values_and_variant_counts(
     if include_refs:
         no_refs_filter = ""
 
+    query_params = {"region": region, "pm_name": pheno_metric_name}
     if where is None:
         sample_subset_cte = ""
         count_expr = f"rb_or_cardinality_agg(v.{ColumnNames.samples_present})"
     else:
         sample_subset_cte = f"""
             with sample_subset_bm as (
-                select coalesce(rb_build_agg(s.id), rb_build('{{}}')) as bm
-                from {TableNames.samples} s
-                left join {TableNames.geo_locations} gl on gl.id = s.{ColumnNames.geo_location_id}
-                where {parser.parse(where)}
+                {SAMPLE_SUBSET_BM_SELECT}
             )
         """
+        query_params[SAMPLE_SUBSET_BM_PARAM] = await get_sample_subset_bitmap(
+            where, SampleSubsetJoins.geo_locations
+        )
         count_expr = (
             f"rb_and_cardinality(rb_or_agg(v.{ColumnNames.samples_present}), "
             f"(select bm from sample_subset_bm))"
@@ -220,7 +223,7 @@ async def get_pheno_values_and_variant_counts(
                 order by count desc;
                 """
             ),
-            {"region": region, "pm_name": pheno_metric_name},
+            query_params,
         )
 
     out_data = []
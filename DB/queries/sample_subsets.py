@@ -0,0 +1,125 @@
+import asyncio
+from enum import StrEnum
+
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+from DB.engine import get_async_session
+from DB.queries.data_generation import get_data_generation
+from parser.facets import compile_sample_facets
+from parser.parser import parser
+from utils.constants import TableNames, ColumnNames, SAMPLE_SUBSET_CACHE_MAX_BYTES
+from utils.generation_cache import GenerationCache
+
+SAMPLE_SUBSET_BM_PARAM = 'sample_subset_bm'
+# Selects the bitmap given by get_sample_subset_bitmap as a roaringbitmap, as bm, for use as a CTE
+SAMPLE_SUBSET_BM_SELECT = f'select cast(:{SAMPLE_SUBSET_BM_PARAM} as bytea)::roaringbitmap as bm'
+
+
+class SampleSubsetJoins(StrEnum):
+    """
+    Tables joined to samples that a filter may reference. These decide which samples a filter can match,
+    not just which columns it may use, so they are part of the cache key.
+    """
+    # geo_locations only
+    geo_locations = 'geo_locations'
+    # geo_locations, then samples_lineages, lineages and lineage_systems, all left joined
+    lineages = 'lineages'
+    # as lineages, but inner joined, so samples without a lineage never match
+    assigned_lineages = 'assigned_lineages'
+
+
+_GEO_LOCATIONS_JOIN = (
+    f'left join {TableNames.geo_locations} gl on gl.id = s.{ColumnNames.geo_location_id}\n'
+)
+
+
+def _get_lineages_join(join_type: str) -> str:
+    return (
+        _GEO_LOCATIONS_JOIN +
+        f'{join_type} join {TableNames.samples_lineages} sl on sl.{ColumnNames.sample_id} = s.id\n'
+        f'{join_type} join {TableNames.lineages} l on l.id = sl.{ColumnNames.lineage_id}\n'
+        f'{join_type} join {TableNames.lineage_systems} ls on ls.id = l.{ColumnNames.lineage_system_id}\n'
+    )
+
+
+_JOINS = {
+    SampleSubsetJoins.geo_locations: _GEO_LOCATIONS_JOIN,
+    SampleSubsetJoins.lineages: _get_lineages_join('left'),
+    SampleSubsetJoins.assigned_lineages: _get_lineages_join('inner'),
+}
+
+_subsets = GenerationCache(SAMPLE_SUBSET_CACHE_MAX_BYTES, getsizeof=len)
+_building: dict[tuple, asyncio.Task] = dict()
+
+
+async def get_sample_subset_bitmap(where: str | None, joins: SampleSubsetJoins) -> bytes:
+    """
+    Bitmap of the ids of the samples matching a filter, serialized. Kept in process until the data generation
+    changes, so that endpoints queried with the same filter, e.g. by a dashboard, only build it once.
+    Concurrent requests for a bitmap that is still being built wait for that build rather than starting another.
+    :param where: user filter, None to match every sample the joins allow
+    :param joins: tables joined to samples for the filter
+    :return: bitmap to be passed as SAMPLE_SUBSET_BM_PARAM to a query using SAMPLE_SUBSET_BM_SELECT
+    """
+    user_where_clause = 'true' if where is None else parser.parse(where)
+    facets_bm = None
+    # sample_facets has no record of which samples have a lineage, so it cannot apply that join's restriction
+    if where is not None and joins != SampleSubsetJoins.assigned_lineages:
+        facets_bm = compile_sample_facets(where)
+    key = (joins, user_where_clause)
+    try:
+        generation = await get_data_generation()
+    except DBAPIError:
+        # e.g. the data_generation table has not been created in this database yet
+        return await _build_sample_subset_bitmap(user_where_clause, facets_bm, joins)
+
+    bitmap = _subsets.get(generation, key)
+    if bitmap is not None:
+        return bitmap
+
+    build_key = (generation, *key)
+    task = _building.get(build_key)
+    if task is None:
+        task = asyncio.create_task(_build_sample_subset_bitmap(user_where_clause, facets_bm, joins))
+        _building[build_key] = task
+        task.add_done_callback(lambda _: _building.pop(build_key, None))
+    # one waiting request being cancelled must not cancel the build for the others
+    bitmap = await asyncio.shield(task)
+    _subsets.put(generation, key, bitmap)
+    return bitmap
+
+
+async def _build_sample_subset_bitmap(
+    user_where_clause: str,
+    facets_bm: str | None,
+    joins: SampleSubsetJoins
+) -> bytes:
+    if facets_bm is not None and await _sample_facets_are_built():
+        query = f'select ({facets_bm})::bytea;'
+    else:
+        query = (
+            f"select coalesce(rb_build_agg(s.id), rb_build('{{}}'))::bytea\n"
+            f'from {TableNames.samples} s\n'
+            f'{_JOINS[joins]}'
+            f'where {user_where_clause};'
+        )
+    async with get_async_session() as session:
+        return await session.scalar(text(query))
+
+
+async def _sample_facets_are_built() -> bool:
+    """
+    Whether sample_facets can be used in place of samples. It is only empty while samples is, unless it was
+    never built, e.g. in a database created before it existed.
+    """
+    try:
+        async with get_async_session() as session:
+            return await session.scalar(
+                text(
+                    f'select exists (select 1 from {TableNames.sample_facets})\n'
+                    f'    or not exists (select 1 from {TableNames.samples});'
+                )
+            )
+    except DBAPIError:
+        return False
@@ -6,6 +6,8 @@ from DB.engine import get_async_session
 from DB.queries.date_count_helpers import get_extract_clause, get_group_by_clause, get_order_by_cause, \
     MID_COLLECTION_DATE_CALCULATION
 from DB.queries.helpers import get_ih_table_and_change_cols
+from DB.queries.sample_subsets import get_sample_subset_bitmap, SampleSubsetJoins, SAMPLE_SUBSET_BM_SELECT, \
+    SAMPLE_SUBSET_BM_PARAM
 from api.models import VariantNucleotideInfo, VariantAminoAcidInfo
 from parser.parser import parser
 from utils.constants import ColumnNames, DateBinOpt, NtOrAa, TableNames, COLLECTION_DATE
@@ -54,7 +56,7 @@ async def get_variants_by_sample(
     min_alt_freq: float | None = None,
     max_alt_freq: float | None = None
 ) -> List['VariantNucleotideInfo'] | List['VariantAminoAcidInfo']:
-    user_where_clause = parser.parse(where)
+    sample_subset_bm = await get_sample_subset_bitmap(where, SampleSubsetJoins.geo_locations)
     ih_table, change_id_col, catalog_table, *_ = get_ih_table_and_change_cols(change_bin)
     if change_bin == NtOrAa.nt:
         model = VariantNucleotideInfo
@@ -65,10 +67,7 @@ async def get_variants_by_sample(
 
     variants_query = f'''
         with sample_subset_bm as (
-            select coalesce(rb_build_agg(s.id), rb_build('{{}}')) as bm
-            from {TableNames.samples} s
-            left join {TableNames.geo_locations} gl on gl.id = s.{ColumnNames.geo_location_id}
-            where {user_where_clause}
+            {SAMPLE_SUBSET_BM_SELECT}
         )
         select
             u.{ColumnNames.sample_id},
@@ -87,7 +86,11 @@ async def get_variants_by_sample(
     async with get_async_session() as session:
         result = await session.execute(
             text(variants_query),
-            {'min_alt_freq': min_alt_freq, 'max_alt_freq': max_alt_freq}
+            {
+                'min_alt_freq': min_alt_freq,
+                'max_alt_freq': max_alt_freq,
+                SAMPLE_SUBSET_BM_PARAM: sample_subset_bm
+            }
         )
         return [model(**row) for row in result.mappings().all()]
 
@@ -1,5 +1,26 @@
+from sqlalchemy.sql.expression import text
+
+from DB.engine import get_async_write_session
 from DB.structure.utils import run_sql_file
+from utils.constants import TableNames
 
 
 async def create_all():
     await run_sql_file('sql/cache_cns_pmv_sums/create_matview.sql')
+
+
+async def refresh():
+    """
+    Bring the cache up to date, e.g. after sample ids have changed, creating it if it does not exist yet.
+    """
+    async with get_async_write_session() as session:
+        exists = await session.scalar(
+            text('select to_regclass(:name) is not null;'),
+            {'name': TableNames.cache_cns_pmv_sums}
+        )
+    if not exists:
+        await create_all()
+        return
+    async with get_async_write_session() as session:
+        await session.execute(text(f'refresh materialized view {TableNames.cache_cns_pmv_sums};'))
+        await session.commit()
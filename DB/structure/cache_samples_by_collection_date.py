@@ -0,0 +1,30 @@
+from sqlalchemy.sql.expression import text
+
+from DB.engine import get_async_write_session
+from DB.structure.utils import run_sql_file
+from utils.constants import TableNames
+
+
+async def create_all():
+    await run_sql_file('sql/cache_samples_by_collection_date/create_matview.sql')
+    await run_sql_file('sql/cache_samples_by_collection_date/create_unique_index.sql')
+
+
+async def refresh():
+    """
+    Bring the cache up to date after samples have changed, creating it if it does not exist yet.
+    The refresh is concurrent, so queries can keep reading the cache meanwhile.
+    """
+    async with get_async_write_session() as session:
+        exists = await session.scalar(
+            text('select to_regclass(:name) is not null;'),
+            {'name': TableNames.cache_samples_by_collection_date}
+        )
+    if not exists:
+        await create_all()
+        return
+    async with get_async_write_session() as session:
+        await session.execute(
+            text(f'refresh materialized view concurrently {TableNames.cache_samples_by_collection_date};')
+        )
+        await session.commit()
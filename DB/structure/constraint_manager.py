@@ -1,50 +1,154 @@
-from typing import Iterable
+import re
+from typing import Iterable, List
 
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.sql.expression import text
 
 from DB.engine import get_async_write_session
+from DB.structure.utils import run_statements_in_parallel, apply_local_settings
+from utils.constants import TableNames, ColumnNames
+
+# max number of sessions building indexes at once while restoring
+RESTORE_PARALLELISM = 4
+# per session, so the total memory used is up to RESTORE_PARALLELISM times this
+RESTORE_SETTINGS = {
+    'maintenance_work_mem': '2GB',
+    'max_parallel_maintenance_workers': '4',
+}
+
+# contype values in pg_constraint for constraints backed by a unique index
+PRIMARY_KEY = 'p'
+UNIQUE = 'u'
+INDEX_BACKED_TYPES = {PRIMARY_KEY, UNIQUE}
 
 
 class ConstraintManager:
-    _dropped_cons_defs = dict()
+    """
+    Drops constraints and restores them later, e.g. to speed up bulk inserts.
+    The definitions of dropped constraints are kept in the dropped_constraints table, written in the same
+    transaction as the drop, so that they survive the process that dropped them.
+    Anything left there by a failed process can be restored with: python constraints.py restore --all-pending
+    """
 
     @classmethod
     async def drop_constraints(cls, connames: Iterable[str]):
-        commit_defs = dict()
         async with get_async_write_session() as session:
             for conname in connames:
                 res = await session.execute(
                     text(
-                        'select ut.relname, c.oid\n'
+                        'select ut.relname, c.contype::text, pg_get_constraintdef(c.oid),\n'
+                        '       case when c.conindid <> 0 then pg_get_indexdef(c.conindid) end\n'
                         'from pg_constraint c\n'
                         'inner join pg_stat_user_tables ut on ut.relid = c.conrelid\n'
                         'where conname = :conname'
                     ),
                     {'conname': conname}
                 )
-                relname, oid = res.one()
-
-                res = await session.execute(text('select pg_get_constraintdef(:oid);'), {'oid': oid})
-                def_ = res.one()[0]
-
-                create_statement = f'alter table {relname} add constraint {conname} {def_};'
+                row = res.one_or_none()
+                if row is None:
+                    # dropping again, e.g. from a resumed run, is fine as long as we still know how to restore it
+                    if conname in await cls._get_pending_names(session, [conname]):
+                        continue
+                    raise ValueError(f'Constraint {conname} does not exist and has no pending restore')
+                relname, contype, def_, index_def = row
 
+                await session.execute(
+                    text(
+                        f'insert into {TableNames.dropped_constraints} (\n'
+                        f'    {ColumnNames.constraint_name}, {ColumnNames.table_name}, {ColumnNames.constraint_type},\n'
+                        f'    {ColumnNames.constraint_def}, {ColumnNames.index_def}\n'
+                        f')\n'
+                        f'values (:conname, :relname, :contype, :constraint_def, :index_def);'
+                    ),
+                    {
+                        'conname': conname,
+                        'relname': relname,
+                        'contype': contype,
+                        'constraint_def': f'alter table {relname} add constraint {conname} {def_};',
+                        'index_def': index_def if contype in INDEX_BACKED_TYPES else None,
+                    }
+                )
                 await session.execute(
                     text(f'alter table {relname} drop constraint {conname};'),
                 )
-                commit_defs[conname] = create_statement
 
             await session.commit()
-        cls._dropped_cons_defs.update(commit_defs)
 
     @classmethod
     async def restore_constraints(cls, connames: Iterable[str]):
+        """
+        Restore dropped constraints. Indexes behind primary keys and unique constraints are built first,
+        in parallel sessions, and then attached; other constraints, like foreign keys, are added after that,
+        as they may depend on the former.
+        Constraints that are already in place and have no pending restore are skipped.
+        """
+        connames = list(connames)
         async with get_async_write_session() as session:
-            for conname in connames:
-                await session.execute(text(cls._dropped_cons_defs[conname]))
+            res = await session.execute(
+                text(
+                    f'select {ColumnNames.constraint_name}, {ColumnNames.table_name}, {ColumnNames.constraint_type},\n'
+                    f'       {ColumnNames.constraint_def}, {ColumnNames.index_def}\n'
+                    f'from {TableNames.dropped_constraints}\n'
+                    f'where {ColumnNames.constraint_name} = any(:connames);'
+                ),
+                {'connames': connames}
+            )
+            pending = {r[0]: r for r in res.all()}
+            missing = [c for c in connames if c not in pending]
+            if len(missing) > 0:
+                res = await session.execute(
+                    text('select conname from pg_constraint where conname = any(:connames);'),
+                    {'connames': missing}
+                )
+                existing = set(res.scalars().all())
+                unknown = [c for c in missing if c not in existing]
+                if len(unknown) > 0:
+                    raise ValueError(f'No definitions found for constraints: {", ".join(unknown)}')
+
+        index_backed = [r for r in pending.values() if r[2] in INDEX_BACKED_TYPES and r[4] is not None]
+        # a build that committed before an earlier attempt died is picked up as it is
+        await run_statements_in_parallel(
+            [cls._if_not_exists(r[4]) for r in index_backed],
+            RESTORE_PARALLELISM,
+            RESTORE_SETTINGS
+        )
+
+        async with get_async_write_session() as session:
+            await apply_local_settings(session, RESTORE_SETTINGS)
+            for conname, relname, contype, _, index_def in index_backed:
+                kind = 'primary key' if contype == PRIMARY_KEY else 'unique'
+                await session.execute(
+                    text(
+                        f'alter table {relname} add constraint {conname} {kind} '
+                        f'using index {cls._get_index_name(index_def)};'
+                    )
+                )
+            index_backed_names = {r[0] for r in index_backed}
+            for conname, _, _, constraint_def, _ in pending.values():
+                if conname not in index_backed_names:
+                    await session.execute(text(constraint_def))
+            await session.execute(
+                text(
+                    f'delete from {TableNames.dropped_constraints}\n'
+                    f'where {ColumnNames.constraint_name} = any(:connames);'
+                ),
+                {'connames': list(pending.keys())}
+            )
             await session.commit()
-        for conname in connames:
-            cls._dropped_cons_defs.pop(conname)
+
+    @classmethod
+    async def restore_all_pending(cls) -> List[str]:
+        """
+        Restore every constraint still recorded as dropped, e.g. after an ingest process died.
+        :return: names of the constraints restored
+        """
+        async with get_async_write_session() as session:
+            res = await session.execute(
+                text(f'select {ColumnNames.constraint_name} from {TableNames.dropped_constraints};')
+            )
+            connames = list(res.scalars().all())
+        await cls.restore_constraints(connames)
+        return connames
 
     @classmethod
     async def drop_constraint(cls, conname: str):
@@ -53,3 +157,22 @@ class ConstraintManager:
     @classmethod
     async def restore_constraint(cls, conname: str):
         await cls.restore_constraints([conname])
+
+    @staticmethod
+    async def _get_pending_names(session: AsyncSession, connames: List[str]) -> set[str]:
+        res = await session.execute(
+            text(
+                f'select {ColumnNames.constraint_name} from {TableNames.dropped_constraints}\n'
+                f'where {ColumnNames.constraint_name} = any(:connames);'
+            ),
+            {'connames': connames}
+        )
+        return set(res.scalars().all())
+
+    @staticmethod
+    def _get_index_name(index_def: str) -> str:
+        return re.match(r'^CREATE (?:UNIQUE )?INDEX (\S+) ON ', index_def).group(1)
+
+    @staticmethod
+    def _if_not_exists(index_def: str) -> str:
+        return re.sub(r'^CREATE (UNIQUE )?INDEX ', r'CREATE \1INDEX IF NOT EXISTS ', index_def)
@@ -0,0 +1,6 @@
+from DB.structure.utils import run_sql_file
+
+
+async def create_all():
+    await run_sql_file('sql/data_generation/create_table_data_generation.sql')
+    await run_sql_file('sql/data_generation/create_pk_data_generation.sql')
@@ -0,0 +1,6 @@
+from DB.structure.utils import run_sql_file
+
+
+async def create_all():
+    await run_sql_file('sql/dropped_constraints/create_table_dropped_constraints.sql')
+    await run_sql_file('sql/dropped_constraints/create_pk_dropped_constraints.sql')
@@ -0,0 +1,7 @@
+from DB.structure.utils import run_sql_file
+
+
+async def create_all():
+    await run_sql_file('sql/ih_amino_acids_by_sample/create_table_ih_amino_acids_by_sample.sql')
+    await run_sql_file('sql/ih_amino_acids_by_sample/create_pk_ih_amino_acids_by_sample.sql')
+    await run_sql_file('sql/ih_amino_acids_by_sample/create_fk_sample_id.sql')
\ No newline at end of file
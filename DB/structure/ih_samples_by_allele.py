@@ -1,8 +1,4 @@
-from sqlalchemy.sql.expression import text
-
-from DB.engine import get_async_write_session
 from DB.structure.utils import run_sql_file
-from utils.constants import TableNames, ColumnNames
 
 
 async def create_all():
@@ -23,8 +19,3 @@ async def drop_triggers():
 async def restore_triggers():
     await run_sql_file('sql/ih_samples_by_allele/create_trigger_check_range_overlap.sql')
     await run_sql_file('sql/ih_samples_by_allele/create_trigger_check_sample_uq_within_allele.sql')
-    async with get_async_write_session() as session:
-        await session.execute(
-            text(f'update {TableNames.ih_samples_by_allele} set {ColumnNames.allele_id} = {ColumnNames.allele_id};')
-        )
-        await session.commit()
\ No newline at end of file
@@ -0,0 +1,6 @@
+from DB.structure.utils import run_sql_file
+
+
+async def create_all():
+    await run_sql_file('sql/ingest_ledger/create_table_ingest_ledger.sql')
+    await run_sql_file('sql/ingest_ledger/create_pk_ingest_ledger.sql')
@@ -0,0 +1,7 @@
+from DB.structure.utils import run_sql_file
+
+
+async def create_all():
+    await run_sql_file('sql/ingest_run_stages/create_table_ingest_run_stages.sql')
+    await run_sql_file('sql/ingest_run_stages/create_pk_ingest_run_stages.sql')
+    await run_sql_file('sql/ingest_run_stages/create_fk_ingest_run_id.sql')
@@ -0,0 +1,6 @@
+from DB.structure.utils import run_sql_file
+
+
+async def create_all():
+    await run_sql_file('sql/ingest_runs/create_table_ingest_runs.sql')
+    await run_sql_file('sql/ingest_runs/create_pk_ingest_runs.sql')
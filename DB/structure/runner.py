@@ -2,12 +2,16 @@ from DB.structure import samples, geo_locations, alleles, amino_acids, phenotype
     phenotype_metric_values, cns_samples_by_allele, cns_samples_by_amino_acid, lineage_systems, \
     lineages, samples_lineages, lineages_immediate_children, lineages_deep_children, \
      effects, papers, annotations, annotations_papers, annotations_amino_acids, \
-    cns_alleles_by_sample, cns_amino_acids_by_sample, ih_samples_by_allele, ih_samples_by_amino_acid
+    cns_alleles_by_sample, cns_amino_acids_by_sample, ih_samples_by_allele, ih_samples_by_amino_acid, \
+    ih_alleles_by_sample, ih_amino_acids_by_sample, ingest_ledger, ingest_runs, ingest_run_stages, dropped_constraints, \
+    data_generation, sample_facets, sample_ids_by_collection_date
 
 
 async def set_up_db():
     await geo_locations.create_all()
     await samples.create_all()
+    await sample_facets.create_all()
+    await sample_ids_by_collection_date.create_all()
     await alleles.create_all()
     await amino_acids.create_all()
 
@@ -17,7 +21,9 @@ async def set_up_db():
     await cns_amino_acids_by_sample.create_all()
 
     await ih_samples_by_allele.create_all()
+    await ih_alleles_by_sample.create_all()
     await ih_samples_by_amino_acid.create_all()
+    await ih_amino_acids_by_sample.create_all()
 
     await phenotype_metrics.create_all()
     await phenotype_metric_values.create_all()
@@ -33,3 +39,10 @@ async def set_up_db():
     await annotations.create_all()
     await annotations_papers.create_all()
     await annotations_amino_acids.create_all()
+
+    await ingest_ledger.create_all()
+    await ingest_runs.create_all()
+    await ingest_run_stages.create_all()
+
+    await dropped_constraints.create_all()
+    await data_generation.create_all()
@@ -0,0 +1,6 @@
+from DB.structure.utils import run_sql_file
+
+
+async def create_all():
+    await run_sql_file('sql/sample_facets/create_table_sample_facets.sql')
+    await run_sql_file('sql/sample_facets/create_pk_sample_facets.sql')
@@ -0,0 +1,6 @@
+from DB.structure.utils import run_sql_file
+
+
+async def create_all():
+    await run_sql_file('sql/sample_ids_by_collection_date/create_table_sample_ids_by_collection_date.sql')
+    await run_sql_file('sql/sample_ids_by_collection_date/create_pk_sample_ids_by_collection_date.sql')
@@ -0,0 +1,7 @@
+create materialized view cache_samples_by_collection_date as
+select (collection_start_date + ((collection_end_date - collection_start_date) / 2))::date as mid_collection_date,
+       collection_end_date - collection_start_date as collection_span,
+       rb_build_agg(id) as samples_present
+from samples
+where num_nulls(collection_end_date, collection_start_date) = 0
+group by mid_collection_date, collection_span;
@@ -0,0 +1,2 @@
+create unique index uq_cache_samples_by_collection_date
+on cache_samples_by_collection_date (mid_collection_date, collection_span);
@@ -0,0 +1 @@
+alter table data_generation add constraint pk_data_generation primary key (id);
@@ -0,0 +1,5 @@
+create table data_generation (
+	id serial not null,
+	source text not null,
+	bumped_at timestamp with time zone not null default now()
+);
@@ -0,0 +1 @@
+alter table dropped_constraints add constraint pk_dropped_constraints primary key (constraint_name);
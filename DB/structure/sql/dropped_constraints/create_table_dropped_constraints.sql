@@ -0,0 +1,8 @@
+create table dropped_constraints (
+	constraint_name text not null,
+	table_name text not null,
+	constraint_type char not null,
+	constraint_def text not null,
+	index_def text,
+	dropped_at timestamp with time zone not null default now()
+);
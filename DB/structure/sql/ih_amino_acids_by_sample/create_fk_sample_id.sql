@@ -0,0 +1,2 @@
+alter table ih_amino_acids_by_sample add constraint fk_ih_amino_acids_by_sample_sample_id_samples
+foreign key (sample_id) references samples (id);
\ No newline at end of file
@@ -0,0 +1,2 @@
+alter table ih_amino_acids_by_sample add constraint pk_ih_amino_acids_by_sample
+primary key (sample_id, alt_freq_range);
\ No newline at end of file
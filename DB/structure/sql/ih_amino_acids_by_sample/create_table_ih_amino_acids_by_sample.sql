@@ -0,0 +1,5 @@
+create table ih_amino_acids_by_sample (
+	sample_id integer not null,
+	alt_freq_range numrange not null,
+	amino_acids_present roaringbitmap not null
+);
\ No newline at end of file
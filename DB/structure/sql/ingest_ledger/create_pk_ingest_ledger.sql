@@ -0,0 +1,2 @@
+alter table ingest_ledger add constraint pk_ingest_ledger
+primary key (accession, record_type);
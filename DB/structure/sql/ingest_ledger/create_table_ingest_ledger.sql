@@ -0,0 +1,7 @@
+create table ingest_ledger (
+	accession text not null,
+	record_type text not null,
+	source_file text not null,
+	content_hash text not null,
+	ingested_at timestamp with time zone not null default now()
+);
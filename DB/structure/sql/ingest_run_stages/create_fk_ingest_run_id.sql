@@ -0,0 +1,2 @@
+alter table ingest_run_stages add constraint fk_ingest_run_stages_ingest_run_id_ingest_runs
+foreign key (ingest_run_id) references ingest_runs (id);
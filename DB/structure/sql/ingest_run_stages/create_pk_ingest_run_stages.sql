@@ -0,0 +1,2 @@
+alter table ingest_run_stages add constraint pk_ingest_run_stages
+primary key (ingest_run_id, stage_name);
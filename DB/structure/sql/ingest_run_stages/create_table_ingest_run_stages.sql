@@ -0,0 +1,7 @@
+create table ingest_run_stages (
+	ingest_run_id integer not null,
+	stage_name text not null,
+	started_at timestamp with time zone not null,
+	finished_at timestamp with time zone not null,
+	row_count bigint
+);
@@ -0,0 +1 @@
+alter table ingest_runs add constraint pk_ingest_runs primary key (id);
@@ -0,0 +1,8 @@
+create table ingest_runs (
+	id serial not null,
+	parser_name text not null,
+	input_files text[] not null,
+	status text not null,
+	started_at timestamp with time zone not null default now(),
+	finished_at timestamp with time zone
+);
@@ -0,0 +1 @@
+alter table sample_facets add constraint pk_sample_facets primary key (facet, value);
@@ -0,0 +1,5 @@
+create table sample_facets (
+	facet text not null,
+	value text not null,
+	samples_present roaringbitmap not null
+);
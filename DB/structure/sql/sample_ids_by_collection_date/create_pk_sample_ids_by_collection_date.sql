@@ -0,0 +1,2 @@
+alter table sample_ids_by_collection_date add constraint pk_sample_ids_by_collection_date
+primary key (mid_collection_date);
@@ -0,0 +1,5 @@
+create table sample_ids_by_collection_date (
+	mid_collection_date date not null,
+	first_sample_id integer not null,
+	last_sample_id integer not null
+);
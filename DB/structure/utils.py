@@ -1,4 +1,6 @@
+import asyncio
 from pathlib import Path
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.sql.expression import text
 
 from DB.engine import get_async_write_session
@@ -11,3 +13,36 @@ async def run_sql_file(filename: str):
     async with get_async_write_session() as session:
         await session.execute(text(query))
         await session.commit()
+
+
+async def run_statements_in_parallel(
+    statements: list[str],
+    max_parallel: int,
+    settings: dict[str, str] | None = None
+):
+    """
+    Run each statement in its own session and transaction, at most max_parallel at a time.
+    Intended for independent DDL like index builds, which postgres can run concurrently on separate connections.
+    :param statements: SQL statements to run
+    :param max_parallel: maximum number of sessions in use at once
+    :param settings: server settings applied to each transaction only, e.g. maintenance_work_mem
+    """
+    slots = asyncio.Semaphore(max_parallel)
+
+    async def run_statement(statement: str):
+        async with slots:
+            async with get_async_write_session() as session:
+                await apply_local_settings(session, settings)
+                await session.execute(text(statement))
+                await session.commit()
+
+    await asyncio.gather(*[run_statement(s) for s in statements])
+
+
+async def apply_local_settings(session: AsyncSession, settings: dict[str, str] | None):
+    """
+    Apply server settings for the rest of the session's current transaction,
+    so that they don't stick to the pooled connection afterwards.
+    """
+    for name, value in (settings or dict()).items():
+        await session.execute(text('select set_config(:name, :value, true);'), {'name': name, 'value': value})
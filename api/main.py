@@ -6,12 +6,13 @@ import re
 from fastapi import APIRouter, FastAPI, HTTPException, Path, Query, Request
 from fastapi.routing import APIRoute
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from fastmcp import FastMCP
 from sqlalchemy.exc import DBAPIError
 
 import DB.queries.annotations
 import DB.queries.counts
+import DB.queries.data_generation
 import DB.queries.helpers
 import DB.queries.lineages
 import DB.queries.mutations
@@ -33,10 +34,11 @@ from api.models import VariantNucleotideInfo, VariantAminoAcidInfo, SampleInfo,
     MutationAminoAcidCountByDateAndLineageInfo, PhenotypeMetricDateCountInfo, \
     PhenotypeMetricAggregateByDateInfo, AnnotationProportionByDateInfo, AnnotatedPositionCountInfo, \
     LineageAbundanceWithSampleInfo, AverageLineageAbundanceInfo
+from api.response_cache import ResponseCache, CachedResponse, get_cache_key
 from utils.constants import CHANGE_PATTERN, WORDLIKE_PATTERN, DateBinOpt, NtOrAa, \
     DEFAULT_MAX_SPAN_DAYS, COLLECTION_DATE, DEFAULT_DAYS, COMMA_SEP_WORDLIKE_PATTERN, \
     DEFAULT_PREVALENCE_THRESHOLD, MIN_PREVALENCE_THRESHOLD, FILTER_SYNTAX_HELP, DistinctValueField, \
-    WastewaterGeoBin
+    WastewaterGeoBin, RESPONSE_CACHE_MAX_BYTES
 from utils.errors import ParsingError
 
 log = logging.getLogger(__name__)
@@ -131,6 +133,40 @@ def filter_query(columns_help: str, *, required: bool = True) -> Query:
         description=f'{columns_help}\n\n{FILTER_SYNTAX_HELP}',
     )
 
+response_cache = ResponseCache(RESPONSE_CACHE_MAX_BYTES)
+
+
+@app.middleware('http')
+async def cache_responses(request: Request, call_next):
+    """
+    The data only changes when an ingest runs, so successful GET responses under /v1 are kept until the
+    next ingest bumps the data generation, or the day ends for responses that depend on today's date.
+    Registered before the CORS middleware so that it runs inside it,
+    and cached responses still get the CORS headers of the request they answer.
+    """
+    if request.method != 'GET' or not request.url.path.startswith(router.prefix + '/'):
+        return await call_next(request)
+    key = get_cache_key(request.url.path, request.query_params.multi_items())
+    if key is None:
+        return await call_next(request)
+    try:
+        generation = await DB.queries.data_generation.get_data_generation()
+    except DBAPIError as e:
+        # e.g. the data_generation table has not been created in this database yet
+        log.warning(f'Not caching responses, unable to read the data generation: {e}')
+        return await call_next(request)
+
+    cached = response_cache.get(generation, key)
+    if cached is None:
+        response = await call_next(request)
+        if response.status_code != 200:
+            return response
+        body = b''.join([chunk async for chunk in response.body_iterator])
+        cached = CachedResponse(response.status_code, dict(response.headers), body)
+        response_cache.put(generation, key, cached)
+    return Response(content=cached.body, status_code=cached.status_code, headers=cached.headers)
+
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=['*'],
@@ -0,0 +1,44 @@
+from datetime import date
+from typing import Iterable, NamedTuple, Tuple
+
+from parser.parser import parser
+from utils.errors import ParsingError
+from utils.generation_cache import GenerationCache
+
+FILTER_PARAM = 'filter'
+
+
+class CachedResponse(NamedTuple):
+    status_code: int
+    headers: dict[str, str]
+    body: bytes
+
+
+class ResponseCache(GenerationCache):
+    """
+    Response bodies, kept until the data generation changes.
+    """
+
+    def __init__(self, max_bytes: int):
+        super().__init__(max_bytes, getsizeof=lambda r: len(r.body))
+
+
+def get_cache_key(path: str, query_params: Iterable[Tuple[str, str]]) -> tuple | None:
+    """
+    Requests that only differ in the order of their parameters, or in how their filter is spaced, get the
+    same key. The filter is compared as parsed, e.g. `host=Homo sapiens` and `host = Homo sapiens`.
+    Today's date is part of the key, as some responses depend on it, e.g. day bins counted from today
+    or days_before_today, and those must not outlive the day even if no ingest bumps the generation.
+    :param path: request path
+    :param query_params: (name, value) for each query parameter, repeated names included
+    :return: key for the request, or None if it should not be cached because its filter does not parse
+    """
+    normalized = []
+    for name, value in query_params:
+        if name == FILTER_PARAM:
+            try:
+                value = parser.parse(value)
+            except ParsingError:
+                return None
+        normalized.append((name, value))
+    return path, tuple(sorted(normalized)), date.today()
@@ -0,0 +1,43 @@
+import argparse
+from enum import StrEnum
+
+from utils.input_files import list_archive_members, find_archive_members, ARCHIVE_MEMBER_SEPARATOR
+
+
+class Commands(StrEnum):
+    list = 'list'
+    find = 'find'
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description='Inspect ingest archives without extracting them. '
+                    'Files are printed as <archive>::<member>, which runinserts.py accepts as input.'
+    )
+    argparser.add_argument('command', help=f'Options: {", ".join(Commands)}')
+    argparser.add_argument('archive', help='path to a .zip, .tar or .tar.gz archive')
+    argparser.add_argument(
+        'patterns',
+        help='find: shell patterns matched against the file names, e.g. "*variants.tsv". '
+             'One line is printed per pattern, in the same order',
+        nargs='*'
+    )
+
+    args = argparser.parse_args()
+
+    match args.command:
+        case Commands.list:
+            for member in list_archive_members(args.archive):
+                print(f'{args.archive}{ARCHIVE_MEMBER_SEPARATOR}{member}')
+        case Commands.find:
+            if len(args.patterns) == 0:
+                raise ValueError('find requires a pattern')
+            # like find ... | head -1 for each pattern, the line is empty if there is no match
+            for found in find_archive_members(args.archive, args.patterns):
+                print(found or '')
+        case _:
+            raise ValueError(f'Not a recognized command: {args.command}')
+
+
+if __name__ == '__main__':
+    main()
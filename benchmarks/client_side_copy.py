@@ -0,0 +1,110 @@
+"""
+Measure how fast VariantsMutationsCombinedParser loads its input files with client_side_copy=true,
+copying each file over a single connection against spreading it over several shards, and all the files at once.
+The columns are text, so this times reading, decompressing and sending the files and the server's csv parsing,
+not the type conversions of the real tmp tables.
+
+Usage: python3 -m benchmarks.client_side_copy variants.tsv.gz mutations.tsv.gz --shards 1 4 --runs 3
+
+Needs the same database environment as runinserts.py. Each file is copied into its own bench_ prefixed table,
+which is dropped afterwards.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from typing import List
+
+from sqlalchemy.sql.expression import text
+
+from DB.engine import get_async_write_session
+from DB.inserts.file_parsers.variants_mutations_combined_parser import VariantsMutationsCombinedParser
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='Benchmark client side copies of variants and mutations files')
+    argparser.add_argument('filenames', nargs='+', help='variants, codons or mutations files, may be compressed')
+    argparser.add_argument('--shards', type=int, nargs='+', default=[1, 4], help='connections per file to compare')
+    argparser.add_argument('--runs', type=int, default=3, help='times each load is run, the median is reported')
+    argparser.add_argument('--chunk_rows', type=int, default=100_000, help='rows per copied chunk')
+    args = argparser.parse_args()
+
+    asyncio.run(run_benchmark(args.filenames, args.shards, args.runs, args.chunk_rows))
+
+
+async def run_benchmark(filenames: List[str], shard_counts: List[int], runs: int, chunk_rows: int):
+    files = [
+        VariantsMutationsCombinedParser.InputFile(filename, client_side_copy=True, chunk_rows=chunk_rows)
+        for filename in filenames
+    ]
+    tables = [f'bench_client_side_copy_{i}' for i in range(len(files))]
+    await _set_up(files, tables)
+    try:
+        _, n_rows = await _time_load(files, tables, 1, 1, one_at_a_time=True)
+        print(f'{n_rows:,} rows in {len(files)} files')
+        for n_shards in shard_counts:
+            for one_at_a_time in [True, False]:
+                elapsed, _ = await _time_load(files, tables, n_shards, runs, one_at_a_time)
+                files_desc = 'one file at a time' if one_at_a_time else 'all files at once '
+                print(
+                    f'{n_shards:>3} shards per file, {files_desc}: '
+                    f'{elapsed:>8.1f} s ({n_rows / elapsed:>12,.0f} rows/s)'
+                )
+    finally:
+        await _clean_up(tables)
+
+
+async def _time_load(
+    files: List[VariantsMutationsCombinedParser.InputFile],
+    tables: List[str],
+    n_shards: int,
+    runs: int,
+    one_at_a_time: bool
+) -> (float, int):
+    elapsed = []
+    for _ in range(runs):
+        await _truncate(tables)
+        # as in the parser, the slots are shared between files and cap the connections copying at once
+        load_slots = asyncio.Semaphore(n_shards)
+        copies = [
+            file.copy_into_table_in_parallel(table, load_slots, n_shards=n_shards)
+            for file, table in zip(files, tables)
+        ]
+        start = time.perf_counter()
+        if one_at_a_time:
+            for copy in copies:
+                await copy
+        else:
+            await asyncio.gather(*copies)
+        elapsed.append(time.perf_counter() - start)
+    return statistics.median(elapsed), await _count_rows(tables)
+
+
+async def _set_up(files: List[VariantsMutationsCombinedParser.InputFile], tables: List[str]):
+    async with get_async_write_session() as session:
+        for file, table in zip(files, tables):
+            columns = ',\n'.join(f'    {column} text' for column in file.header_order)
+            await session.execute(text(f'create unlogged table {table} (\n{columns}\n);'))
+        await session.commit()
+
+
+async def _truncate(tables: List[str]):
+    async with get_async_write_session() as session:
+        await session.execute(text(f'truncate {", ".join(tables)};'))
+        await session.commit()
+
+
+async def _count_rows(tables: List[str]) -> int:
+    async with get_async_write_session() as session:
+        return sum([await session.scalar(text(f'select count(*) from {table};')) for table in tables])
+
+
+async def _clean_up(tables: List[str]):
+    async with get_async_write_session() as session:
+        for table in tables:
+            await session.execute(text(f'drop table if exists {table};'))
+        await session.commit()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""
+Compare the throughput of translating codons with the per-row plpgsql translate_codon() function,
+which VariantsMutationsCombinedParser used to install, against the join on tmp_codon_translations it uses now.
+
+Usage: python3 -m benchmarks.codon_translation --rows 50000000
+
+Needs the same database environment as runinserts.py. All tables and functions are created under a bench_ prefix
+and dropped afterwards.
+"""
+import argparse
+import asyncio
+import time
+
+from sqlalchemy.sql.expression import text
+
+from DB.engine import get_async_write_session
+from utils.constants import CODONS_AMINO_ACIDS
+
+FUNCTION_TRANSLATION = (
+    'select alt_codon,\n'
+    '       bench_translate_codon(alt_codon) as alt_aa,\n'
+    '       ref_codon,\n'
+    '       bench_translate_codon(ref_codon) as ref_aa\n'
+    'from bench_ih_codons'
+)
+
+JOIN_TRANSLATION = (
+    'select tic.alt_codon,\n'
+    '       alt_t.aa as alt_aa,\n'
+    '       tic.ref_codon,\n'
+    '       ref_t.aa as ref_aa\n'
+    'from bench_ih_codons tic\n'
+    'left join bench_codon_translations alt_t on alt_t.codon = tic.alt_codon\n'
+    'left join bench_codon_translations ref_t on ref_t.codon = tic.ref_codon'
+)
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='Benchmark codon translation during amino acid staging')
+    argparser.add_argument('--rows', type=int, default=50_000_000, help='number of rows in the synthetic codons table')
+    args = argparser.parse_args()
+
+    asyncio.run(run_benchmark(args.rows))
+
+
+async def run_benchmark(n_rows: int):
+    print(f'building bench_ih_codons with {n_rows} rows')
+    await _set_up(n_rows)
+    try:
+        function_s = await _time_translation(FUNCTION_TRANSLATION)
+        print(f'plpgsql function: {function_s:.1f} s ({n_rows / function_s:,.0f} rows/s)')
+
+        join_s = await _time_translation(
+            JOIN_TRANSLATION,
+            # the parser adds translations for the N-containing codons of each run before joining, so time that too
+            setup=(
+                'insert into bench_codon_translations (codon, aa)\n'
+                'select codon, \'X\'\n'
+                'from (\n'
+                '    select alt_codon as codon from bench_ih_codons\n'
+                '    union\n'
+                '    select ref_codon as codon from bench_ih_codons\n'
+                ') codons\n'
+                'where codon like \'%N%\'\n'
+                'on conflict (codon) do nothing;'
+            )
+        )
+        print(f'join:             {join_s:.1f} s ({n_rows / join_s:,.0f} rows/s)')
+        print(f'speedup:          {function_s / join_s:.1f}x')
+    finally:
+        await _clean_up()
+
+
+async def _time_translation(select: str, setup: str | None = None) -> float:
+    async with get_async_write_session() as session:
+        start = time.perf_counter()
+        if setup is not None:
+            await session.execute(text(setup))
+        await session.execute(text(f'create unlogged table bench_translated as\n{select};'))
+        await session.commit()
+        elapsed = time.perf_counter() - start
+
+        await session.execute(text('drop table bench_translated;'))
+        await session.commit()
+    return elapsed
+
+
+async def _set_up(n_rows: int):
+    async with get_async_write_session() as session:
+        await session.execute(
+            text(
+                'create unlogged table bench_codon_translations (\n'
+                '    codon text not null primary key,\n'
+                '    aa    text not null\n'
+                ');'
+            )
+        )
+        await session.execute(
+            text(
+                f"insert into bench_codon_translations (codon, aa)\n"
+                f"values {','.join(str(t) for t in CODONS_AMINO_ACIDS)};"
+            )
+        )
+        await session.execute(
+            text(
+                "create function bench_translate_codon(codon_in text)\n"
+                "    returns text as\n"
+                "$$\n"
+                "declare\n"
+                "    aa_out text;\n"
+                "begin\n"
+                "    if codon_in ~ '.*N.*' then\n"
+                "        select 'X' into aa_out;\n"
+                "    else\n"
+                "        select aa\n"
+                "        from bench_codon_translations\n"
+                "        where codon = codon_in\n"
+                "        into aa_out;\n"
+                "    end if;\n"
+                "    return aa_out;\n"
+                "end;\n"
+                "$$\n"
+                "    language plpgsql;"
+            )
+        )
+        # about 1% of alt codons contain an N, like real intrahost calls
+        await session.execute(
+            text(
+                'create unlogged table bench_ih_codons as\n'
+                'with codons as (\n'
+                '    select array_agg(codon) as arr from bench_codon_translations\n'
+                ')\n'
+                'select case when random() < 0.01 then \'ANT\' else arr[1 + floor(random() * 64)::int] end as alt_codon,\n'
+                '       arr[1 + floor(random() * 64)::int] as ref_codon\n'
+                'from codons, generate_series(1, :n_rows);'
+            ),
+            {'n_rows': n_rows}
+        )
+        await session.execute(text('analyze bench_ih_codons;'))
+        await session.execute(text('analyze bench_codon_translations;'))
+        await session.commit()
+
+
+async def _clean_up():
+    async with get_async_write_session() as session:
+        await session.execute(text('drop table if exists bench_translated;'))
+        await session.execute(text('drop table if exists bench_ih_codons;'))
+        await session.execute(text('drop function if exists bench_translate_codon(codon_in text);'))
+        await session.execute(text('drop table if exists bench_codon_translations;'))
+        await session.commit()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Compare the throughput of parsing collection dates with map_elements(parse_collection_start_and_end),
+which Sc2SamplesParser used to do, against parse_collection_start_and_end_expr, which it uses now.
+
+Usage: python3 -m benchmarks.collection_dates --rows 5000000
+       python3 -m benchmarks.collection_dates --file metadata.tsv --column Collection_Date
+
+Without a file, a synthetic column is generated with a mix of the formats found in NCBI metadata.
+No database is needed.
+"""
+import argparse
+import random
+import time
+
+import polars as pl
+
+from utils.dates_and_times import parse_collection_start_and_end, parse_collection_start_and_end_expr
+
+COLLECTION_DATE = 'collection_date'
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='Benchmark collection date parsing for the samples parsers')
+    argparser.add_argument('--rows', type=int, default=5_000_000, help='number of rows in the synthetic column')
+    argparser.add_argument('--file', help='read the dates from this metadata file instead of generating them')
+    argparser.add_argument('--column', default='Collection_Date', help='name of the date column within --file')
+    argparser.add_argument('--separator', default='\t', help='separator used in --file')
+    args = argparser.parse_args()
+
+    if args.file is not None:
+        dates = (
+            pl.read_csv(args.file, separator=args.separator, columns=[args.column], infer_schema=False)
+            .rename({args.column: COLLECTION_DATE})
+            .drop_nulls()
+        )
+    else:
+        dates = _generate_dates(args.rows)
+    run_benchmark(dates)
+
+
+def run_benchmark(dates: pl.DataFrame):
+    # both run lazily, as in the parser
+    print(f'parsing {dates.height} collection dates')
+
+    start = time.perf_counter()
+    by_row = dates.lazy().select(
+        pl.col(COLLECTION_DATE).map_elements(parse_collection_start_and_end, return_dtype=pl.List(pl.Date))
+    ).collect()
+    map_elements_s = time.perf_counter() - start
+    print(f'map_elements: {map_elements_s:.2f} s ({dates.height / map_elements_s:,.0f} rows/s)')
+
+    start = time.perf_counter()
+    by_expr = dates.lazy().select(
+        parse_collection_start_and_end_expr(pl.col(COLLECTION_DATE)).alias(COLLECTION_DATE)
+    ).collect()
+    expr_s = time.perf_counter() - start
+    print(f'expression:   {expr_s:.2f} s ({dates.height / expr_s:,.0f} rows/s)')
+    print(f'speedup:      {map_elements_s / expr_s:.1f}x')
+
+    same = by_row.select(
+        pl.col(COLLECTION_DATE).list.get(0).alias('start'),
+        pl.col(COLLECTION_DATE).list.get(1).alias('end')
+    ).equals(by_expr.unnest(COLLECTION_DATE))
+    print(f'results match: {same}')
+
+
+def _generate_dates(n_rows: int) -> pl.DataFrame:
+    # mostly full dates, then year-month, year only, ranges and dates with times, roughly as in NCBI metadata
+    random.seed(0)
+    templates = [
+        (0.7, '{y}-{m:02}-{d:02}'),
+        (0.15, '{y}-{m:02}'),
+        (0.1, '{y}'),
+        (0.03, '{y}-{m:02}-{d:02}/{y}-{m2:02}-{d:02}'),
+        (0.02, '{y}-{m:02}-{d:02}T15:40:34Z'),
+    ]
+    weights = [w for w, _ in templates]
+    # formatting millions of strings in python is slow, so sample from a pool of distinct values instead
+    pool = [
+        template.format(
+            y=random.randint(2019, 2025),
+            m=random.randint(1, 6),
+            m2=random.randint(7, 12),
+            d=random.randint(1, 28)
+        )
+        for template in random.choices([t for _, t in templates], weights=weights, k=100_000)
+    ]
+    return pl.DataFrame({COLLECTION_DATE: random.choices(pool, k=n_rows)})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""
+Compare the stored size of the sample bitmaps and the time of some typical queries over them before and after
+compact_sample_ids renumbers the samples by collection date.
+After compaction, the samples of a range of collection dates are also counted with rb_range_cardinality over the
+ids recorded in sample_ids_by_collection_date, against intersecting with a bitmap built from samples.
+
+Usage: python3 -m benchmarks.sample_id_compaction --runs 5 --days 90
+
+Needs the same database environment as runinserts.py, and renumbers the samples of that database for good,
+exactly as compaction.py sample_ids does, so stop the API first.
+"""
+import argparse
+import asyncio
+import datetime
+import statistics
+import time
+from typing import Dict, Tuple
+
+from sqlalchemy.sql.expression import text
+
+from DB.engine import get_async_session
+from DB.inserts.sample_ids import compact_sample_ids, SAMPLE_BITMAP_TABLES
+from DB.queries.date_count_helpers import MID_COLLECTION_DATE_CALCULATION
+from DB.structure import cache_samples_by_collection_date
+from utils.constants import TableNames, ColumnNames
+
+SIZED_TABLES = SAMPLE_BITMAP_TABLES + [TableNames.cache_samples_by_collection_date]
+
+QUERIES = {
+    'union of consensus samples': (
+        f'select rb_or_cardinality_agg({ColumnNames.samples_present})\n'
+        f'from {TableNames.cns_samples_by_allele};'
+    ),
+    'consensus samples per allele in date range': (
+        f'with in_range as (\n'
+        f'    select rb_build_agg(id) as bm\n'
+        f'    from (select id, {MID_COLLECTION_DATE_CALCULATION} from {TableNames.samples}) s\n'
+        f'    where {ColumnNames.mid_collection_date} between :start_date and :end_date\n'
+        f')\n'
+        f'select {ColumnNames.allele_id},\n'
+        f'       rb_and_cardinality({ColumnNames.samples_present}, (select bm from in_range))\n'
+        f'from {TableNames.cns_samples_by_allele};'
+    ),
+    'samples by collection week': (
+        f'select extract(year from {ColumnNames.mid_collection_date}) as year,\n'
+        f'       extract(week from {ColumnNames.mid_collection_date}) as chunk,\n'
+        f'       rb_or_cardinality_agg({ColumnNames.samples_present})\n'
+        f'from {TableNames.cache_samples_by_collection_date}\n'
+        f'group by year, chunk;'
+    ),
+}
+
+ID_RANGE_QUERY = (
+    f'with id_range as (\n'
+    f'    select min({ColumnNames.first_sample_id}) as first_id, max({ColumnNames.last_sample_id}) as last_id\n'
+    f'    from {TableNames.sample_ids_by_collection_date}\n'
+    f'    where {ColumnNames.mid_collection_date} between :start_date and :end_date\n'
+    f')\n'
+    f'select {ColumnNames.allele_id},\n'
+    f'       coalesce(rb_range_cardinality({ColumnNames.samples_present}, first_id, last_id + 1), 0)\n'
+    f'from {TableNames.cns_samples_by_allele}, id_range;'
+)
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='Benchmark renumbering samples by collection date')
+    argparser.add_argument('--runs', type=int, default=5, help='times each query is run, the median is reported')
+    argparser.add_argument('--days', type=int, default=90, help='length of the date range, ending at the latest date')
+    args = argparser.parse_args()
+
+    asyncio.run(run_benchmark(args.runs, args.days))
+
+
+async def run_benchmark(runs: int, days: int):
+    end_date = await _get_latest_collection_date()
+    if end_date is None:
+        raise ValueError('No samples with collection dates to benchmark')
+    params = {'start_date': end_date - datetime.timedelta(days=days), 'end_date': end_date}
+    # so that the before and after figures for it are both over current data
+    await cache_samples_by_collection_date.refresh()
+
+    sizes_before = await _get_sizes()
+    times_before = {name: await _time_query(query, params, runs) for name, query in QUERIES.items()}
+
+    start = time.perf_counter()
+    n_samples = await compact_sample_ids()
+    print(f'renumbered {n_samples} samples in {time.perf_counter() - start:.1f} s')
+
+    sizes_after = await _get_sizes()
+    times_after = {name: await _time_query(query, params, runs) for name, query in QUERIES.items()}
+
+    print('stored bitmap sizes (rows, bytes):')
+    for table in SIZED_TABLES:
+        n_rows, bytes_before = sizes_before[table]
+        _, bytes_after = sizes_after[table]
+        print(
+            f'  {table:<36} {n_rows:>10,} rows  {bytes_before:>16,} -> {bytes_after:>16,}'
+            f'  ({_ratio(bytes_before, bytes_after)})'
+        )
+
+    print(f'query times (median of {runs} runs, {days} day range ending {end_date}):')
+    for name in QUERIES:
+        print(
+            f'  {name:<44} {times_before[name]:>8.3f} s -> {times_after[name]:>8.3f} s'
+            f'  ({_ratio(times_before[name], times_after[name])})'
+        )
+    id_range_s = await _time_query(ID_RANGE_QUERY, params, runs)
+    name = 'consensus samples per allele in date range'
+    print(
+        f'  {name + " by id range":<44} {times_after[name]:>8.3f} s -> {id_range_s:>8.3f} s'
+        f'  ({_ratio(times_after[name], id_range_s)})'
+    )
+
+
+async def _get_latest_collection_date() -> datetime.date | None:
+    async with get_async_session() as session:
+        return await session.scalar(
+            text(
+                f'select max({ColumnNames.mid_collection_date})\n'
+                f'from (select {MID_COLLECTION_DATE_CALCULATION} from {TableNames.samples}) s;'
+            )
+        )
+
+
+async def _get_sizes() -> Dict[str, Tuple[int, int]]:
+    sizes = dict()
+    async with get_async_session() as session:
+        for table in SIZED_TABLES:
+            res = await session.execute(
+                text(f'select count(*), coalesce(sum(pg_column_size({ColumnNames.samples_present})), 0) from {table};')
+            )
+            sizes[table] = tuple(res.one())
+    return sizes
+
+
+async def _time_query(query: str, params: Dict, runs: int) -> float:
+    elapsed = []
+    async with get_async_session() as session:
+        for _ in range(runs):
+            start = time.perf_counter()
+            res = await session.execute(text(query), params)
+            res.all()
+            elapsed.append(time.perf_counter() - start)
+    return statistics.median(elapsed)
+
+
+def _ratio(before: float, after: float) -> str:
+    if after == 0:
+        return 'n/a'
+    return f'{before / after:.1f}x'
+
+
+if __name__ == '__main__':
+    main()
@@ -2,11 +2,14 @@ import argparse
 import asyncio
 from enum import StrEnum
 
-from DB.structure import cache_cns_pmv_sums
+from DB.inserts.data_generation import bump_data_generation
+from DB.inserts.sample_facets import refresh_sample_facets
+from DB.structure import cache_cns_pmv_sums, cache_samples_by_collection_date
 
 
 class Commands(StrEnum):
     create = 'create'
+    sample_facets = 'sample_facets'
 
 
 def main():
@@ -18,12 +21,29 @@ def main():
     match args.command:
         case Commands.create:
             create_caches()
+        case Commands.sample_facets:
+            refresh_facets()
         case _:
             raise ValueError(f'Not a recognized command: {args.command}')
 
 
 def create_caches():
-    asyncio.run(cache_cns_pmv_sums.create_all())
+    asyncio.run(_create_caches())
+
+
+async def _create_caches():
+    await cache_cns_pmv_sums.create_all()
+    await cache_samples_by_collection_date.refresh()
+    await bump_data_generation('caches')
+
+
+def refresh_facets():
+    asyncio.run(_refresh_sample_facets())
+
+
+async def _refresh_sample_facets():
+    print(f'{await refresh_sample_facets()} sample facet values')
+    await bump_data_generation('sample_facets')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,28 @@
+import argparse
+import asyncio
+from enum import StrEnum
+
+from DB.inserts.sample_ids import compact_sample_ids
+
+
+class Commands(StrEnum):
+    sample_ids = 'sample_ids'
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description='Muninn offline compaction. Stop the API and any ingestion before running it.'
+    )
+    argparser.add_argument('command', help=f'Options: {", ".join(Commands)}')
+
+    args = argparser.parse_args()
+
+    match args.command:
+        case Commands.sample_ids:
+            print(f'Renumbered {asyncio.run(compact_sample_ids())} samples by collection date')
+        case _:
+            raise ValueError(f'Not a recognized command: {args.command}')
+
+
+if __name__ == '__main__':
+    main()
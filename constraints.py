@@ -0,0 +1,42 @@
+import argparse
+import asyncio
+from enum import StrEnum
+
+from DB.structure.constraint_manager import ConstraintManager
+
+
+class Commands(StrEnum):
+    restore = 'restore'
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='Muninn constraint management')
+    argparser.add_argument('command', help=f'Options: {", ".join(Commands)}')
+    argparser.add_argument('connames', nargs='*', help='Names of the constraints to restore')
+    argparser.add_argument(
+        '--all-pending',
+        action='store_true',
+        help='Restore every constraint recorded as dropped, e.g. by an ingest process that died'
+    )
+
+    args = argparser.parse_args()
+
+    match args.command:
+        case Commands.restore:
+            restore_constraints(args.connames, args.all_pending)
+        case _:
+            raise ValueError(f'Not a recognized command: {args.command}')
+
+
+def restore_constraints(connames: list[str], all_pending: bool):
+    if all_pending == (len(connames) > 0):
+        raise ValueError('Give either constraint names or --all-pending')
+    if all_pending:
+        connames = asyncio.run(ConstraintManager.restore_all_pending())
+    else:
+        asyncio.run(ConstraintManager.restore_constraints(connames))
+    print(f'Restored {len(connames)} constraints: {", ".join(connames)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+from typing import List, Tuple
+
+from parser.parser import parser
+from parser.tokenizer import lexer
+from utils.constants import TableNames, ColumnNames, SAMPLE_FACET_FIELDS
+
+'''
+Compiles filters over the sample facet fields into roaring bitmap expressions over sample_facets,
+so that the samples they match can be found without scanning samples.
+
+The SQL that parser.parse emits is what a filter means: there AND binds tighter than OR, and NOT tighter than AND,
+so the tokens are parsed again here with those precedences rather than with the grammar's.
+Each expression is compiled to the bitmaps of the samples it is true for and of those it is false for. As in SQL,
+a comparison with a sample lacking a value is neither, so NOT has to swap the two rather than take a complement.
+'''
+
+_FACET_FIELDS = frozenset(f.value for f in SAMPLE_FACET_FIELDS)
+_EMPTY_BM = "rb_build('{}')"
+
+# (bitmap where true, bitmap where false)
+Compiled = Tuple[str, str]
+
+
+class _Unsupported(Exception):
+    pass
+
+
+def compile_sample_facets(where: str) -> str | None:
+    """
+    :param where: user filter
+    :return: SQL expression for the roaringbitmap of the ids of the samples matching the filter, or None if the
+    filter uses anything other than = and != between facet fields and words, which then needs evaluating over samples
+    :raises ParsingError: if the filter does not parse
+    """
+    # validates the filter, with the same errors as when it is evaluated over samples
+    parser.parse(where)
+    facet_lexer = lexer.clone()
+    facet_lexer.input(where)
+    tokens = list(iter(facet_lexer.token, None))
+    try:
+        compiled, end = _compile_or(tokens, 0)
+    except _Unsupported:
+        return None
+    if end != len(tokens):
+        return None
+    return compiled[0]
+
+
+def _compile_or(tokens: List, i: int) -> Tuple[Compiled, int]:
+    left, i = _compile_and(tokens, i)
+    while i < len(tokens) and tokens[i].type == 'OR':
+        right, i = _compile_and(tokens, i + 1)
+        left = (f'rb_or({left[0]}, {right[0]})', f'rb_and({left[1]}, {right[1]})')
+    return left, i
+
+
+def _compile_and(tokens: List, i: int) -> Tuple[Compiled, int]:
+    left, i = _compile_not(tokens, i)
+    while i < len(tokens) and tokens[i].type == 'AND':
+        right, i = _compile_not(tokens, i + 1)
+        left = (f'rb_and({left[0]}, {right[0]})', f'rb_or({left[1]}, {right[1]})')
+    return left, i
+
+
+def _compile_not(tokens: List, i: int) -> Tuple[Compiled, int]:
+    if tokens[i].type == 'NOT':
+        (true_bm, false_bm), i = _compile_not(tokens, i + 1)
+        return (false_bm, true_bm), i
+    if tokens[i].type == 'LPAREN':
+        compiled, i = _compile_or(tokens, i + 1)
+        return compiled, i + 1
+    return _compile_term(tokens, i)
+
+
+def _compile_term(tokens: List, i: int) -> Tuple[Compiled, int]:
+    field, op, value = tokens[i:i + 3]
+    # unquoted identifiers are case-insensitive in SQL
+    facet = field.value.lower()
+    if facet not in _FACET_FIELDS or value.type != 'WORD':
+        raise _Unsupported()
+    equal_bm = _get_value_bitmap(facet, value.value)
+    not_equal_bm = f'rb_andnot({_get_facet_bitmap(facet)}, {equal_bm})'
+    if op.type == 'EQUALS':
+        return (equal_bm, not_equal_bm), i + 3
+    if op.type == 'NOT_EQUALS':
+        return (not_equal_bm, equal_bm), i + 3
+    raise _Unsupported()
+
+
+def _get_value_bitmap(facet: str, value: str) -> str:
+    return (
+        f'coalesce((select {ColumnNames.samples_present} from {TableNames.sample_facets} '
+        f"where {ColumnNames.facet} = '{facet}' and {ColumnNames.value} = {_quote(value)}), {_EMPTY_BM})"
+    )
+
+
+def _get_facet_bitmap(facet: str) -> str:
+    # samples having any value for the facet
+    return (
+        f'coalesce((select rb_or_agg({ColumnNames.samples_present}) from {TableNames.sample_facets} '
+        f"where {ColumnNames.facet} = '{facet}'), {_EMPTY_BM})"
+    )
+
+
+def _quote(value: str) -> str:
+    escaped = value.replace("'", "''")
+    return f"'{escaped}'"
@@ -4,6 +4,9 @@ import sys
 from datetime import datetime
 from typing import Any
 
+from DB.inserts.data_generation import bump_data_generation
+from DB.inserts.sample_facets import refresh_sample_facets
+from DB.inserts.sample_ids import clear_sample_ids_by_collection_date
 from DB.inserts.file_parsers.dms_parser import HaRegionDmsTsvParser, HaRegionDmsCsvParser, HaRegionDmsCsvParserNewData, \
     Pb2RegionDmsCsvParser, HaRegionDmsCsvParserNeuAcVsNeuGc
 from DB.inserts.file_parsers.eve_parser import EveCsvParser
@@ -11,7 +14,7 @@ from DB.inserts.file_parsers.file_parser import FileParser
 from DB.inserts.file_parsers.flumut_annotations_parser import FlumutTsvParser
 from DB.inserts.file_parsers.freyja_demixed_lineage_hierarchy_parser import FreyjaDemixedLineageHierarchyYamlParser
 from DB.inserts.file_parsers.freyja_demixed_parser import FreyjaDemixedParser
-from DB.inserts.file_parsers.samples_parser import SamplesCsvParser, SamplesTsvParser
+from DB.inserts.file_parsers.samples_parser import SamplesCsvParser, SamplesTsvParser, SamplesParser
 from DB.inserts.file_parsers.sarscov2_parsers.dms_parser import Sc2DmsTsvParser
 from DB.inserts.file_parsers.sarscov2_parsers.eve_parser import Sc2EveCsvParser
 from DB.inserts.file_parsers.sarscov2_parsers.sc2_samples_parser import Sc2SdSamplesParser, Sc2SamplesParser, \
@@ -19,33 +22,37 @@ from DB.inserts.file_parsers.sarscov2_parsers.sc2_samples_parser import Sc2SdSam
 from DB.inserts.file_parsers.simple_lineage_parser import GenofluLineageParser, Sc2LineageParser
 from DB.inserts.file_parsers.variants_mutations_combined_parser import VariantsMutationsCombinedParser, \
     VariantsMutationsCombinedParserBig
+from DB.structure import cache_samples_by_collection_date
+
+
+# define allowed formats, give names and point to parsers
+FORMATS = {
+    'samples_csv': SamplesCsvParser,
+    'samples_tsv': SamplesTsvParser,
+    'eve_dms_csv': EveCsvParser,
+    'sc2_eve_dms_csv': Sc2EveCsvParser,
+    'genoflu_lineages': GenofluLineageParser,
+    'sc2_lineages': Sc2LineageParser,
+    'ha_dms_tsv': HaRegionDmsTsvParser,
+    'ha_dms_csv': HaRegionDmsCsvParser,
+    'pb2_dms_csv': Pb2RegionDmsCsvParser,
+    'ha_neuac_vs_neugc_dms_csv': HaRegionDmsCsvParserNeuAcVsNeuGc,
+    'sc2_dms_tsv': Sc2DmsTsvParser,
+    'freyja_demixed': FreyjaDemixedParser,
+    'variants_mutations_combined_tsv': VariantsMutationsCombinedParser,
+    'variants_mutations_combined_big_tsv': VariantsMutationsCombinedParserBig,
+    'sc2_samples': Sc2SdSamplesParser,
+    'sc2_wastewater_samples': Sc2WastewaterSamplesParser,
+    'sc2_sd_samples': Sc2SdSamplesParser,
+    'sc2_ncbi_samples': Sc2NcbiSamplesParser,
+    'flumut_tsv': FlumutTsvParser,
+    'dms_tmp_csv': HaRegionDmsCsvParserNewData,
+    'freyja_demixed_hierarchy_yaml': FreyjaDemixedLineageHierarchyYamlParser,
+}
 
 
 def main():
-    # define allowed formats, give names and point to parsers
-    formats = {
-        'samples_csv': SamplesCsvParser,
-        'samples_tsv': SamplesTsvParser,
-        'eve_dms_csv': EveCsvParser,
-        'sc2_eve_dms_csv': Sc2EveCsvParser,
-        'genoflu_lineages': GenofluLineageParser,
-        'sc2_lineages': Sc2LineageParser,
-        'ha_dms_tsv': HaRegionDmsTsvParser,
-        'ha_dms_csv': HaRegionDmsCsvParser,
-        'pb2_dms_csv': Pb2RegionDmsCsvParser,
-        'ha_neuac_vs_neugc_dms_csv': HaRegionDmsCsvParserNeuAcVsNeuGc,
-        'sc2_dms_tsv': Sc2DmsTsvParser,
-        'freyja_demixed': FreyjaDemixedParser,
-        'variants_mutations_combined_tsv': VariantsMutationsCombinedParser,
-        'variants_mutations_combined_big_tsv': VariantsMutationsCombinedParserBig,
-        'sc2_samples': Sc2SdSamplesParser,
-        'sc2_wastewater_samples': Sc2WastewaterSamplesParser,
-        'sc2_sd_samples': Sc2SdSamplesParser,
-        'sc2_ncbi_samples': Sc2NcbiSamplesParser,
-        'flumut_tsv': FlumutTsvParser,
-        'dms_tmp_csv': HaRegionDmsCsvParserNewData,
-        'freyja_demixed_hierarchy_yaml': FreyjaDemixedLineageHierarchyYamlParser,
-    }
+    formats = FORMATS
 
     ## Parse and verify args ##
     argparser = argparse.ArgumentParser(
@@ -72,6 +79,14 @@ def main():
         required=False
     )
 
+    argparser.add_argument(
+        '--resume',
+        help='Resume the last unfinished run of this format from its last completed stage. '
+             f'Only supported by {VariantsMutationsCombinedParser.__name__} formats.',
+        action='store_true',
+        required=False
+    )
+
     args = argparser.parse_args()
 
     if args.req_cols:
@@ -99,24 +114,44 @@ def main():
     ):
         raise ValueError('Multiple filenames provided, but this format takes only one.')
 
-    if parser_extras is not None and not issubclass(file_parser, VariantsMutationsCombinedParser):
+    if parser_extras is not None and not (
+            issubclass(file_parser, VariantsMutationsCombinedParser) or
+            issubclass(file_parser, Sc2SamplesParser)
+    ):
         print('Warning: this format does not except extra args, the values you passed will be ignored. ')
 
+    if args.resume and not issubclass(file_parser, VariantsMutationsCombinedParser):
+        print('Warning: this format cannot be resumed, it will be run from the start. ')
+
     # run inserts method
     start_time = datetime.now()
     print(f'{args.filenames} {args.format} start at {start_time}')
     if issubclass(file_parser, FileParser):
         if issubclass(file_parser, VariantsMutationsCombinedParser):
-            parser = file_parser(args.filenames, parser_extras)
+            parser = file_parser(args.filenames, parser_extras, resume=args.resume)
         elif issubclass(file_parser, Sc2SamplesParser) and len(args.filenames) >= 2:
-            parser = file_parser(args.filenames[0], args.filenames[1])
+            parser = file_parser(args.filenames[0], args.filenames[1], parser_extras=parser_extras)
+        elif issubclass(file_parser, Sc2SamplesParser):
+            parser = file_parser(filename, parser_extras=parser_extras)
         else:
             parser = file_parser(filename)
-        asyncio.run(parser.parse_and_insert())
+        asyncio.run(parse_and_insert(parser, args.format))
     end_time = datetime.now()
     print(f'{args.filenames} {args.format} end at {end_time}, elapsed: {end_time - start_time}')
 
 
+async def parse_and_insert(parser: FileParser, format_: str) -> None:
+    try:
+        await parser.parse_and_insert()
+    finally:
+        # even a failed run may have committed some of its data
+        if isinstance(parser, (SamplesParser, Sc2SamplesParser)):
+            await clear_sample_ids_by_collection_date()
+            await refresh_sample_facets()
+            await cache_samples_by_collection_date.refresh()
+        await bump_data_generation(format_)
+
+
 def print_req_col_info(formats: dict[str, Any]) -> None:
     for name, parser in formats.items():
         if issubclass(parser, FileParser):
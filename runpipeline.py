@@ -0,0 +1,197 @@
+import argparse
+import asyncio
+import sys
+from datetime import datetime
+from os import path
+from typing import List
+
+import yaml
+
+from DB.inserts.stages import Stage, StagePipeline, StageResult, format_stage_report, get_critical_path
+from runinserts import FORMATS
+
+# Formats are grouped by the data they need to already be in the database.
+SAMPLES = 'samples'
+VARIANTS = 'variants'
+LINEAGES = 'lineages'
+LINEAGE_HIERARCHY = 'lineage_hierarchy'
+PHENOTYPES = 'phenotypes'
+ANNOTATIONS = 'annotations'
+
+FORMAT_GROUPS = {
+    'samples_csv': SAMPLES,
+    'samples_tsv': SAMPLES,
+    'sc2_samples': SAMPLES,
+    'sc2_wastewater_samples': SAMPLES,
+    'sc2_sd_samples': SAMPLES,
+    'sc2_ncbi_samples': SAMPLES,
+    'variants_mutations_combined_tsv': VARIANTS,
+    'variants_mutations_combined_big_tsv': VARIANTS,
+    'genoflu_lineages': LINEAGES,
+    'sc2_lineages': LINEAGES,
+    'freyja_demixed': LINEAGES,
+    'freyja_demixed_hierarchy_yaml': LINEAGE_HIERARCHY,
+    'eve_dms_csv': PHENOTYPES,
+    'sc2_eve_dms_csv': PHENOTYPES,
+    'ha_dms_tsv': PHENOTYPES,
+    'ha_dms_csv': PHENOTYPES,
+    'pb2_dms_csv': PHENOTYPES,
+    'ha_neuac_vs_neugc_dms_csv': PHENOTYPES,
+    'sc2_dms_tsv': PHENOTYPES,
+    'dms_tmp_csv': PHENOTYPES,
+    'flumut_tsv': ANNOTATIONS,
+}
+
+# Entries of these groups share tables they load through, so they run one at a time, in manifest order.
+SERIAL_GROUPS = {SAMPLES, VARIANTS}
+# Entries of the same format in these groups run one after another. Lineage entries add missing lineages to the
+# same lineage system with a plain COPY, and annotation entries read the existing annotations before copying in
+# the rest, so concurrent entries would both try to add the same ones. Phenotype entries of the same format
+# upsert the same metric values; those of other formats may share metrics, which are inserted on conflict.
+SERIAL_FORMAT_GROUPS = {LINEAGES, PHENOTYPES, ANNOTATIONS}
+
+GROUP_DEPENDENCIES = {
+    SAMPLES: [],
+    VARIANTS: [SAMPLES],
+    LINEAGES: [SAMPLES],
+    # the hierarchy and the demixed lineages both add missing lineages to the same lineage system
+    LINEAGE_HIERARCHY: [LINEAGES],
+    # scores and annotations are attached to amino acids, which are created by the variants load
+    PHENOTYPES: [SAMPLES, VARIANTS],
+    ANNOTATIONS: [SAMPLES, VARIANTS],
+}
+
+
+class ManifestEntry:
+    def __init__(self, name: str, format_: str, filenames: List[str], parser_extras: List[str], resume: bool):
+        self.name = name
+        self.format = format_
+        self.filenames = filenames
+        self.parser_extras = parser_extras
+        self.resume = resume
+
+    def get_command(self) -> List[str]:
+        command = [sys.executable, '-u', 'runinserts.py', *self.filenames, '--format', self.format]
+        if len(self.parser_extras) > 0:
+            command += ['--parser_extras', *self.parser_extras]
+        if self.resume:
+            command.append('--resume')
+        return command
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description='Muninn Data Insertion Pipeline. Runs the inputs listed in a manifest, '
+                    'each as its own runinserts.py process, running independent formats concurrently.'
+    )
+    argparser.add_argument(
+        'manifest',
+        help='YAML file with a list of inputs under "inputs", each with a "format", "files", '
+             'and optionally "parser_extras" and "resume". Relative paths are resolved against the manifest.'
+    )
+    argparser.add_argument(
+        '--max_parallel',
+        help='Maximum number of parsers running at once',
+        type=int,
+        default=4
+    )
+    args = argparser.parse_args()
+
+    entries = read_manifest(args.manifest)
+    start_time = datetime.now()
+    print(f'pipeline {args.manifest} start at {start_time}')
+    asyncio.run(run_pipeline(entries, args.max_parallel))
+    end_time = datetime.now()
+    print(f'pipeline {args.manifest} end at {end_time}, elapsed: {end_time - start_time}')
+
+
+def read_manifest(filename: str) -> List[ManifestEntry]:
+    with open(filename, 'r') as f:
+        manifest = yaml.safe_load(f)
+    base_dir = path.dirname(path.abspath(filename))
+
+    entries = []
+    names = set()
+    for item in manifest['inputs']:
+        format_ = item['format']
+        if format_ not in FORMATS:
+            raise ValueError(f'Invalid format name in manifest: {format_}')
+        files = item['files'] if isinstance(item['files'], list) else [item['files']]
+        # the same format may be listed more than once, e.g. for several DMS files
+        name = format_
+        i = 2
+        while name in names:
+            name = f'{format_}_{i}'
+            i += 1
+        names.add(name)
+        entries.append(
+            ManifestEntry(
+                name,
+                format_,
+                [path.join(base_dir, f) for f in files],
+                item.get('parser_extras', []),
+                item.get('resume', False)
+            )
+        )
+    return entries
+
+
+def get_stages(entries: List[ManifestEntry]) -> List[Stage]:
+    """
+    One stage per manifest entry, depending on every entry in the groups its own group depends on,
+    and, for the serial groups, on the entries of its own group listed before it
+    (of its own format, for the groups serial by format).
+    """
+    stages = []
+    for i, entry in enumerate(entries):
+        group = FORMAT_GROUPS[entry.format]
+        depends_on = []
+        if group in SERIAL_GROUPS:
+            depends_on += [other.name for other in entries[:i] if FORMAT_GROUPS[other.format] == group]
+        elif group in SERIAL_FORMAT_GROUPS:
+            depends_on += [other.name for other in entries[:i] if other.format == entry.format]
+        depends_on += [
+            other.name for other in entries
+            if FORMAT_GROUPS[other.format] in GROUP_DEPENDENCIES[group]
+        ]
+        stages.append(Stage(entry.name, _get_runner(entry), depends_on))
+    return stages
+
+
+async def run_pipeline(entries: List[ManifestEntry], max_parallel: int):
+    stages = get_stages(entries)
+    pipeline = StagePipeline(stages, max_parallel=max_parallel)
+    results: List[StageResult] = []
+
+    async def record_result(result: StageResult):
+        results.append(result)
+
+    try:
+        await pipeline.run(on_stage_done=record_result)
+    finally:
+        if len(results) > 0:
+            print(format_stage_report(results))
+            critical_path = get_critical_path(stages, results)
+            print(f'critical path: {" -> ".join(r.name for r in critical_path)}')
+
+
+def _get_runner(entry: ManifestEntry):
+    async def run() -> None:
+        process = await asyncio.create_subprocess_exec(
+            *entry.get_command(),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            cwd=path.dirname(path.abspath(__file__))
+        )
+        # prefix output so that the logs of parsers running at the same time can be told apart
+        async for line in process.stdout:
+            print(f'[{entry.name}] {line.decode().rstrip()}')
+        returncode = await process.wait()
+        if returncode != 0:
+            raise RuntimeError(f'{entry.name} exited with code {returncode}')
+
+    return run
+
+
+if __name__ == '__main__':
+    main()
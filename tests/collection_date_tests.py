@@ -1,7 +1,9 @@
 from datetime import date
 import unittest
 
-from utils.dates_and_times import parse_collection_start_and_end
+import polars as pl
+
+from utils.dates_and_times import parse_collection_start_and_end, parse_collection_start_and_end_expr
 
 
 class TestCollectionDateParsing(unittest.TestCase):
@@ -32,4 +34,65 @@ class TestCollectionDateParsing(unittest.TestCase):
         ]
         for input_ in cases:
             print(input_)
-            self.assertRaises(ValueError, parse_collection_start_and_end, input_)
\ No newline at end of file
+            self.assertRaises(ValueError, parse_collection_start_and_end, input_)
+
+
+class TestCollectionDateParsingExpr(unittest.TestCase):
+
+    @staticmethod
+    def _parse_with_expr(inputs: list[str | None]) -> list[tuple[date, date] | None]:
+        parsed = (
+            pl.DataFrame({'collection_date': inputs}, schema={'collection_date': pl.String})
+            .select(parse_collection_start_and_end_expr(pl.col('collection_date')).alias('parsed'))
+            .unnest('parsed')
+        )
+        return [None if start is None or end is None else (start, end) for start, end in parsed.iter_rows()]
+
+    def test_valid_inputs(self):
+        cases = {
+            '2024': (date(2024, 1, 1), date(2024, 12, 31)),
+            '2025-4-16': (date(2025, 4, 16), date(2025, 4, 16)),
+            '2025-4-16T': (date(2025, 4, 16), date(2025, 4, 16)),
+            '2025-4-16/2025-5-17': (date(2025, 4, 16), date(2025, 5, 17)),
+            '2025-4-16T15:40:34/2025-5-17T15:40:34': (date(2025, 4, 16), date(2025, 5, 17)),
+            '1-1-1': (date(1, 1, 1), date(1, 1, 1)),
+        }
+        self.assertEqual(list(cases.values()), self._parse_with_expr(list(cases.keys())))
+
+    def test_expr_matches_scalar_parsing(self):
+        inputs = [
+            '2024',
+            '2025-4-16T',
+            '2025-4-16T15:40:34/2025-5-17',
+            '2025-4-16/2025-5-17T15:40:34',
+            '2025-4-16/',
+            '2025-4',
+            '2025-0',
+            '2025-1-0',
+            '/2025-4-16',
+            '2024-02',
+            '2024-2-29',
+            '2023-2-29',
+            '2023-2/2024',
+            '2024-12-31T23:59:59Z',
+            '2024 12:00',
+            '2024-13',
+            '2024-1-32',
+            '2024-1-1-1',
+            '2024/2025/2026',
+            '10000',
+            '0',
+            'missing',
+            '',
+        ]
+        expected = []
+        for input_ in inputs:
+            try:
+                expected.append(parse_collection_start_and_end(input_))
+            except ValueError:
+                expected.append(None)
+
+        self.assertEqual(expected, self._parse_with_expr(inputs))
+
+    def test_expr_passes_nulls_through(self):
+        self.assertEqual([None, (date(2024, 1, 1), date(2024, 12, 31))], self._parse_with_expr([None, '2024']))
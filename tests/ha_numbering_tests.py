@@ -0,0 +1,37 @@
+import unittest
+
+import polars as pl
+
+from utils.ha_numbering import convert_mature_h5_to_sequential, convert_mature_h5_to_sequential_expr
+
+
+class HaNumberingTests(unittest.TestCase):
+    def test_expr_matches_scalar_conversion(self):
+        positions = list(range(-20, 560))
+        expected = []
+        for p in positions:
+            try:
+                expected.append(convert_mature_h5_to_sequential(p))
+            except ValueError:
+                expected.append(None)
+
+        actual = (
+            pl.DataFrame({'position_aa': positions})
+            .select(convert_mature_h5_to_sequential_expr(pl.col('position_aa')))
+            .to_series()
+            .to_list()
+        )
+        self.assertEqual(expected, actual)
+
+    def test_expr_passes_nulls_through(self):
+        actual = (
+            pl.DataFrame({'position_aa': [None, 1]}, schema={'position_aa': pl.Int64})
+            .select(convert_mature_h5_to_sequential_expr(pl.col('position_aa')))
+            .to_series()
+            .to_list()
+        )
+        self.assertEqual([None, 17], actual)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import gzip
+import io
+import tarfile
+import tempfile
+import unittest
+import zipfile
+from os import path
+from unittest import mock
+
+import polars as pl
+
+from utils.input_files import split_archive_member, list_archive_members, find_archive_member, input_exists, \
+    open_input_text, iter_archive_members, get_polars_source, find_archive_members, MEMBER_INDEX_SUFFIX, \
+    _build_member_index
+
+MEMBERS = {
+    'outputs/metadata.tsv': b'accession\tcollection_date\nSRR1\t2024-01-01\nSRR2\t2024-02-01\n',
+    'outputs/SraRunTable_2024.tsv': b'accession\nSRR3\n',
+    'outputs/demixed/SRR1.demixed': b'lineages\tA B\nabundances\t0.5 0.5\n',
+}
+
+
+class InputFilesTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.zip_archive = path.join(self.tmp_dir.name, 'outputs.all.zip')
+        with zipfile.ZipFile(self.zip_archive, 'w') as zf:
+            for name, contents in MEMBERS.items():
+                zf.writestr(name, contents)
+            zf.writestr('outputs/variants.tsv.gz', gzip.compress(MEMBERS['outputs/metadata.tsv']))
+        self.tar_archive = path.join(self.tmp_dir.name, 'outputs.all.tar.gz')
+        with tarfile.open(self.tar_archive, 'w:gz') as tf:
+            for name, contents in MEMBERS.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(contents)
+                tf.addfile(info, io.BytesIO(contents))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_split_archive_member(self):
+        cases = {
+            'outputs.all.zip::outputs/metadata.tsv': ('outputs.all.zip', 'outputs/metadata.tsv'),
+            'a/outputs.all.tar.gz::metadata.tsv': ('a/outputs.all.tar.gz', 'metadata.tsv'),
+            'outputs.all.zip::': ('outputs.all.zip', ''),
+            'metadata.tsv': None,
+            'not_an_archive.tsv::metadata.tsv': None,
+        }
+        for k, v in cases.items():
+            self.assertEqual(v, split_archive_member(k))
+
+    def test_list_and_find(self):
+        for archive in [self.zip_archive, self.tar_archive]:
+            self.assertTrue(set(MEMBERS.keys()) <= set(list_archive_members(archive)))
+            self.assertEqual(
+                f'{archive}::outputs/SraRunTable_2024.tsv',
+                find_archive_member(archive, 'SraRunTable*.tsv')
+            )
+            # matched against the file name only, like find -name
+            self.assertIsNone(find_archive_member(archive, 'outputs*'))
+            self.assertTrue(input_exists(f'{archive}::outputs/metadata.tsv'))
+            self.assertFalse(input_exists(f'{archive}::metadata.tsv'))
+
+    def test_find_several(self):
+        for archive in [self.zip_archive, self.tar_archive]:
+            self.assertEqual(
+                [f'{archive}::outputs/SraRunTable_2024.tsv', None, f'{archive}::outputs/metadata.tsv'],
+                find_archive_members(archive, ['SraRunTable*.tsv', 'mutations*.tsv', 'meta*.tsv'])
+            )
+
+    def test_tar_member_index_reused_by_other_processes(self):
+        list_archive_members(self.tar_archive)
+        self.assertTrue(path.isfile(f'{self.tar_archive}{MEMBER_INDEX_SUFFIX}'))
+
+        # as in a new process, which finds the index next to the archive instead of reading the archive through
+        _build_member_index.cache_clear()
+        with mock.patch('utils.input_files.tarfile.open', side_effect=AssertionError('archive read again')):
+            with open_input_text(f'{self.tar_archive}::outputs/metadata.tsv') as f:
+                self.assertEqual(MEMBERS['outputs/metadata.tsv'].decode(), f.read())
+
+        # a changed archive is read again
+        with tarfile.open(self.tar_archive, 'w:gz') as tf:
+            info = tarfile.TarInfo('outputs/other.tsv')
+            info.size = 1
+            tf.addfile(info, io.BytesIO(b'1'))
+        self.assertEqual(['outputs/other.tsv'], list_archive_members(self.tar_archive))
+
+    def test_read_members(self):
+        for archive in [self.zip_archive, self.tar_archive]:
+            with open_input_text(f'{archive}::outputs/metadata.tsv') as f:
+                self.assertEqual(MEMBERS['outputs/metadata.tsv'].decode(), f.read())
+            contents = dict(iter_archive_members(archive, ['outputs/demixed/SRR1.demixed', 'outputs/missing']))
+            self.assertEqual({'outputs/demixed/SRR1.demixed': MEMBERS['outputs/demixed/SRR1.demixed']}, contents)
+            df = pl.scan_csv(get_polars_source(f'{archive}::outputs/metadata.tsv'), separator='\t').collect()
+            self.assertEqual(['SRR1', 'SRR2'], df.get_column('accession').to_list())
+
+        with open_input_text(f'{self.zip_archive}::outputs/variants.tsv.gz') as f:
+            self.assertEqual(MEMBERS['outputs/metadata.tsv'].decode(), f.read())
+
+        with self.assertRaises(FileNotFoundError):
+            open_input_text(f'{self.tar_archive}::outputs/missing')
+
+    def test_dot_prefixed_tar_members(self):
+        # as made by e.g. tar -czf outputs.all.tar.gz -C outputs .
+        for mode, suffix in [('w:gz', '.tar.gz'), ('w', '.tar')]:
+            archive = path.join(self.tmp_dir.name, f'dot_prefixed{suffix}')
+            with tarfile.open(archive, mode) as tf:
+                for name, contents in MEMBERS.items():
+                    info = tarfile.TarInfo(name.replace('outputs/', './', 1))
+                    info.size = len(contents)
+                    tf.addfile(info, io.BytesIO(contents))
+            self.assertIn('metadata.tsv', list_archive_members(archive))
+            self.assertEqual(f'{archive}::SraRunTable_2024.tsv', find_archive_member(archive, 'SraRunTable*.tsv'))
+            for member in ['metadata.tsv', './metadata.tsv']:
+                self.assertTrue(input_exists(f'{archive}::{member}'))
+                # reading stops at the end of the member rather than running on into the next one
+                with open_input_text(f'{archive}::{member}') as f:
+                    self.assertEqual(MEMBERS['outputs/metadata.tsv'].decode(), f.read())
+            contents = dict(iter_archive_members(archive, ['demixed/SRR1.demixed', 'metadata.tsv']))
+            self.assertEqual(MEMBERS['outputs/demixed/SRR1.demixed'], contents['demixed/SRR1.demixed'])
+            self.assertEqual(MEMBERS['outputs/metadata.tsv'], contents['metadata.tsv'])
+            source = get_polars_source(f'{archive}::metadata.tsv')
+            self.assertTrue(path.isfile(source))
+            self.assertEqual(['SRR1', 'SRR2'], pl.scan_csv(source, separator='\t').collect()['accession'].to_list())
+
+
+if __name__ == '__main__':
+    unittest.main()
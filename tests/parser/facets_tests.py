@@ -0,0 +1,106 @@
+import random
+import re
+import sqlite3
+import unittest
+
+from utils.errors import ParsingError
+from parser.facets import compile_sample_facets
+from parser.parser import parser
+
+HOSTS = ['cat', 'dog', 'Homo sapiens']
+COUNTRIES = ['USA', 'Canada']
+
+VALUE_BITMAP = re.compile(
+    r"coalesce\(\(select samples_present from sample_facets where facet = '(\w+)' and value = '([^']*)'\), "
+    r"rb_build\('\{\}'\)\)"
+)
+FACET_BITMAP = re.compile(
+    r"coalesce\(\(select rb_or_agg\(samples_present\) from sample_facets where facet = '(\w+)'\), "
+    r"rb_build\('\{\}'\)\)"
+)
+
+
+class TestSampleFacets(unittest.TestCase):
+
+    def setUp(self):
+        # samples with every combination of values, nulls included
+        self.samples = []
+        for host in HOSTS + [None]:
+            for country_name in COUNTRIES + [None]:
+                self.samples.append({'id': len(self.samples), 'host': host, 'country_name': country_name})
+
+    def _evaluate_compiled(self, compiled: str) -> set:
+        # stand-ins for sample_facets and the roaringbitmap functions, over python sets
+        def value_bitmap(facet, value):
+            return {s['id'] for s in self.samples if s[facet] == value}
+
+        def facet_bitmap(facet):
+            return {s['id'] for s in self.samples if s[facet] is not None}
+
+        expression = VALUE_BITMAP.sub(r"value_bitmap('\1', '\2')", compiled)
+        expression = FACET_BITMAP.sub(r"facet_bitmap('\1')", expression)
+        return eval(
+            expression,
+            {
+                'value_bitmap': value_bitmap,
+                'facet_bitmap': facet_bitmap,
+                'rb_and': lambda a, b: a & b,
+                'rb_or': lambda a, b: a | b,
+                'rb_andnot': lambda a, b: a - b,
+            }
+        )
+
+    def _evaluate_sql(self, where: str) -> set:
+        connection = sqlite3.connect(':memory:')
+        connection.execute('create table samples (id integer, host text, country_name text)')
+        connection.executemany('insert into samples values (:id, :host, :country_name)', self.samples)
+        rows = connection.execute(f'select id from samples where {parser.parse(where)}').fetchall()
+        connection.close()
+        return {r[0] for r in rows}
+
+    def test_eq_and_neq(self):
+        self.assertEqual(self._evaluate_sql('host = cat'), self._evaluate_compiled(compile_sample_facets('host = cat')))
+        # samples without a host are in neither
+        self.assertEqual(
+            self._evaluate_sql('host != cat'),
+            self._evaluate_compiled(compile_sample_facets('host != cat'))
+        )
+        self.assertEqual(
+            self._evaluate_sql('!(host = cat)'),
+            self._evaluate_compiled(compile_sample_facets('!(host = cat)'))
+        )
+
+    def test_field_names_case_insensitive(self):
+        self.assertEqual(compile_sample_facets('host = cat'), compile_sample_facets('HOST = cat'))
+
+    def test_unsupported_filters(self):
+        for where in ['bases > 1000', 'host = 5', 'host = cat ^ lineage_name = BA.2', 'collection_start_date = 2024-01-01']:
+            self.assertIsNone(compile_sample_facets(where))
+        self.assertRaises(ParsingError, compile_sample_facets, 'host == cat')
+
+    def test_matches_sql_semantics(self):
+        # AND binds tighter than OR and NOT tighter than AND in the emitted SQL, unlike in the grammar
+        random.seed(0)
+        for _ in range(500):
+            where = self._random_filter(3)
+            self.assertEqual(
+                self._evaluate_sql(where),
+                self._evaluate_compiled(compile_sample_facets(where)),
+                where
+            )
+
+    def _random_filter(self, depth: int) -> str:
+        if depth == 0 or random.random() < 0.3:
+            field, values = random.choice([('host', HOSTS), ('country_name', COUNTRIES)])
+            return f'{field} {random.choice(["=", "!="])} {random.choice(values)}'
+        match random.randrange(4):
+            case 0:
+                return f'!{self._random_filter(depth - 1)}'
+            case 1:
+                return f'({self._random_filter(depth - 1)})'
+            case _:
+                return f'{self._random_filter(depth - 1)} {random.choice(["^", "|"])} {self._random_filter(depth - 1)}'
+
+
+if __name__ == '__main__':
+    unittest.main()
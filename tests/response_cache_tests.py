@@ -0,0 +1,72 @@
+import datetime
+import unittest
+from unittest import mock
+
+from api.response_cache import ResponseCache, CachedResponse, get_cache_key
+
+
+def _response(body: bytes) -> CachedResponse:
+    return CachedResponse(200, {'content-type': 'application/json'}, body)
+
+
+class TestResponseCacheKey(unittest.TestCase):
+
+    def test_params_order_and_filter_spacing_ignored(self):
+        self.assertEqual(
+            get_cache_key('/v1/mutations:count', [('filter', 'host=Homo sapiens'), ('change_bin', 'aa')]),
+            get_cache_key('/v1/mutations:count', [('change_bin', 'aa'), ('filter', 'host = Homo sapiens')])
+        )
+
+    def test_different_requests_differ(self):
+        self.assertNotEqual(
+            get_cache_key('/v1/mutations:count', [('change_bin', 'aa')]),
+            get_cache_key('/v1/mutations:count', [('change_bin', 'nt')])
+        )
+        self.assertNotEqual(
+            get_cache_key('/v1/mutations:count', [('filter', 'host = cat')]),
+            get_cache_key('/v1/variants:count', [('filter', 'host = cat')])
+        )
+
+    def test_next_day_misses(self):
+        params = [('group_by', 'collection_date'), ('date_bin', 'day'), ('days', '7')]
+        cache = ResponseCache(max_bytes=10)
+        cache.put(1, get_cache_key('/v1/samples:count', params), _response(b'1'))
+        self.assertIsNotNone(cache.get(1, get_cache_key('/v1/samples:count', params)))
+
+        tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+        with mock.patch('api.response_cache.date', wraps=datetime.date) as date:
+            date.today.return_value = tomorrow
+            self.assertIsNone(cache.get(1, get_cache_key('/v1/samples:count', params)))
+
+    def test_invalid_filter_not_cached(self):
+        self.assertIsNone(get_cache_key('/v1/samples', [('filter', 'host = cat ^')]))
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def test_evicts_least_recently_used_by_size(self):
+        cache = ResponseCache(max_bytes=10)
+        cache.put(1, ('a',), _response(b'1234'))
+        cache.put(1, ('b',), _response(b'1234'))
+        cache.get(1, ('a',))
+        cache.put(1, ('c',), _response(b'1234'))
+        self.assertIsNotNone(cache.get(1, ('a',)))
+        self.assertIsNone(cache.get(1, ('b',)))
+        self.assertEqual(8, cache.size_bytes)
+
+        cache.put(1, ('too big',), _response(b'12345678901'))
+        self.assertIsNone(cache.get(1, ('too big',)))
+
+    def test_new_generation_clears(self):
+        cache = ResponseCache(max_bytes=10)
+        cache.put(1, ('a',), _response(b'1'))
+        self.assertIsNone(cache.get(2, ('a',)))
+        self.assertEqual(0, len(cache))
+
+        # started before the bump, finished after it
+        cache.put(1, ('a',), _response(b'1'))
+        self.assertIsNone(cache.get(2, ('a',)))
+
+
+if __name__ == '__main__':
+    unittest.main()
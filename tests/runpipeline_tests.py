@@ -0,0 +1,78 @@
+import unittest
+
+from runpipeline import ManifestEntry, get_stages
+
+
+def _entry(name: str, format_: str) -> ManifestEntry:
+    return ManifestEntry(name, format_, [f'{name}.tsv'], [], False)
+
+
+class TestPipelineStages(unittest.TestCase):
+
+    def test_dependencies_between_groups(self):
+        entries = [
+            _entry('samples', 'samples_tsv'),
+            _entry('variants', 'variants_mutations_combined_tsv'),
+            _entry('genoflu', 'genoflu_lineages'),
+            _entry('dms', 'ha_dms_tsv'),
+            _entry('flumut', 'flumut_tsv'),
+        ]
+        depends_on = {s.name: set(s.depends_on) for s in get_stages(entries)}
+        self.assertEqual(
+            {
+                'samples': set(),
+                'variants': {'samples'},
+                'genoflu': {'samples'},
+                'dms': {'samples', 'variants'},
+                'flumut': {'samples', 'variants'},
+            },
+            depends_on
+        )
+
+    def test_serial_groups_keep_manifest_order(self):
+        entries = [
+            _entry('dms', 'ha_dms_tsv'),
+            _entry('samples', 'samples_tsv'),
+            _entry('samples_2', 'samples_tsv'),
+            _entry('dms_2', 'pb2_dms_csv'),
+        ]
+        depends_on = {s.name: set(s.depends_on) for s in get_stages(entries)}
+        self.assertEqual(set(), depends_on['samples'])
+        self.assertEqual({'samples'}, depends_on['samples_2'])
+        # phenotype loads don't wait on each other
+        self.assertEqual({'samples', 'samples_2'}, depends_on['dms'])
+        self.assertEqual({'samples', 'samples_2'}, depends_on['dms_2'])
+
+    def test_lineage_entries_of_the_same_format_keep_manifest_order(self):
+        entries = [
+            _entry('samples', 'samples_tsv'),
+            _entry('genoflu', 'genoflu_lineages'),
+            _entry('pango', 'sc2_lineages'),
+            _entry('genoflu_2', 'genoflu_lineages'),
+        ]
+        depends_on = {s.name: set(s.depends_on) for s in get_stages(entries)}
+        self.assertEqual({'samples'}, depends_on['genoflu'])
+        self.assertEqual({'samples'}, depends_on['pango'])
+        self.assertEqual({'samples', 'genoflu'}, depends_on['genoflu_2'])
+
+    def test_phenotype_and_annotation_entries_of_the_same_format_keep_manifest_order(self):
+        entries = [
+            _entry('variants', 'variants_mutations_combined_tsv'),
+            _entry('ha_dms', 'ha_dms_tsv'),
+            _entry('flumut', 'flumut_tsv'),
+            _entry('ha_dms_csv', 'ha_dms_csv'),
+            _entry('ha_dms_2', 'ha_dms_tsv'),
+            _entry('flumut_2', 'flumut_tsv'),
+        ]
+        depends_on = {s.name: set(s.depends_on) for s in get_stages(entries)}
+        self.assertEqual({'variants'}, depends_on['ha_dms_csv'])
+        self.assertEqual({'variants', 'ha_dms'}, depends_on['ha_dms_2'])
+        self.assertEqual({'variants', 'flumut'}, depends_on['flumut_2'])
+
+    def test_command(self):
+        entry = ManifestEntry('variants', 'variants_mutations_combined_tsv', ['a.tsv', 'b.tsv'], ['incremental=true'], True)
+        self.assertEqual(
+            ['-u', 'runinserts.py', 'a.tsv', 'b.tsv', '--format', 'variants_mutations_combined_tsv',
+             '--parser_extras', 'incremental=true', '--resume'],
+            entry.get_command()[1:]
+        )
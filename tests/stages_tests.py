@@ -0,0 +1,48 @@
+from datetime import datetime, timedelta
+import unittest
+
+from DB.inserts.stages import Stage, StageResult, get_critical_path
+
+
+async def _noop():
+    return None
+
+
+def _result(name: str, start_minute: int, minutes: int) -> StageResult:
+    started_at = datetime(2025, 1, 1) + timedelta(minutes=start_minute)
+    return StageResult(name, started_at, started_at + timedelta(minutes=minutes), None)
+
+
+class TestCriticalPath(unittest.TestCase):
+
+    def test_longest_chain_wins(self):
+        stages = [
+            Stage('samples', _noop),
+            Stage('variants', _noop, ['samples']),
+            Stage('lineages', _noop, ['samples']),
+            Stage('dms', _noop, ['variants']),
+        ]
+        results = [
+            _result('samples', 0, 5),
+            _result('variants', 5, 30),
+            _result('lineages', 5, 20),
+            _result('dms', 35, 2),
+        ]
+        path = get_critical_path(stages, results)
+        self.assertEqual(['samples', 'variants', 'dms'], [r.name for r in path])
+
+    def test_stages_without_results_take_no_time(self):
+        stages = [
+            Stage('samples', _noop),
+            Stage('variants', _noop, ['samples']),
+            Stage('lineages', _noop, ['samples']),
+        ]
+        results = [
+            _result('variants', 0, 1),
+            _result('lineages', 0, 3),
+        ]
+        path = get_critical_path(stages, results)
+        self.assertEqual(['lineages'], [r.name for r in path])
+
+    def test_no_stages(self):
+        self.assertEqual([], get_critical_path([], []))
@@ -36,6 +36,12 @@ MIN_PREVALENCE_THRESHOLD = 0.01
 # while unrelated pairs top out around 0.56 ('cattle'/'Castor fiber' = 0.44).
 MIN_FUZZY_MATCH_SCORE = 0.7
 ASYNCPG_MAX_QUERY_ARGS = 32767
+# The API caches responses until an ingest bumps the data generation, which it checks at most this often.
+DATA_GENERATION_TTL_SECONDS = 10
+# Total size of the response bodies the API keeps cached, least recently used are evicted first.
+RESPONSE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+# Total size of the sample subset bitmaps the API keeps for reuse across endpoints.
+SAMPLE_SUBSET_CACHE_MAX_BYTES = 64 * 1024 * 1024
 
 FILTER_SYNTAX_HELP = (
     'Filter mini-language: combine terms with ^ (AND) and | (OR); negate a single term with a prefix '
@@ -54,6 +60,13 @@ NUCLEOTIDE_CHARACTERS_AMBIGUOUS = ['A', 'C', 'G', 'T', 'M', 'R', 'W', 'S', 'Y',
 CONTAINER_DATA_DIRECTORY = '/home/muninn/data'
 
 
+class IngestRunStatuses:
+    running = 'running'
+    finished = 'finished'
+    # superseded by a fresh run before it could be resumed
+    abandoned = 'abandoned'
+
+
 class PhenotypeMetricAssayTypes:
     DMS = 'DMS'
     EVE = 'EVEscape'
@@ -151,6 +164,14 @@ class DistinctValueField(Enum):
         return str(self.value)
 
 
+# The DistinctValueFields holding a single value per sample, from samples or geo_locations. Each of their values
+# is indexed in sample_facets as the bitmap of the samples having it, so filters over them need no scan of samples.
+SAMPLE_FACET_FIELDS = tuple(
+    f for f in DistinctValueField
+    if f not in {DistinctValueField.region, DistinctValueField.gff_feature, DistinctValueField.lineage_system_name}
+)
+
+
 class StandardPhenoMetricNames:
     species_sera_escape = 'species_sera_escape'
     entry_in_293t_cells = 'entry_in_293t_cells'
@@ -206,9 +227,19 @@ class TableNames(PgIdentifiers):
     cns_amino_acids_by_sample = 'cns_amino_acids_by_sample'
     ih_samples_by_allele = 'ih_samples_by_allele'
     ih_samples_by_amino_acid = 'ih_samples_by_amino_acid'
+    ih_alleles_by_sample = 'ih_alleles_by_sample'
+    ih_amino_acids_by_sample = 'ih_amino_acids_by_sample'
+    ingest_ledger = 'ingest_ledger'
+    ingest_runs = 'ingest_runs'
+    ingest_run_stages = 'ingest_run_stages'
+    dropped_constraints = 'dropped_constraints'
+    data_generation = 'data_generation'
+    sample_facets = 'sample_facets'
+    sample_ids_by_collection_date = 'sample_ids_by_collection_date'
 
     # Caches
     cache_cns_pmv_sums = 'cache_cns_pmv_sums'
+    cache_samples_by_collection_date = 'cache_samples_by_collection_date'
 
 
 class ColumnNames(PgIdentifiers):
@@ -291,6 +322,7 @@ class ColumnNames(PgIdentifiers):
     samples_present = 'samples_present'
     alleles_present = 'alleles_present'
     amino_acids_present = 'amino_acids_present'
+    alt_freq_range = 'alt_freq_range'
 
     # geo locations
     country_name = 'country_name'
@@ -301,6 +333,7 @@ class ColumnNames(PgIdentifiers):
     # phenotype metrics
     phenotype_metric_name = 'phenotype_metric_name'
     phenotype_metric_assay_type = 'phenotype_metric_assay_type'
+    value = 'value'
 
     # papers
     authors = 'authors'
@@ -320,6 +353,43 @@ class ColumnNames(PgIdentifiers):
     parent_id = 'parent_id'
     child_id = 'child_id'
 
+    # ingest ledger
+    record_type = 'record_type'
+    source_file = 'source_file'
+    content_hash = 'content_hash'
+    ingested_at = 'ingested_at'
+
+    # ingest runs
+    ingest_run_id = 'ingest_run_id'
+    parser_name = 'parser_name'
+    input_files = 'input_files'
+    status = 'status'
+    started_at = 'started_at'
+    finished_at = 'finished_at'
+    stage_name = 'stage_name'
+    row_count = 'row_count'
+
+    # dropped constraints
+    constraint_name = 'constraint_name'
+    table_name = 'table_name'
+    constraint_type = 'constraint_type'
+    constraint_def = 'constraint_def'
+    index_def = 'index_def'
+    dropped_at = 'dropped_at'
+
+    # data generation
+    source = 'source'
+    bumped_at = 'bumped_at'
+
+    # sample facets
+    facet = 'facet'
+
+    # samples by collection date
+    mid_collection_date = 'mid_collection_date'
+    collection_span = 'collection_span'
+    first_sample_id = 'first_sample_id'
+    last_sample_id = 'last_sample_id'
+
 
 class ConstraintNames(PgIdentifiers):
     # primary keys
@@ -345,9 +415,19 @@ class ConstraintNames(PgIdentifiers):
     pk_cns_amino_acids_by_sample = f'pk_{TableNames.cns_amino_acids_by_sample}'
     pk_ih_samples_by_allele = f'pk_{TableNames.ih_samples_by_allele}'
     pk_ih_samples_by_amino_acid = f'pk_{TableNames.ih_samples_by_amino_acid}'
+    pk_ih_alleles_by_sample = f'pk_{TableNames.ih_alleles_by_sample}'
+    pk_ih_amino_acids_by_sample = f'pk_{TableNames.ih_amino_acids_by_sample}'
+    pk_ingest_ledger = f'pk_{TableNames.ingest_ledger}'
+    pk_ingest_runs = f'pk_{TableNames.ingest_runs}'
+    pk_ingest_run_stages = f'pk_{TableNames.ingest_run_stages}'
+    pk_dropped_constraints = f'pk_{TableNames.dropped_constraints}'
+    pk_data_generation = f'pk_{TableNames.data_generation}'
+    pk_sample_facets = f'pk_{TableNames.sample_facets}'
+    pk_sample_ids_by_collection_date = f'pk_{TableNames.sample_ids_by_collection_date}'
 
     # samples
     uq_samples_accession = 'uq_samples_accession'
+    uq_cache_samples_by_collection_date = f'uq_{TableNames.cache_samples_by_collection_date}'
     fk_samples_geo_location_id_geo_locations = 'fk_samples_geo_location_id_geo_locations'
     ck_samples_retraction_values_existence_in_harmony = 'ck_samples_retraction_values_existence_in_harmony'
     ck_samples_collection_start_and_end_both_absent_or_both_present = 'ck_samples_collection_start_and_end_both_absent_or_both_present'
@@ -366,6 +446,9 @@ class ConstraintNames(PgIdentifiers):
     ck_amino_acids_ref_codon_not_empty = 'ck_amino_acids_ref_codon_not_empty'
     uq_amino_acids_gff_feature_position_alt_aa_alt_codon = 'uq_amino_acids_gff_feature_position_alt_aa_alt_codon'
 
+    # samples lineages
+    fk_samples_lineages_sample_id_samples = 'fk_samples_lineages_sample_id_samples'
+
     # intra host variants
     fk_intra_host_variants_allele_id_alleles = 'fk_intra_host_variants_allele_id_alleles'
     fk_intra_host_variants_sample_id_samples = 'fk_intra_host_variants_sample_id_samples'
@@ -382,9 +465,18 @@ class ConstraintNames(PgIdentifiers):
     # consensus samples by amino acid
     fk_cns_samples_by_amino_acid_amino_acid_id_amino_acids = 'fk_cns_samples_by_amino_acid_amino_acid_id_amino_acids'
 
+    # consensus alleles by sample
+    fk_cns_alleles_by_sample_sample_id_samples = 'fk_alleles_by_sample_sample_id_samples'
+
     # consensus amino acids by sample
     fk_cns_amino_acids_by_sample_sample_id_samples = 'fk_cns_amino_acids_by_sample_sample_id_samples'
 
+    # intrahost alleles by sample
+    fk_ih_alleles_by_sample_sample_id_samples = 'fk_ih_alleles_by_sample_sample_id_samples'
+
+    # intrahost amino acids by sample
+    fk_ih_amino_acids_by_sample_sample_id_samples = 'fk_ih_amino_acids_by_sample_sample_id_samples'
+
     # phenotype metrics tables
     uq_phenotype_metrics_name = 'uq_phenotype_metrics_name'
     ck_phenotype_metrics_name_not_empty = 'ck_phenotype_metrics_name_not_empty'
@@ -404,6 +496,9 @@ class ConstraintNames(PgIdentifiers):
     uq_lineages_immediate_children_parent_child = f'uq_{TableNames.lineages_immediate_children}_parent_child'
     ck_lineages_immediate_children_no_self_parenthood = f'ck_{TableNames.lineages_immediate_children}_no_self_parenthood'
 
+    # ingest runs
+    fk_ingest_run_stages_ingest_run_id_ingest_runs = 'fk_ingest_run_stages_ingest_run_id_ingest_runs'
+
     # annotations tables
     uq_papers_authors_title_year = 'uq_papers_authors_title_year'
     uq_effects_detail = 'uq_effects_detail'
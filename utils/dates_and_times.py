@@ -3,6 +3,8 @@ import datetime
 import re
 from datetime import date
 
+import polars as pl
+
 
 def parse_collection_start_and_end(datestr: str) -> tuple[date, date]:
     """
@@ -58,6 +60,53 @@ def parse_collection_start_and_end(datestr: str) -> tuple[date, date]:
     return d0, d1
 
 
+# year from 1 to 9999, optionally followed by month and day, then any time, which is discarded. to_date rejects
+# numbers padded beyond four digits for the year or two for the month and day, as well as months and days that
+# don't exist, so those don't need checking here
+_DATE_PATTERN = r'^((?:[1-9][0-9]{0,3}|0[1-9][0-9]{0,2}|00[1-9][0-9]?|000[1-9])(?:-[0-9]{1,2}){0,2})(?:[T ][^/]*)?$'
+_DATE_FORMAT = '%Y-%m-%d'
+
+
+def parse_collection_start_and_end_expr(datestr: pl.Expr) -> pl.Expr:
+    """
+    Column-wise version of parse_collection_start_and_end.
+    Strings that parse_collection_start_and_end would reject get a null start, end, or both, instead of raising.
+    Unlike int(), only ASCII digits are accepted within dates, without signs, surrounding whitespace or padding
+    beyond four digits for the year and two for the month and day, e.g. 2024-004-01 is rejected.
+    :param datestr: String expression of collection dates
+    :return: struct expression with Date fields start and end
+    """
+    # each step is a single pass over the strings, and references are kept to a minimum,
+    # as polars evaluates every reference to a subexpression separately
+    parts = datestr.str.split('/')
+    n_parts = parts.list.len()
+    raw_end = (
+        pl.when(n_parts == 1).then(parts.list.first())
+        .when(n_parts == 2).then(parts.list.get(1, null_on_oob=True))
+    )
+    start = (
+        _clean_date_expr(parts.list.first())
+        .str.replace(r'^([0-9]+)$', '${1}-1-1')
+        .str.replace(r'^([0-9]+-[0-9]+)$', '${1}-1')
+        .str.to_date(_DATE_FORMAT, strict=False)
+    )
+    end = _clean_date_expr(raw_end).str.replace(r'^([0-9]+)$', '${1}-12')
+    # full dates parse as they are, year-months run to the end of the month
+    end = pl.coalesce(
+        end.str.to_date(_DATE_FORMAT, strict=False),
+        (end + '-1').str.to_date(_DATE_FORMAT, strict=False).dt.month_end()
+    )
+    return pl.struct(start.alias('start'), end.alias('end'))
+
+
+def _clean_date_expr(raw: pl.Expr) -> pl.Expr:
+    """
+    :param raw: one side of a collection date range, e.g. 2024, 2024-04 or 2024-04-16T15:40:34
+    :return: the date without any time, null if it doesn't match _DATE_PATTERN
+    """
+    return raw.str.extract(_DATE_PATTERN, 1)
+
+
 def format_iso_week(year: int, week: int):
     """
     Put year and week number into iso format.
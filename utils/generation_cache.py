@@ -0,0 +1,39 @@
+from typing import Any, Callable, Hashable
+
+from cachetools import LRUCache
+
+
+class GenerationCache:
+    """
+    LRU cache bounded by the total size of its values. Entries belong to the data generation they were
+    computed under, and are all dropped as soon as a caller sees a newer generation.
+    """
+
+    def __init__(self, max_bytes: int, getsizeof: Callable[[Any], int]):
+        self.max_bytes = max_bytes
+        self._getsizeof = getsizeof
+        self._generation: int | None = None
+        self._values: LRUCache = LRUCache(maxsize=max_bytes, getsizeof=getsizeof)
+
+    def get(self, generation: int, key: Hashable) -> Any | None:
+        self._check_generation(generation)
+        return self._values.get(key)
+
+    def put(self, generation: int, key: Hashable, value: Any) -> None:
+        self._check_generation(generation)
+        # drop values computed for callers that started before an ingest finished, they may hold the older data
+        if generation != self._generation or self._getsizeof(value) > self.max_bytes:
+            return
+        self._values[key] = value
+
+    def __len__(self):
+        return len(self._values)
+
+    @property
+    def size_bytes(self) -> int:
+        return self._values.currsize
+
+    def _check_generation(self, generation: int) -> None:
+        if self._generation is None or generation > self._generation:
+            self._values.clear()
+            self._generation = generation
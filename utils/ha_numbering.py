@@ -1,3 +1,6 @@
+import polars as pl
+
+
 def convert_mature_h5_to_sequential(position_aa: int) -> int:
     # mapping based on https://github.com/dms-vep/Flu_H5_American-Wigeon_South-Carolina_2021-H5N1_DMS/raw/refs/heads/main/data/site_numbering_map.csv
     if -16 <= position_aa <= -1:
@@ -7,3 +10,14 @@ def convert_mature_h5_to_sequential(position_aa: int) -> int:
     else:
         raise ValueError(f'{position_aa} is not recognized as a mature H5 site.')
 
+
+def convert_mature_h5_to_sequential_expr(position_aa: pl.Expr) -> pl.Expr:
+    """
+    Column-wise version of convert_mature_h5_to_sequential.
+    Positions that aren't recognized as mature H5 sites become null instead of raising.
+    """
+    return (
+        pl.when(position_aa.is_between(-16, -1)).then(position_aa + 17)
+        .when(position_aa.is_between(1, 552)).then(position_aa + 16)
+        .otherwise(None)
+    )
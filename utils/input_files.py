@@ -0,0 +1,278 @@
+import atexit
+import functools
+import json
+import shutil
+import tempfile
+from fnmatch import fnmatch
+from os import path, replace, stat
+from typing import IO, Dict, Iterable, Iterator, List, NamedTuple, Tuple
+import gzip
+import io
+import tarfile
+import zipfile
+
+import zstandard
+
+COMPRESSED_SUFFIXES = ('.gz', '.zst')
+ZIP_SUFFIXES = ('.zip',)
+TAR_SUFFIXES = ('.tar', '.tar.gz', '.tgz')
+# Separates an archive from the path of a file within it, e.g. outputs.all.zip::outputs/metadata.tsv
+ARCHIVE_MEMBER_SEPARATOR = '::'
+# Written next to a tar archive, so that every process reading from it can skip building its member index
+MEMBER_INDEX_SUFFIX = '.members.json'
+
+
+def is_compressed(filename: str) -> bool:
+    return filename.endswith(COMPRESSED_SUFFIXES)
+
+
+def split_archive_member(filename: str) -> Tuple[str, str] | None:
+    """
+    :param filename: input path, possibly of the form <archive>::<member>
+    :return: (archive path, member path) if filename names a file within a zip or tar archive, else None
+    """
+    archive, separator, member = filename.partition(ARCHIVE_MEMBER_SEPARATOR)
+    if separator == '' or not archive.endswith(ZIP_SUFFIXES + TAR_SUFFIXES):
+        return None
+    return archive, member
+
+
+def is_archive_member(filename: str) -> bool:
+    return split_archive_member(filename) is not None
+
+
+class _TarMember(NamedTuple):
+    offset: int
+    size: int
+
+
+def _normalize_member(member: str) -> str:
+    # tar archives made with e.g. `tar -C dir .` store their members as ./<name>
+    while member.startswith('./'):
+        member = member[2:]
+    return member.lstrip('/')
+
+
+def _get_member_index(archive: str) -> Dict[str, _TarMember | zipfile.ZipInfo]:
+    """
+    The regular files within an archive by normalized name, read once per process and archive version.
+    For compressed tar archives, building it has to decompress the archive once, as they have no index of their own,
+    so the index of a tar archive is also kept in <archive>.members.json for other processes to reuse.
+    """
+    st = stat(archive)
+    return _build_member_index(archive, st.st_mtime_ns, st.st_size)
+
+
+@functools.lru_cache(maxsize=None)
+def _build_member_index(archive: str, mtime_ns: int, size: int) -> Dict[str, _TarMember | zipfile.ZipInfo]:
+    if archive.endswith(ZIP_SUFFIXES):
+        with zipfile.ZipFile(archive) as zf:
+            return {_normalize_member(info.filename): info for info in zf.infolist() if not info.is_dir()}
+    index_file = f'{archive}{MEMBER_INDEX_SUFFIX}'
+    index = _read_member_index_file(index_file, mtime_ns, size)
+    if index is None:
+        with tarfile.open(archive, 'r:*') as tf:
+            index = {
+                _normalize_member(info.name): _TarMember(info.offset_data, info.size)
+                for info in tf.getmembers()
+                if info.isfile()
+            }
+        _write_member_index_file(index_file, mtime_ns, size, index)
+    return index
+
+
+def _read_member_index_file(index_file: str, mtime_ns: int, size: int) -> Dict[str, _TarMember] | None:
+    try:
+        with open(index_file) as f:
+            saved = json.load(f)
+        if saved['mtime_ns'] != mtime_ns or saved['size'] != size:
+            return None
+        return {member: _TarMember(*info) for member, info in saved['members'].items()}
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _write_member_index_file(index_file: str, mtime_ns: int, size: int, index: Dict[str, _TarMember]):
+    # written under a name of its own first, so that a process reading it never sees half of it
+    try:
+        with tempfile.NamedTemporaryFile(
+            'w', dir=path.dirname(path.abspath(index_file)), suffix='.tmp', delete=False
+        ) as f:
+            json.dump({'mtime_ns': mtime_ns, 'size': size, 'members': index}, f)
+        replace(f.name, index_file)
+    except OSError:
+        # e.g. the archive's directory is read only, every process then builds the index itself
+        pass
+
+
+def _open_tar_data(archive: str) -> IO[bytes]:
+    # seeking forward in a gzip file decompresses up to the offset, but never back from the start of the archive
+    if archive.endswith('.tar'):
+        return open(archive, 'rb')
+    return gzip.open(archive, 'rb')
+
+
+def list_archive_members(archive: str) -> List[str]:
+    """
+    List the regular files within an archive, without extracting anything.
+    Names are given without any leading ./, and are looked up the same way.
+    """
+    return list(_get_member_index(archive).keys())
+
+
+def find_archive_member(archive: str, pattern: str) -> str | None:
+    """
+    Archive equivalent of `find <dir> -type f -name <pattern> | head -1`.
+    :return: <archive>::<member> for the first member whose basename matches the pattern, or None
+    """
+    return find_archive_members(archive, [pattern])[0]
+
+
+def find_archive_members(archive: str, patterns: List[str]) -> List[str | None]:
+    """
+    find_archive_member for several patterns, reading the archive's members only once.
+    :return: for each pattern, <archive>::<member> for the first member whose basename matches it, or None
+    """
+    members = list_archive_members(archive)
+    found = []
+    for pattern in patterns:
+        match = next((m for m in members if fnmatch(path.basename(m), pattern)), None)
+        found.append(None if match is None else f'{archive}{ARCHIVE_MEMBER_SEPARATOR}{match}')
+    return found
+
+
+def input_exists(filename: str) -> bool:
+    parts = split_archive_member(filename)
+    if parts is None:
+        return path.isfile(filename)
+    archive, member = parts
+    return path.isfile(archive) and _normalize_member(member) in _get_member_index(archive)
+
+
+def open_input_binary(filename: str) -> IO[bytes]:
+    """
+    Open an input file, or a file within a zip or tar archive, for reading as bytes.
+    Archive members are streamed out of the archive rather than extracted to disk.
+    """
+    parts = split_archive_member(filename)
+    if parts is None:
+        return open(filename, 'rb')
+    archive, member = parts
+    info = _get_member_index(archive).get(_normalize_member(member))
+    if info is None:
+        raise FileNotFoundError(f'{member} not found in {archive}')
+    if archive.endswith(ZIP_SUFFIXES):
+        zf = zipfile.ZipFile(archive)
+        # the member keeps the archive's file open until it is closed itself
+        f = zf.open(info)
+        zf.close()
+        return f
+    # the index gives where the member's data starts, so the tar headers before it need not be read again
+    data = _open_tar_data(archive)
+    data.seek(info.offset)
+    return io.BufferedReader(_ClosingReader(data, size=info.size))
+
+
+def iter_archive_members(archive: str, members: Iterable[str]) -> Iterator[Tuple[str, bytes]]:
+    """
+    Read the contents of many members of an archive in a single pass over it.
+    :return: (member, contents) for each of the given members found, in archive order
+    """
+    index = _get_member_index(archive)
+    found = [(member, index[_normalize_member(member)]) for member in members if _normalize_member(member) in index]
+    if archive.endswith(ZIP_SUFFIXES):
+        with zipfile.ZipFile(archive) as zf:
+            for member, info in sorted(found, key=lambda m: m[1].header_offset):
+                yield member, zf.read(info)
+        return
+    # in order of offset, so that a compressed archive is only ever read forward
+    with _open_tar_data(archive) as data:
+        for member, info in sorted(found, key=lambda m: m[1].offset):
+            data.seek(info.offset)
+            yield member, data.read(info.size)
+
+
+def open_input_decompressed(filename: str) -> IO[bytes]:
+    """
+    Open an input file for reading as bytes, transparently decompressing gzip (.gz) and zstandard (.zst) files.
+    The file may also be a member of a zip or tar archive, given as <archive>::<member>.
+    :param filename: path to the input file
+    :return: binary file object
+    """
+    parts = split_archive_member(filename)
+    binary = open_input_binary(filename)
+    name = filename if parts is None else parts[1]
+    if name.endswith('.gz'):
+        return io.BufferedReader(_ClosingReader(gzip.GzipFile(fileobj=binary), binary))
+    if name.endswith('.zst'):
+        return io.BufferedReader(_ClosingReader(zstandard.ZstdDecompressor().stream_reader(binary, closefd=True)))
+    return binary
+
+
+def open_input_text(filename: str) -> IO[str]:
+    """
+    Open an input file as text, transparently decompressing gzip (.gz) and zstandard (.zst) files.
+    The file may also be a member of a zip or tar archive, given as <archive>::<member>.
+    Newlines are left untranslated so that the result can be handed directly to the csv module.
+    :param filename: path to the input file
+    :return: text file object
+    """
+    return io.TextIOWrapper(open_input_decompressed(filename), newline='')
+
+
+def get_polars_source(filename: str) -> str:
+    """
+    :return: path to hand polars' read or scan functions for the given input, so that it can scan it lazily.
+    Archive members are copied out to a temporary file first, once per process, rather than read into memory.
+    The temporary files are removed when the process exits.
+    """
+    if not is_archive_member(filename):
+        return filename
+    return _extract_to_temp_file(filename)
+
+
+@functools.lru_cache(maxsize=None)
+def _extract_to_temp_file(filename: str) -> str:
+    member = split_archive_member(filename)[1]
+    # keeps the member's file name, suffix included, for anything that goes by it
+    extracted = path.join(tempfile.mkdtemp(dir=_get_extract_dir()), path.basename(member))
+    with open_input_binary(filename) as src, open(extracted, 'wb') as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    return extracted
+
+
+@functools.lru_cache(maxsize=None)
+def _get_extract_dir() -> str:
+    extract_dir = tempfile.mkdtemp(prefix='muninn_archive_members_')
+    atexit.register(shutil.rmtree, extract_dir, ignore_errors=True)
+    return extract_dir
+
+
+class _ClosingReader(io.RawIOBase):
+    """
+    Raw stream over a file object that also closes the objects it was read out of, e.g. its archive.
+    If a size is given, it ends after that many bytes, e.g. at the end of an archive member.
+    """
+
+    def __init__(self, f: IO[bytes], *owners, size: int | None = None):
+        self._f = f
+        self._owners = owners
+        self._remaining = size
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        n = len(b) if self._remaining is None else min(len(b), self._remaining)
+        data = self._f.read(n)
+        b[:len(data)] = data
+        if self._remaining is not None:
+            self._remaining -= len(data)
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self._f.close()
+            for owner in self._owners:
+                owner.close()
+        super().close()